@@ -0,0 +1,169 @@
+from array import array
+from global_modules.bank import credits_step, deposits_step
+from global_modules.load_config import ALL_CONFIGS, Reputation
+from modules.db import just_db
+from modules.websocket_manager import websocket_manager
+
+REPUTATION: Reputation = ALL_CONFIGS['reputation']
+
+CREDIT_FIELDS = ("total_to_pay", "need_pay", "paid", "steps_now", "steps_total")
+DEPOSIT_FIELDS = ("current_balance", "total_earned", "income_per_turn",
+                  "steps_now", "steps_total", "can_withdraw_from")
+
+
+class InstrumentTable:
+    """ Кредиты или вклады всех компаний сессии в столбцах.
+
+        Строка i - один инструмент: owner[i] - id компании,
+        slot[i] - его индекс в списке компании, числовые поля -
+        по столбцу array('q') на поле.
+    """
+
+    def __init__(self, fields: tuple[str, ...]):
+        self.fields = fields
+        self.owner = array('q')
+        self.slot = array('q')
+        self.columns: dict[str, array] = {field: array('q') for field in fields}
+        self.docs: list[dict] = []
+
+    def append(self, company_id: int, slot: int, doc: dict):
+        self.owner.append(company_id)
+        self.slot.append(slot)
+        for field in self.fields:
+            self.columns[field].append(int(doc.get(field, 0)))
+        self.docs.append(doc)
+
+    def __len__(self) -> int:
+        return len(self.owner)
+
+    def row(self, i: int) -> dict:
+        """ Документ инструмента с обновлёнными значениями столбцов """
+        return {**self.docs[i],
+                **{field: self.columns[field][i] for field in self.fields}}
+
+
+class BankEngine:
+    """ Вклады и кредиты всех компаний сессии за ход.
+
+        Инструменты загружаются одним запросом в столбцы, правила банка
+        (global_modules.bank.deposits_step / credits_step) применяются
+        ко всем строкам разом, затем каждая затронутая компания
+        записывается одним запросом, а клиентам после коммита уходит 
+        одно событие api-bank_step. Без replica set записи компаний 
+        компенсируются через on_rollback.
+    """
+
+    async def step(self, session) -> dict:
+        """ Ход банка сессии. Возвращает сводку хода """
+        from game.company import Company
+
+        companies: list[dict] = await just_db.find(
+            Company.__tablename__, session_id=session.session_id,
+            projection=["id", "credits", "deposits",
+                        "reputation", "in_prison"]) # type: ignore
+        companies = [c for c in companies
+                     if c.get("credits") or c.get("deposits")]
+        companies.sort(key=lambda c: c["id"])
+
+        credits = InstrumentTable(CREDIT_FIELDS)
+        deposits = InstrumentTable(DEPOSIT_FIELDS)
+        for company in companies:
+            for slot, credit in enumerate(company.get("credits") or []):
+                credits.append(company["id"], slot, credit)
+            for slot, deposit in enumerate(company.get("deposits") or []):
+                deposits.append(company["id"], slot, deposit)
+
+        columns = deposits.columns
+        matured = deposits_step(
+            columns["current_balance"], columns["total_earned"],
+            columns["income_per_turn"], columns["steps_now"], columns["steps_total"])
+
+        columns = credits.columns
+        overdue, prison = credits_step(
+            columns["total_to_pay"], columns["need_pay"], columns["paid"],
+            columns["steps_now"], columns["steps_total"],
+            REPUTATION.credit.max_overdue)
+
+        in_prison = {c["id"] for c in companies if c.get("in_prison")}
+        # Вклад забирается по окончании срока, если компания не в тюрьме
+        # и уже можно снимать деньги (иначе - на следующем ходу)
+        withdrawn: dict[int, int] = {}
+        removed_deposits: set[int] = set()
+        for i in matured:
+            company_id = deposits.owner[i]
+            if company_id in in_prison or \
+                    session.step < deposits.columns["can_withdraw_from"][i]:
+                continue
+            amount = deposits.columns["current_balance"][i]
+            withdrawn[company_id] = withdrawn.get(company_id, 0) + amount
+            removed_deposits.add(i)
+
+        penalties: dict[int, int] = {}
+        for i in overdue:
+            company_id = credits.owner[i]
+            penalties[company_id] = penalties.get(company_id, 0) + REPUTATION.credit.lost
+        to_prison = {credits.owner[i] for i in prison}
+
+        rows_credits: dict[int, list[dict]] = {}
+        for i in range(len(credits)):
+            rows_credits.setdefault(credits.owner[i], []).append(credits.row(i))
+        rows_deposits: dict[int, list[dict]] = {}
+        for i in range(len(deposits)):
+            if i in removed_deposits: continue
+            rows_deposits.setdefault(deposits.owner[i], []).append(deposits.row(i))
+
+        summary: dict[str, list] = {"companies": [], "withdrawn": [], "to_prison": []}
+        for company in companies:
+            company_id = company["id"]
+            reputation = company.get("reputation", 0)
+            new_reputation = max(0, reputation - penalties.get(company_id, 0))
+
+            document = await just_db.inc(
+                Company.__tablename__, {"id": company_id},
+                {"balance": withdrawn.get(company_id, 0)}, None, {
+                    "credits": rows_credits.get(company_id, []),
+                    "deposits": rows_deposits.get(company_id, []),
+                    "reputation": new_reputation
+                })
+            if document is None: continue
+            await just_db.on_rollback(
+                lambda company=company: just_db.inc(
+                    Company.__tablename__, {"id": company["id"]},
+                    {"balance": -withdrawn.get(company["id"], 0)}, None, {
+                        "credits": company.get("credits") or [],
+                        "deposits": company.get("deposits") or [],
+                        "reputation": company.get("reputation", 0)
+                    }))
+
+            summary["companies"].append({
+                "company_id": company_id,
+                "credits": len(rows_credits.get(company_id, [])),
+                "deposits": len(rows_deposits.get(company_id, [])),
+                "new_balance": document["balance"],
+                "new_reputation": new_reputation
+            })
+            if company_id in withdrawn:
+                summary["withdrawn"].append({
+                    "company_id": company_id, "amount": withdrawn[company_id]})
+
+            if new_reputation != reputation and \
+                    new_reputation <= REPUTATION.prison.on_reputation:
+                to_prison.add(company_id)
+
+        for company_id in sorted(to_prison):
+            company = await Company(id=company_id).reupdate()
+            if company.in_prison: continue
+            await company.to_prison()
+            summary["to_prison"].append(company_id)
+
+        await just_db.on_commit(lambda: websocket_manager.broadcast({
+            "type": "api-bank_step",
+            "data": {
+                "session_id": session.session_id,
+                "step": session.step,
+                **summary
+            }
+        }))
+        return summary
+
+bank_engine = BankEngine()
@@ -0,0 +1,143 @@
+from typing import Optional, TYPE_CHECKING
+from global_modules.load_config import ALL_CONFIGS
+from global_modules.models.cells import Cells
+
+if TYPE_CHECKING:
+    from game.session import Session
+
+cells: Cells = ALL_CONFIGS['cells']
+
+# Таблица кодов типов клеток: код - индекс в списке (0 - пустая клетка)
+CELL_CODES: list[str] = ['null', *cells.types]
+CELL_INDEX: dict[str, int] = {key: code for code, key in enumerate(CELL_CODES)}
+
+
+class CellMap:
+    """ Компактная карта сессии: по одному байту (коду типа) на клетку.
+
+        Для подсчёта клеток каждого типа в квадрате вокруг точки строятся
+        (по требованию) таблицы префиксных сумм, поэтому запрос выполняется
+        за O(число типов) независимо от радиуса и размера карты.
+    """
+
+    def __init__(self, rows: int, cols: int,
+                 data: Optional[bytearray] = None):
+        self.rows = rows
+        self.cols = cols
+        self.data = data if data is not None else bytearray(rows * cols)
+        self._prefix: dict[int, list[int]] = {}
+
+    @classmethod
+    def from_cells(cls, cells_list: list[str], rows: int, cols: int) -> 'CellMap':
+        """ Из списка ключей типов клеток (формат Session.cells) """
+        data = bytearray(CELL_INDEX.get(key, 0) for key in cells_list[:rows * cols])
+        data.extend(bytes(rows * cols - len(data)))
+        return cls(rows, cols, data)
+
+    def to_cells(self) -> list[str]:
+        """ В список ключей типов клеток (формат Session.cells) """
+        return [CELL_CODES[code] for code in self.data]
+
+    def index(self, x: int, y: int) -> int:
+        return x * self.cols + y
+
+    def get(self, x: int, y: int) -> str:
+        return CELL_CODES[self.data[self.index(x, y)]]
+
+    def set(self, x: int, y: int, cell_key: str):
+        self.data[self.index(x, y)] = CELL_INDEX[cell_key]
+        self._prefix.clear()
+
+    def indices_of(self, cell_key: str) -> list[int]:
+        """ Индексы всех клеток типа """
+        code = CELL_INDEX[cell_key]
+        return [i for i, c in enumerate(self.data) if c == code]
+
+    def counts(self) -> dict[str, int]:
+        """ Количество клеток каждого встречающегося типа """
+        result = {}
+        for code, key in enumerate(CELL_CODES):
+            count = self.data.count(code)
+            if count: result[key] = count
+        return result
+
+    def _prefix_sums(self, code: int) -> list[int]:
+        """ Таблица префиксных сумм (rows + 1) x (cols + 1) для типа клетки """
+        table = self._prefix.get(code)
+        if table is not None: return table
+
+        width = self.cols + 1
+        table = [0] * ((self.rows + 1) * width)
+        for x in range(self.rows):
+            row_sum = 0
+            row = self.data[x * self.cols:(x + 1) * self.cols]
+            for y, c in enumerate(row):
+                row_sum += c == code
+                table[(x + 1) * width + y + 1] = table[x * width + y + 1] + row_sum
+
+        self._prefix[code] = table
+        return table
+
+    def window_count(self, cell_key: str,
+                     x: int, y: int, radius: int) -> int:
+        """ Количество клеток типа в квадрате радиуса radius вокруг (x, y)
+            (сама клетка (x, y) не учитывается)
+        """
+        code = CELL_INDEX.get(cell_key)
+        if code is None: return 0
+
+        x0, x1 = max(0, x - radius), min(self.rows - 1, x + radius)
+        y0, y1 = max(0, y - radius), min(self.cols - 1, y + radius)
+        if x0 > x1 or y0 > y1: return 0
+
+        table = self._prefix_sums(code)
+        width = self.cols + 1
+        total = (table[(x1 + 1) * width + y1 + 1] - table[x0 * width + y1 + 1]
+                 - table[(x1 + 1) * width + y0] + table[x0 * width + y0])
+
+        if 0 <= x < self.rows and 0 <= y < self.cols and self.data[self.index(x, y)] == code:
+            total -= 1
+        return total
+
+    def rows_chunk(self, start_row: int, rows: int) -> dict:
+        """ Часть карты из строк [start_row, start_row + rows)
+            для постраничной передачи больших карт
+        """
+        start_row = max(0, start_row)
+        end_row = min(self.rows, start_row + max(rows, 0))
+
+        return {
+            "rows": self.rows,
+            "cols": self.cols,
+            "start_row": start_row,
+            "end_row": end_row,
+            "cells": [CELL_CODES[code] for code in
+                      self.data[start_row * self.cols:end_row * self.cols]],
+            "next_row": end_row if end_row < self.rows else None
+        }
+
+
+class CellMapsManager:
+    """ Карты сессий: строятся из Session.cells при первом обращении.
+        Клетки меняются только при генерации карты, после неё карта сбрасывается.
+    """
+
+    def __init__(self):
+        self.maps: dict[str, CellMap] = {}
+
+    def get(self, session: 'Session') -> CellMap:
+        cell_map = self.maps.get(session.session_id)
+        if cell_map is None:
+            cell_map = CellMap.from_cells(
+                session.cells, session.map_size["rows"], session.map_size["cols"])
+            if session.cells:
+                self.maps[session.session_id] = cell_map
+        return cell_map
+
+    def set(self, session_id: str, cell_map: CellMap):
+        self.maps[session_id] = cell_map
+
+    def drop(self, session_id: str):
+        self.maps.pop(session_id, None)
+
+cell_maps = CellMapsManager()
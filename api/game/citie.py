@@ -7,6 +7,8 @@ from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
 from modules.function_way import determine_city_branch
+from game.cell_map import cell_maps
+from game.event_effects import ActiveEffects
 from modules.websocket_manager import websocket_manager
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
@@ -69,6 +71,58 @@ NAMES = [
     "Берилловый Вал"
 ]
 
+# Ресурсы, на которые города формируют спрос (порядок как в конфиге)
+NOT_RAW_RESOURCES = [
+    (resource_id, resource) for resource_id, resource in RESOURCES.resources.items()
+    if not resource.raw
+]
+
+async def update_cities_demands(session, cities: list['Citie']):
+    """ Обновляет спрос всех городов сессии за один проход.
+
+        Количество пользователей, цены и эффекты события берутся один раз,
+        спрос всех городов записывается одним bulk_write. У каждого города
+        свой поток случайных чисел, как в Citie._update_demands, поэтому
+        спрос города не зависит от пути обновления и от других городов.
+    """
+    from game.price_graph import session_prices
+
+    if not cities: return
+
+    users_count = await just_db.count("users", session_id=session.session_id)
+    effects = session.effects
+    prices = (await session_prices.get(session.session_id, session.step)).prices_dict()
+
+    previous = [
+        ({"id": city.id, "session_id": city.session_id}, 
+         copy.deepcopy({"demands": city.demands, "demands_save": city.demands_save}))
+        for city in cities
+    ]
+
+    for city in sorted(cities, key=lambda c: c.id):
+        city.generate_demands(session.rng("demand", session.step, city.id), 
+                              users_count, effects, prices)
+
+    await just_db.bulk_update(Citie.__tablename__, [
+        ({"id": city.id, "session_id": city.session_id}, 
+         {"demands": city.demands, "demands_save": city.demands_save})
+        for city in cities
+    ])
+    await just_db.on_rollback(
+        lambda: just_db.bulk_update(Citie.__tablename__, previous))
+
+    async def broadcast():
+        for city in cities:
+            await websocket_manager.broadcast({
+                "type": "api-city-update-demands",
+                "data": {
+                    "city_id": city.id,
+                    "session_id": city.session_id,
+                    "demands": city.demands
+                }
+            })
+    await just_db.on_commit(broadcast)
+
 class Citie(BaseClass, SessionObject):
 
     __tablename__ = "cities"
@@ -90,29 +144,33 @@ class Citie(BaseClass, SessionObject):
     async def create(self, 
                      session_id: str, 
                      x: int, y: int, 
-                     name: Optional[str] = None):
+                     name: Optional[str] = None,
+                     rng: Optional[random.Random] = None):
         """ Создание нового города
         
         Args:
             session_id: ID сессии
             x: координата X
             y: координата Y
+            rng: поток случайных чисел сессии (по умолчанию поток cities)
         """
 
         self.session_id = session_id
         session = await self.get_session_or_error()
 
         self.cell_position = f"{x}.{y}"
+        if rng is None:
+            rng = session.rng("cities", self.cell_position)
 
         # Определяем приоритетную ветку на основе соседних клеток
         self.branch = await determine_city_branch(
-            x, y, session_id, session.cells, session.map_size
+            x, y, session_id, cell_maps.get(session), rng=rng
         )
 
-        self.name = name if name else random.choice(NAMES)
+        self.name = name if name else rng.choice(NAMES)
 
         # Инициализируем спрос
-        await self._update_demands(session)
+        await self._update_demands(session, rng)
 
         await self.insert()
         await websocket_manager.broadcast({
@@ -124,20 +182,49 @@ class Citie(BaseClass, SessionObject):
 
         return self
 
-    async def _update_demands(self, session=None):
+    async def _update_demands(self, session=None, 
+                              rng: Optional[random.Random] = None):
         """Обновляет спрос города на товары
         
         Args:
             session: объект Session (опционально, для оптимизации)
+            rng: генератор случайных чисел (по умолчанию поток demand сессии)
         """
+        from game.price_graph import session_prices
+
         if session is None:
             session = await self.get_session_or_error()
 
         if not session:
             return
 
-        # Получаем количество пользователей в сессии (минимум 1 для расчётов)
-        users_count = max(len(await session.users), 1)
+        users_count = await just_db.count("users", session_id=session.session_id)
+        prices = await session_prices.get(session.session_id, session.step)
+
+        if rng is None:
+            rng = session.rng("demand", session.step, self.id)
+
+        self.generate_demands(
+            rng, users_count, 
+            session.effects, prices.prices_dict()
+        )
+
+    def generate_demands(self, rng: random.Random, 
+                         users_count: int, effects: ActiveEffects, 
+                         prices: dict[str, int]):
+        """Генерирует спрос города по заранее собранным данным сессии
+        
+        Args:
+            rng: генератор случайных чисел (при одинаковом seed результат одинаковый)
+            users_count: количество пользователей в сессии
+            effects: эффекты текущего события (Session.effects)
+            prices: текущие цены предметов {resource_id: price}
+        """
+        # Минимум 1 пользователь для расчётов
+        users_count = max(users_count, 1)
+
+        increase_price = effects.increase_price
+        increase_demand = effects.increase_demand
 
         # Рассчитываем модификаторы спроса на основе разности между сохраненным и текущим спросом
         demand_modifiers = {}
@@ -155,68 +242,62 @@ class Citie(BaseClass, SessionObject):
         # Очищаем старый спрос
         self.demands = {}
 
-        # Получаем все ресурсы, которые не являются сырьем
-        for resource_id, resource in RESOURCES.resources.items():
-            if not resource.raw:
-                # Базовое количество: massModifier определяет масштаб
-                # Для товаров с massModifier=100 будет ~100 единиц на игрока
-                base_amount = resource.massModifier * users_count
-                
-                # Применяем модификатор, основанный на продажах прошлого хода
-                previous_demand_modifier = demand_modifiers.get(resource_id, 1.0)
-                base_amount *= previous_demand_modifier
-
-                mod_price = session.get_event_effects().get(
-                    'increase_price', {}
-                ).get(resource_id, 1.0)
-                mod_count = session.get_event_effects().get(
-                    'increase_demand', {}
-                ).get(resource_id, 1.0)
-
-                # Модификатор для приоритетной ветки (увеличиваем спрос на 50%)
-                branch_modifier = 1.5 if resource.branch == self.branch else 1.0
-
-                # Применяем модификатор продаж прошлого хода
-                previous_demand_modifier = demand_modifiers.get(resource_id, 1.0)
-                if previous_demand_modifier != 1.0:
-                    rand_demand = random.uniform(previous_demand_modifier, 1.0)
-                else:
-                    rand_demand = random.uniform(0.8, 1.5)
-
-                # Рандомизация ±60%
-                amount_variation = random.uniform(0.4, 1.6)
-
-                # Рассчитываем финальное количество
-                amount = int(base_amount * branch_modifier * rand_demand * amount_variation)
-
-                # Ограничение: минимум зависит от massModifier
-                min_min = 0
-                branch_modifier = 1.0
-                if resource.branch == self.branch:
-                    min_min = random.randint(0, 1)
-                    branch_modifier = 1.5
-
-                min_amount = random.randint(min_min, max(int(resource.massModifier * 0.5), 2))
-                max_amount = int(resource.massModifier * users_count * 2 * mod_count * branch_modifier)
-                amount = random.randint(min_amount, max(min_amount, max_amount, amount))
-
-
-                # Цена с рандомизацией ±20%
-                current_item_price = await session.get_item_price(resource_id)
-                price_variation = random.uniform(0.8, 1.2)
-                price = int(current_item_price * price_variation * mod_price)
-
-                # Бонус к цене для приоритетной ветки (+50%)
-                if resource.branch == self.branch:
-                    price = int(price * 1.5)
-
-                # Минимальная цена не может быть меньше базовой
-                # price = max(resource.basePrice, price)
-                
-                self.demands[resource_id] = {
-                    'amount': amount,
-                    'price': price
-                }
+        # Все ресурсы, которые не являются сырьем
+        for resource_id, resource in NOT_RAW_RESOURCES:
+            # Базовое количество: massModifier определяет масштаб
+            # Для товаров с massModifier=100 будет ~100 единиц на игрока
+            base_amount = resource.massModifier * users_count
+            
+            # Применяем модификатор, основанный на продажах прошлого хода
+            previous_demand_modifier = demand_modifiers.get(resource_id, 1.0)
+            base_amount *= previous_demand_modifier
+
+            mod_price = increase_price.get(resource_id, 1.0)
+            mod_count = increase_demand.get(resource_id, 1.0)
+
+            # Модификатор для приоритетной ветки (увеличиваем спрос на 50%)
+            branch_modifier = 1.5 if resource.branch == self.branch else 1.0
+
+            # Применяем модификатор продаж прошлого хода
+            if previous_demand_modifier != 1.0:
+                rand_demand = rng.uniform(previous_demand_modifier, 1.0)
+            else:
+                rand_demand = rng.uniform(0.8, 1.5)
+
+            # Рандомизация ±60%
+            amount_variation = rng.uniform(0.4, 1.6)
+
+            # Рассчитываем финальное количество
+            amount = int(base_amount * branch_modifier * rand_demand * amount_variation)
+
+            # Ограничение: минимум зависит от massModifier
+            min_min = 0
+            branch_modifier = 1.0
+            if resource.branch == self.branch:
+                min_min = rng.randint(0, 1)
+                branch_modifier = 1.5
+
+            min_amount = rng.randint(min_min, max(int(resource.massModifier * 0.5), 2))
+            max_amount = int(resource.massModifier * users_count * 2 * mod_count * branch_modifier)
+            amount = rng.randint(min_amount, max(min_amount, max_amount, amount))
+
+
+            # Цена с рандомизацией ±20%
+            current_item_price = prices.get(resource_id, resource.basePrice)
+            price_variation = rng.uniform(0.8, 1.2)
+            price = int(current_item_price * price_variation * mod_price)
+
+            # Бонус к цене для приоритетной ветки (+50%)
+            if resource.branch == self.branch:
+                price = int(price * 1.5)
+
+            # Минимальная цена не может быть меньше базовой
+            # price = max(resource.basePrice, price)
+            
+            self.demands[resource_id] = {
+                'amount': amount,
+                'price': price
+            }
 
         # Обновляем demands_save для следующего хода (сохраняем только что созданный спрос)
         self.demands_save = copy.deepcopy(self.demands)
@@ -224,20 +305,7 @@ class Citie(BaseClass, SessionObject):
     async def on_new_game_stage(self):
         """Вызывается при начале нового игрового хода"""
         session = await self.get_session_or_error()
-        
-        # Обновляем спрос на товары
-        await self._update_demands(session)
-        
-        await self.save_to_base()
-        
-        await websocket_manager.broadcast({
-            "type": "api-city-update-demands",
-            "data": {
-                "city_id": self.id,
-                "session_id": self.session_id,
-                "demands": self.demands
-            }
-        })
+        await update_cities_demands(session, [self])
 
     async def sell_resource(self, company_id: int, 
                       resource_id: str, amount: int):
@@ -253,20 +321,31 @@ class Citie(BaseClass, SessionObject):
         """
         from game.logistics import Logistics
 
-        await Logistics().create(
-            session_id=self.session_id,
-            resource_type=resource_id,
-            amount=amount,
-            from_company_id=company_id,
-            to_city_id=self.id
-        )
-        
-        # Уменьшаем спрос
-        self.demands[resource_id]['amount'] -= amount
-        if self.demands[resource_id]['amount'] <= 0:
-            del self.demands[resource_id]
-
-        await self.save_to_base()
+        async def sell():
+            await Logistics().create(
+                session_id=self.session_id,
+                resource_type=resource_id,
+                amount=amount,
+                from_company_id=company_id,
+                to_city_id=self.id
+            )
+
+            # Уменьшаем спрос атомарно, чтобы параллельные продажи его не превысили
+            demand_key = f"demands.{resource_id}.amount"
+            if not await self.inc({demand_key: -amount}, 
+                                  guard={demand_key: {"$gte": amount}}):
+                raise ValueError("Спрос города на этот ресурс уже закрыт")
+
+            if self.demands[resource_id]['amount'] <= 0:
+                await just_db.unset(self.__tablename__, 
+                                    {"id": self.id, demand_key: {"$lte": 0}}, 
+                                    [f"demands.{resource_id}"])
+                del self.demands[resource_id]
+
+        # Отправка груза и уменьшение спроса - одна транзакция. Без replica set 
+        # списание товара и созданная доставка отменяются компенсациями 
+        # (Company.remove_resource, Logistics.create), если спрос уже закрыт
+        await just_db.transaction(sell)
 
         await websocket_manager.broadcast({
             "type": "api-city-trade",
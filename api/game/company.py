@@ -8,8 +8,9 @@ from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
 from game.session import SessionObject, SessionStages
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
-from global_modules.bank import calc_credit, get_credit_conditions, check_max_credit_steps, calc_deposit, get_deposit_conditions, check_max_deposit_steps
-from game.factory import Factory
+from global_modules.bank import calc_credit, credit_schedule, get_credit_conditions, check_max_credit_steps, calc_deposit, get_deposit_conditions, check_max_deposit_steps
+from game.factory import Factory, FactoryFleet
+from game.occupancy import occupancy_grids
 from modules.logs import game_logger
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
@@ -19,6 +20,37 @@ SETTINGS: Settings = ALL_CONFIGS['settings']
 CAPITAL: Capital = ALL_CONFIGS['capital']
 REPUTATION: Reputation = ALL_CONFIGS['reputation']
 
+def warehouse_space_guard(max_amount: int) -> dict:
+    """ Условие Mongo: сумма всех ресурсов на складе не больше max_amount """
+    return {"$expr": {"$lte": [
+        {"$sum": {"$map": {
+            "input": {"$objectToArray": {"$ifNull": ["$warehouses", {}]}},
+            "in": "$$this.v"
+        }}},
+        max_amount
+    ]}}
+
+def economic_power(count: int, item: str, e_type: str) -> int:
+    """ Экономическое влияние за count единиц предмета по типу операции """
+    mod = 1
+
+    if e_type == "production":
+        mod = 1
+    elif e_type == "exchange":
+        mod = 2
+    elif e_type == "city_sell":
+        mod = 3
+    elif e_type == "contract":
+        mod = 2
+
+    resource = RESOURCES.get_resource(item)  # type: ignore
+    if not resource:
+        dif = 0
+    else:
+        dif = resource.basePrice
+
+    return int(count * dif * mod)
+
 class Company(BaseClass, SessionObject):
 
     __tablename__ = "companies"
@@ -66,7 +98,7 @@ class Company(BaseClass, SessionObject):
             raise ValueError("Пользователь не является членом компании.")
 
         self.owner = user_id
-        await self.save_to_base()
+        await self.save_fields("owner")
         game_logger.info(f"Пользователь {user_id} назначен владельцем компании {self.name} ({self.id}).")
 
     async def create(self, name: str, session_id: str):
@@ -117,9 +149,15 @@ class Company(BaseClass, SessionObject):
         if not session or session.stage != "FreeUserConnect":
             return False
 
-        if len(await self.users) >= SETTINGS.max_players_in_company:
+        return self.can_user_enter_with(session, len(await self.users))
+
+    def can_user_enter_with(self, session, users_count: int) -> bool:
+        """ Проверка входа в компанию по уже известным данным
+        """
+        if not session or session.stage != "FreeUserConnect":
             return False
-        return True
+
+        return users_count < SETTINGS.max_players_in_company
 
     @property
     async def users(self) -> list['User']:
@@ -136,22 +174,38 @@ class Company(BaseClass, SessionObject):
             raise ValueError("Координаты должны быть целыми числами.")
 
         session = await self.get_session_or_error()
-        if not await session.can_select_cell(x, y):
+        if not session.can_select_cells():
+            raise ValueError("Текущая стадия сессии не позволяет выбирать клетки.")
+
+        # Сетка загружается до проверки: проверка и занятие клетки идут
+        # подряд без await между ними, поэтому две компании не могут
+        # выбрать одну клетку одновременно
+        grid = await occupancy_grids.get(session)
+        if not grid.is_free(x, y):
             game_logger.warning(f"Компания {self.name} ({self.id}) не может выбрать клетку ({x}, {y}) в сессии {self.session_id}.")
             raise ValueError("Невозможно выбрать эту клетку - либо она занята, либо находится вне карты.")
+        grid.occupy(self.id, x, y)
 
         old_position = self.cell_position
         self.cell_position = f"{x}.{y}"
 
-        await self.save_to_base()
+        try:
+            await self.save_fields("cell_position")
+        except Exception:
+            self.cell_position = old_position
+            grid.release(self.id)
+            if self.get_position(): grid.occupy(self.id, *self.get_position())
+            raise
         await self.reupdate()
         game_logger.info(f"Компания {self.name} ({self.id}) установила позицию на клетку ({x}, {y}).")
 
-        # Если все компании выбрали клетки, переходим к следующему этапу
+        # Если все компании выбрали клетки, переходим к следующему этапу.
+        # Смена стадии блокирует все компании сессии, поэтому идёт отдельной
+        # задачей, а не под блокировкой этой компании (иначе два последних
+        # выбора клеток ждут друг друга)
         await session.reupdate()
         if await session.all_companies_have_cells():
-            await session.update_stage(SessionStages.Game)
-            await session.save_to_base()
+            session.start_game_when_ready()
 
         imps = await self.get_improvements()
         col = imps['factory']['tasksPerTurn']
@@ -189,6 +243,7 @@ class Company(BaseClass, SessionObject):
 
     async def delete(self):
         await just_db.delete(self.__tablename__, **{self.__unique_id__: self.id})
+        occupancy_grids.release(self.session_id, self.id)
 
         for user in await self.users: await user.leave_from_company()
         for factory in await self.get_factories(): await factory.delete()
@@ -232,9 +287,10 @@ class Company(BaseClass, SessionObject):
             game_logger.warning(f"Попытка добавить отрицательное количество ресурса '{resource}' ({amount}) компании {self.name} ({self.id}).")
             raise ValueError("Количество должно быть положительным целым числом.")
 
+        max_size = await self.get_max_warehouse_size()
         if not max_space:
-            if self.get_resources_amount() + amount > await self.get_max_warehouse_size() and not ignore_space:
-                game_logger.warning(f"Недостаточно места на складе компании {self.name} ({self.id}) для добавления {amount} единиц '{resource}'. Свободно: {self.get_warehouse_free_size()}")
+            if self.get_resources_amount() + amount > max_size and not ignore_space:
+                game_logger.warning(f"Недостаточно места на складе компании {self.name} ({self.id}) для добавления {amount} единиц '{resource}'. Свободно: {await self.get_warehouse_free_size()}")
                 raise ValueError("Недостаточно места на складе.")
         if max_space:
             free_space = await self.get_warehouse_free_size()
@@ -242,12 +298,14 @@ class Company(BaseClass, SessionObject):
                 amount = free_space
             if amount <= 0: return False
 
-        if resource in self.warehouses:
-            self.warehouses[resource] += amount
-        else:
-            self.warehouses[resource] = amount
+        # Место на складе проверяется в том же запросе, что и изменение
+        guard = None if ignore_space else warehouse_space_guard(max_size - amount)
+        if not await self.inc({f"warehouses.{resource}": amount}, guard=guard):
+            await self.reupdate()
+            raise ValueError("Недостаточно места на складе.")
+        await just_db.on_rollback(
+            lambda: self.inc({f"warehouses.{resource}": -amount}))
 
-        await self.save_to_base()
         await websocket_manager.broadcast({
             "type": "api-company_resource_added",
             "data": {
@@ -268,16 +326,21 @@ class Company(BaseClass, SessionObject):
             game_logger.warning(f"Попытка удалить отрицательное количество ресурса '{resource}' ({amount}) у компании {self.name} ({self.id}).")
             raise ValueError("Количество должно быть положительным целым числом.")
 
-        if resource not in self.warehouses or self.warehouses[resource] < amount:
+        if not await self.inc({f"warehouses.{resource}": -amount}, 
+                              guard={f"warehouses.{resource}": {"$gte": amount}}):
+            await self.reupdate()
             game_logger.warning(f"Недостаточно ресурса '{resource}' у компании {self.name} ({self.id}) для удаления {amount} единиц. Доступно: {self.warehouses.get(resource, 0)}")
             raise ValueError(f"Недостаточно ресурса '{resource}' для удаления.")
-
-        self.warehouses[resource] -= amount
-        if self.warehouses[resource] == 0:
+        await just_db.on_rollback(
+            lambda: self.inc({f"warehouses.{resource}": amount}))
+
+        if self.warehouses.get(resource) == 0:
+            # Удаляем пустую позицию, только если её не пополнили параллельно
+            await just_db.unset(self.__tablename__, 
+                                {"id": self.id, f"warehouses.{resource}": 0}, 
+                                [f"warehouses.{resource}"])
             del self.warehouses[resource]
 
-        await self.save_to_base()
-
         await websocket_manager.broadcast({
             "type": "api-company_resource_removed",
             "data": {
@@ -296,25 +359,12 @@ class Company(BaseClass, SessionObject):
         return count
 
     async def set_economic_power(self, count: int, item: str, e_type: str):
-        mod = 1
+        power = economic_power(count, item, e_type)
+        if power == 0: return
 
-        if e_type == "production":
-            mod = 1
-        elif e_type == "exchange":
-            mod = 2
-        elif e_type == "city_sell":
-            mod = 3
-        elif e_type == "contract":
-            mod = 2
-
-        resource = RESOURCES.get_resource(item)  # type: ignore
-        if not resource:
-            dif = 0
-        else:
-            dif = resource.basePrice
-
-        self.economic_power += int(count * dif * mod)
-        await self.save_to_base()
+        await self.inc({"economic_power": power})
+        await just_db.on_rollback(
+            lambda: self.inc({"economic_power": -power}))
 
     async def get_my_cell_info(self):
         cell_type_key = await self.get_cell_type()
@@ -324,14 +374,19 @@ class Company(BaseClass, SessionObject):
         return result
 
     async def get_cell_type(self):
+        session = await self.get_session()
+        if not session: return None
+
+        return self.cell_type_in(session)
+
+    def cell_type_in(self, session) -> Optional[str]:
+        """ Тип клетки компании на карте уже загруженной сессии
+        """
         position = self.get_position()
 
         if not position: return None
         x, y = position
 
-        session = await self.get_session()
-        if not session: return None
-
         index = x * session.map_size["cols"] + y
 
         if index < 0 or index >= len(session.cells):
@@ -341,7 +396,11 @@ class Company(BaseClass, SessionObject):
     async def get_improvements(self):
         """ Возвращает данные улучшений для компании
         """
-        cell_type = await self.get_cell_type()
+        return self.improvements_for(await self.get_cell_type())
+
+    def improvements_for(self, cell_type: Optional[str]) -> dict:
+        """ Данные улучшений для известного типа клетки (без запросов к базе)
+        """
         if cell_type is None: return {}
 
         data = {}
@@ -366,11 +425,11 @@ class Company(BaseClass, SessionObject):
         if amount <= 0:
             raise ValueError("Сумма должна быть положительным целым числом.")
 
-        old_balance = self.balance
-        self.balance += amount
-        self.this_turn_income += int(amount * income_percent)
-
-        await self.save_to_base()
+        income = int(amount * income_percent)
+        await self.inc({"balance": amount, "this_turn_income": income})
+        await just_db.on_rollback(
+            lambda: self.inc({"balance": -amount, "this_turn_income": -income}))
+        old_balance = self.balance - amount
 
         await websocket_manager.broadcast({
             "type": "api-company_balance_changed",
@@ -389,13 +448,13 @@ class Company(BaseClass, SessionObject):
         if amount <= 0:
             raise ValueError("Сумма должна быть положительным целым числом.")
 
-        if self.balance < amount:
+        if not await self.inc({"balance": -amount}, 
+                              guard={"balance": {"$gte": amount}}):
+            await self.reupdate()
             raise ValueError("Недостаточно средств для списания.")
+        await just_db.on_rollback(lambda: self.inc({"balance": amount}))
+        old_balance = self.balance + amount
 
-        old_balance = self.balance
-        self.balance -= amount
-        
-        await self.save_to_base()
         await websocket_manager.broadcast({
             "type": "api-company_balance_changed",
             "data": {
@@ -435,7 +494,7 @@ class Company(BaseClass, SessionObject):
         await self.remove_balance(cost)
 
         self.improvements[improvement_type] = imp_lvl_now + 1
-        await self.save_to_base()
+        await self.save_fields("improvements")
 
         if improvement_type == 'factory':
             imp = await self.get_improvements()
@@ -462,10 +521,9 @@ class Company(BaseClass, SessionObject):
         if amount <= 0:
             raise ValueError("Сумма должна быть положительным целым числом.")
 
-        old_reputation = self.reputation
-        self.reputation += amount
+        await self.inc({"reputation": amount})
+        old_reputation = self.reputation - amount
 
-        await self.save_to_base()
         await websocket_manager.broadcast({
             "type": "api-company_reputation_changed",
             "data": {
@@ -483,12 +541,23 @@ class Company(BaseClass, SessionObject):
         if amount <= 0:
             raise ValueError("Сумма должна быть положительным целым числом.")
 
-        old_reputation = self.reputation
-        self.reputation = max(0, self.reputation - amount)
+        # Репутация не опускается ниже 0: списание min(amount, текущая),
+        # при параллельном изменении перечитываем запись и повторяем
+        while True:
+            old_reputation = self.reputation
+            decrease = min(amount, old_reputation)
+            if decrease <= 0: break
+
+            if await self.inc({"reputation": -decrease}, 
+                              guard={"reputation": old_reputation}):
+                break
+
+            document = await just_db.find_one(self.__tablename__, id=self.id)
+            if document is None: break
+            self.load_from_base(document)
 
         if self.reputation != old_reputation:
 
-            await self.save_to_base()
             await websocket_manager.broadcast({
                 "type": "api-company_reputation_changed",
                 "data": {
@@ -504,13 +573,10 @@ class Company(BaseClass, SessionObject):
             return True
         return False
 
-    async def take_credit(self, c_sum: int, steps: int):
-        """ 
-            Сумма кредита у нас между минимумом и максимумом
-            Количество шагов у нас 
+    async def quote_credit(self, c_sum: int, steps: int) -> dict:
+        """ Условия и график платежей кредита без его оформления.
+            Проверки те же, что и у take_credit.
         """
-        self.in_prison_check()
-
         if not isinstance(c_sum, int) or not isinstance(steps, int):
             game_logger.warning(f"Компания {self.name} ({self.id}) пытается взять кредит с неверными типами данных: сумма={type(c_sum)}, шаги={type(steps)}")
             raise ValueError("Сумма и шаги должны быть целыми числами.")
@@ -551,6 +617,29 @@ class Company(BaseClass, SessionObject):
             game_logger.warning(f"Компания {self.name} ({self.id}) пытается взять кредит {c_sum}, меньше минимума {CAPITAL.bank.credit.min}")
             raise ValueError(f"Сумма кредита ниже минимального лимита {CAPITAL.bank.credit.min}.")
 
+        return {
+            "amount": c_sum,
+            "steps": steps,
+            "total": total,
+            "pay_per_turn": pay_per_turn,
+            "extra": extra,
+            "percent": credit_condition.percent,
+            "without_interest": credit_condition.without_interest,
+            "schedule": list(credit_schedule(
+                c_sum, credit_condition.without_interest, 
+                credit_condition.percent, steps))
+        }
+
+    async def take_credit(self, c_sum: int, steps: int):
+        """ 
+            Сумма кредита у нас между минимумом и максимумом
+            Количество шагов у нас 
+        """
+        self.in_prison_check()
+
+        quote = await self.quote_credit(c_sum, steps)
+        total = quote["total"]
+
         credit_data = {
             "total_to_pay": total,
             "need_pay": 0,
@@ -561,7 +650,7 @@ class Company(BaseClass, SessionObject):
         }
         self.credits.append(credit_data)
 
-        await self.save_to_base()
+        await self.save_fields("credits")
         await self.add_balance(c_sum, 0.0) # деньги без процентов в доход
 
         await websocket_manager.broadcast({
@@ -575,32 +664,6 @@ class Company(BaseClass, SessionObject):
         game_logger.info(f"Компания {self.name} ({self.id}) взяла кредит на сумму {c_sum} на {steps} шагов. К доплате: {total}")
         return credit_data
 
-    async def credit_paid_step(self):
-        """ Вызывается при каждом шаге игры для компании.
-            Начисляет плату по кредитам, если они есть.
-        """
-
-        for index, credit in enumerate(self.credits):
-
-            if credit["steps_now"] < credit["steps_total"]:
-                steps_left = max(1, credit["steps_total"] - credit["steps_now"])
-                credit["need_pay"] += (credit["total_to_pay"] - credit['need_pay'] - credit ['paid']) // steps_left
-                credit["steps_now"] += 1
-
-            elif credit["steps_now"] == credit["steps_total"]:
-                # Последний день - начисляем всю оставшуюся сумму
-                # credit["need_pay"] += credit["total_to_pay"] - credit['paid']
-                credit["steps_now"] += 1
-
-            elif credit["steps_now"] > credit["steps_total"]:
-                # Просрочка - не увеличиваем steps_now больше, но снижаем репутацию
-                await self.remove_reputation(REPUTATION.credit.lost)
-
-            if credit["steps_now"] - credit["steps_total"] > REPUTATION.credit.max_overdue:
-                await self.to_prison()
-
-        await self.save_to_base()
-
     async def remove_credit(self, credit_index: int):
         """ Удаляет кредит с индексом credit_index.
         """
@@ -609,7 +672,7 @@ class Company(BaseClass, SessionObject):
             raise ValueError("Недействительный индекс кредита.")
 
         del self.credits[credit_index]
-        await self.save_to_base()
+        await self.save_fields("credits")
 
         await websocket_manager.broadcast({
             "type": "api-company_credit_removed",
@@ -661,7 +724,7 @@ class Company(BaseClass, SessionObject):
             await self.add_reputation(REPUTATION.credit.gained)
         else:
             self.credits[credit_index] = credit
-            await self.save_to_base()
+            await self.save_fields("credits")
 
         remaining = credit["total_to_pay"] - credit["paid"] if credit["paid"] < credit["total_to_pay"] else 0
 
@@ -706,7 +769,8 @@ class Company(BaseClass, SessionObject):
         for i in await self.exchanges:
             await i.delete()
 
-        await self.save_to_base()
+        await self.save_fields("in_prison", "prison_end_step", "reputation", "credits", "deposits",
+                               "tax_debt", "overdue_steps", "this_turn_income")
         await session.create_step_schedule(
             end_step,
             leave_from_prison,
@@ -733,7 +797,7 @@ class Company(BaseClass, SessionObject):
         self.in_prison = False
         self.prison_end_step = None
 
-        await self.save_to_base()
+        await self.save_fields("in_prison", "prison_end_step")
         await websocket_manager.broadcast({
             "type": "api-company_left_prison",
             "data": {
@@ -756,25 +820,26 @@ class Company(BaseClass, SessionObject):
         """
 
         session = await self.get_session_or_error()
+        return self.tax_rate_in(session)
 
-        big_mod = session.get_event_effects().get(
-            'tax_rate_large', CAPITAL.bank.tax.big_business
-        )
-
-        small_mod = session.get_event_effects().get(
-            'tax_rate_small', CAPITAL.bank.tax.small_business
-        )
+    def tax_rate_in(self, session) -> float:
+        """ Налоговая ставка для уже загруженной сессии
+        """
+        effects = session.effects
 
         if self.business_type == "big":
-            return big_mod
-        return small_mod
+            if effects.tax_rate_large is not None: return effects.tax_rate_large
+            return CAPITAL.bank.tax.big_business
+
+        if effects.tax_rate_small is not None: return effects.tax_rate_small
+        return CAPITAL.bank.tax.small_business
 
     async def taxate(self):
         """ Начисляет налоги в зависимости от типа бизнеса. Вызывается каждый ход.
         """
 
         if self.tax_debt > 0:
-            self.overdue_steps += 1
+            await self.inc({"overdue_steps": 1})
             await self.remove_reputation(REPUTATION.tax.late)
             game_logger.warning(f"Компания {self.name} ({self.id}) имеет просроченный налоговый долг. Просрочка: {self.overdue_steps} шагов")
 
@@ -782,6 +847,7 @@ class Company(BaseClass, SessionObject):
             game_logger.warning(f"Компания {self.name} ({self.id}) превысила максимальную просрочку по налогам ({self.overdue_steps} > {REPUTATION.tax.not_paid_stages}). Отправляется в тюрьму")
             self.overdue_steps = 0
             self.tax_debt = 0
+            await self.save_fields("overdue_steps", "tax_debt")
 
             if self.reputation > 0:
                 await self.remove_reputation(self.reputation)
@@ -791,8 +857,8 @@ class Company(BaseClass, SessionObject):
         percent = await self.business_tax()
         tax_amount = int(self.last_turn_income * percent)
 
-        self.tax_debt += tax_amount
-        await self.save_to_base()
+        if tax_amount > 0:
+            await self.inc({"tax_debt": tax_amount})
 
 
     async def pay_taxes(self, amount: int):
@@ -819,14 +885,13 @@ class Company(BaseClass, SessionObject):
         await self.remove_balance(amount)
 
         # Обновляем информацию по налогам
-        self.tax_debt -= amount
+        await self.inc({"tax_debt": -amount})
         if self.tax_debt <= 0:
             self.tax_debt = 0
             self.overdue_steps = 0
+            await self.save_fields("tax_debt", "overdue_steps")
             await self.add_reputation(REPUTATION.tax.paid)
 
-        await self.save_to_base()
-
         await websocket_manager.broadcast({
             "type": "api-company_tax_paid",
             "data": {
@@ -894,7 +959,7 @@ class Company(BaseClass, SessionObject):
         await self.remove_balance(d_sum)
 
         self.deposits.append(deposit_data)
-        await self.save_to_base()
+        await self.save_fields("deposits")
 
         await websocket_manager.broadcast({
             "type": "api-company_deposit_taken",
@@ -906,31 +971,6 @@ class Company(BaseClass, SessionObject):
         })
         return deposit_data
 
-    async def deposit_income_step(self):
-        """ Вызывается при каждом шаге игры для компании.
-            Начисляет доход по вкладам на баланс вклада (не на счёт компании).
-            Автоматически снимает депозиты по окончании срока.
-        """
-        
-        session = await self.get_session()
-        if not session: return False
-
-        for index, deposit in enumerate(self.deposits):
-            if deposit["steps_now"] < deposit["steps_total"]:
-                # Начисляем проценты на баланс вклада
-                deposit["current_balance"] += deposit["income_per_turn"]
-                deposit["total_earned"] += deposit["income_per_turn"]
-
-            deposit["steps_now"] += 1
-
-            # Если срок депозита истек, то снимаем
-            if deposit["steps_now"] >= deposit["steps_total"]:
-
-                if self.in_prison is False:
-                    await self.withdraw_deposit(index)
-
-        await self.save_to_base()
-
     async def withdraw_deposit(self, deposit_index: int):
         """ Забирает депозит с индексом deposit_index.
             Возвращает всю сумму (начальная + проценты) на счёт компании.
@@ -958,7 +998,7 @@ class Company(BaseClass, SessionObject):
 
         # Удаляем вклад
         del self.deposits[deposit_index]
-        await self.save_to_base()
+        await self.save_fields("deposits")
 
         await websocket_manager.broadcast({
             "type": "api-company_deposit_withdrawn",
@@ -1013,18 +1053,11 @@ class Company(BaseClass, SessionObject):
         """ Переукомплектовать фабрики с типом ресурса (без него) на новый ресурс.
             Запускает этап комплектации.
         """
+        from game.factory import bulk_rekit
 
-        free_factories: list[Factory] = []
-        for f in await self.get_factories():
-            if f.complectation == find_resource and f.produce == produce_status:
-                free_factories.append(f)
-
-        limit = 0
-        for factory in free_factories:
-            if limit >= count: break
-
-            limit += 1
-            await factory.pere_complete(new_resource)
+        return await bulk_rekit(self.id, new_resource, count, 
+                                find_complectation=find_resource, 
+                                produce_status=produce_status)
 
     async def auto_manufacturing(self, 
                                  factory_id: int, 
@@ -1055,20 +1088,22 @@ class Company(BaseClass, SessionObject):
         await factory.set_produce(produce)
 
     async def get_contracts(self) -> list['Contract']:
-        """ Получает все контракты компании """
+        """ Получает все контракты компании (id берутся из реестра сессии) """
         from game.contract import Contract
+        from game.contract_registry import contract_registries
 
-        contracts: list[Contract] = await just_db.find(
-            Contract.__tablename__, to_class=Contract,
-            supplier_company_id=self.id
-        ) # type: ignore
+        registry = await contract_registries.get(self.session_id)
+        ids = registry.contract_ids(self.id)
+        if not ids: return []
 
-        contracts += await just_db.find(
+        contracts: list[Contract] = await just_db.find(
             Contract.__tablename__, to_class=Contract,
-            customer_company_id=self.id
+            id={"$in": ids}
         ) # type: ignore
 
-        return contracts
+        # Порядок как в реестре: сначала как поставщик, затем как заказчик
+        order = {contract_id: i for i, contract_id in enumerate(ids)}
+        return sorted(contracts, key=lambda c: order[c.id])
 
     async def get_max_contracts(self) -> int:
         """ Получает максимальное количество активных контрактов """
@@ -1086,9 +1121,10 @@ class Company(BaseClass, SessionObject):
 
     async def can_create_contract(self) -> bool:
         """ Проверяет, может ли компания создать новый контракт """
+        from game.contract_registry import contract_registries
 
-        return len(await self.get_contracts()
-                   ) < await self.get_max_contracts()
+        registry = await contract_registries.get(self.session_id)
+        return registry.count(self.id) < await self.get_max_contracts()
 
     async def on_new_game_stage(self, step: int):
         """ Вызывается при переходе на новый игровой этап.
@@ -1105,13 +1141,11 @@ class Company(BaseClass, SessionObject):
         if step != 1:
             if self.last_turn_income >= CAPITAL.bank.tax.big_on:
                 self.business_type = "big"
-                await self.save_to_base()
 
-        # Начисляем проценты по вкладам
-        await self.deposit_income_step()
+        await self.save_fields("last_turn_income", "this_turn_income", "business_type")
 
-        # Начисляем плату по кредитам
-        await self.credit_paid_step()
+        # Вклады и кредиты обрабатываются фазой банка всей сессии
+        # (game.bank_engine) перед обработкой компаний
 
         # Начисляем налоги
         await self.taxate()
@@ -1120,13 +1154,12 @@ class Company(BaseClass, SessionObject):
         if cell_info:
             resource_id = cell_info.resource_id
 
-            mod = session.get_event_effects().get(
-                'resource_extraction_speed', 1.0
-            )
+            effects = session.effects
+            mod = effects.resource_extraction_speed
 
             cell_type = await self.get_cell_type()
-            if session.get_event().get('cell_type') == cell_type:
-                mod *= session.get_event().get('income_multiplier', 1.0)
+            if effects.cell_type is not None and effects.cell_type == cell_type:
+                mod *= effects.income_multiplier
 
             raw_col = int(await self.raw_in_step() * mod)
 
@@ -1138,14 +1171,11 @@ class Company(BaseClass, SessionObject):
                 game_logger.info(f"Компания {self.name} ({self.id}) добыла {raw_col} единиц ресурса '{resource_id}' на шаге {step}")
 
 
-        factories = await self.get_factories()
-        for factory in factories:
-            await factory.on_new_game_stage()
+        # Фабрики обрабатываются группами: склад изменяется одним запросом
+        await FactoryFleet(await self.get_factories()).on_new_game_stage(self, session)
 
-        contracts = await self.get_contracts()
-        for contract in contracts:
-            contract: Contract
-            await contract.on_new_game_step()
+        # Контракты обрабатываются отдельной фазой хода (Session._process_turn),
+        # чтобы каждый контракт проверялся один раз, а не у каждой из сторон
 
     @property
     async def exchanges(self) -> list['Exchange']:
@@ -1159,68 +1189,163 @@ class Company(BaseClass, SessionObject):
 
         return exchanges
 
-    async def to_dict(self):
-        """Возвращает полный статус компании со всеми данными"""
-        
-        cell_data = await self.get_my_cell_info()
-        
-        return {
+    async def to_dict(self, view: str = "full"):
+        """ Возвращает статус компании
+
+            view - уровень детализации:
+                summary - основные показатели (для списков)
+                finance - summary + налоги, кредиты и вклады
+                full - полный статус со всеми связанными данными
+        """
+        return (await companies_to_dict([self], view))[0]
+
+    def serialize(self, session, view: str = "full",
+                  users: Optional[list] = None,
+                  factories: Optional[list] = None,
+                  exchanges: Optional[list] = None,
+                  contracts: Optional[list] = None) -> dict:
+        """ Собирает словарь компании из заранее загруженных данных.
+            Сам в базу не ходит - все связанные объекты передаются снаружи.
+        """
+        if view not in COMPANY_VIEWS:
+            raise ValueError(f"Неизвестный вид данных компании '{view}'.")
+
+        cell_type = self.cell_type_in(session) if session else None
+
+        data = {
             # Основная информация
             "id": self.id,
             "name": self.name,
             "owner": self.owner,
             "session_id": self.session_id,
-            "secret_code": self.secret_code,
 
             # Финансовые данные
             "balance": self.balance,
-            "last_turn_income": self.last_turn_income,
-            "this_turn_income": self.this_turn_income,
             "business_type": self.business_type,
             "economic_power": self.economic_power,
 
             # Репутация и статус
             "reputation": self.reputation,
             "in_prison": self.in_prison,
-            "prison_end_step": self.prison_end_step,
 
             # Позиция и местоположение
             "cell_position": self.cell_position,
             "position_coords": self.get_position(),
-            "cell_type": await self.get_cell_type(),
-            "cell_info": cell_data.__dict__ if await self.get_my_cell_info() else None,
+            "cell_type": cell_type,
+        }
+        if view == "summary": return data
+
+        data.update({
+            "last_turn_income": self.last_turn_income,
+            "this_turn_income": self.this_turn_income,
+            "prison_end_step": self.prison_end_step,
 
             # Налоги
             "tax_debt": self.tax_debt,
             "overdue_steps": self.overdue_steps,
-            "tax_rate": await self.business_tax(),
-            
+            "tax_rate": self.tax_rate_in(session) if session else None,
+
             # Кредиты и депозиты
             "credits": self.credits,
             "deposits": self.deposits,
+        })
+        if view == "finance": return data
+
+        users = users or []
+        factories = factories or []
+        exchanges = exchanges or []
+        contracts = contracts or []
+
+        cell_info = CELLS.types.get(cell_type) if cell_type else None
+        imps = self.improvements_for(cell_type)
+        capacity = imps['warehouse']['capacity'] if 'warehouse' in imps else 0
+        resources_amount = self.get_resources_amount()
+
+        data.update({
+            "secret_code": self.secret_code,
+            "cell_info": cell_info.__dict__ if cell_info else None,
 
             # Улучшения и ресурсы
             "improvements": self.improvements,
-            "improvements_data": await self.get_improvements(),
+            "improvements_data": imps,
             "warehouses": self.warehouses,
-            "warehouse_capacity": await self.get_max_warehouse_size(),
-            "warehouse_free_size": await self.get_warehouse_free_size(),
-            "resources_amount": self.get_resources_amount(),
-            "raw_per_turn": await self.raw_in_step(),
+            "warehouse_capacity": capacity,
+            "warehouse_free_size": capacity - resources_amount,
+            "resources_amount": resources_amount,
+            "raw_per_turn": imps['station']['productsPerTurn'] if 'station' in imps else 0,
 
             # Пользователи и фабрики
-            "users": [user.to_dict() for user in await self.users],
-            "factories": [await factory.to_dict() for factory in await self.get_factories()],
-            "factories_count": len(await self.get_factories()),
+            "users": [user.to_dict() for user in users],
+            "factories": [factory.serialize(self.warehouses) for factory in factories],
+            "factories_count": len(factories),
 
             # Дополнительные возможности
-            "can_user_enter": await self.can_user_enter(),
+            "can_user_enter": self.can_user_enter_with(session, len(users)),
 
             "exchanges": [
-                change.to_dict() for change in await self.exchanges
+                change.to_dict() for change in exchanges
             ],
 
             "contracts": [
-                contract.to_dict() for contract in await self.get_contracts()
+                contract.to_dict() for contract in contracts
             ]
-        }
\ No newline at end of file
+        })
+        return data
+
+
+COMPANY_VIEWS = ("summary", "finance", "full")
+
+async def companies_to_dict(companies: list[Company], 
+                            view: str = "full") -> list[dict]:
+    """ Пакетная сериализация компаний.
+
+        Вместо ~15 запросов на каждую компанию делает по одному запросу
+        на каждую коллекцию (пользователи, фабрики, биржа, контракты) для всего списка.
+    """
+    from game.session import session_manager
+    from game.user import User
+    from game.exchange import Exchange
+    from game.contract import Contract
+
+    if view not in COMPANY_VIEWS:
+        raise ValueError(f"Неизвестный вид данных компании '{view}'.")
+
+    if not companies: return []
+
+    sessions = {}
+    for session_id in {c.session_id for c in companies}:
+        sessions[session_id] = await session_manager.get_session(session_id)
+
+    if view != "full":
+        return [c.serialize(sessions.get(c.session_id), view) for c in companies]
+
+    ids = [c.id for c in companies]
+    by_company: dict[int, dict[str, list]] = {
+        cid: {"users": [], "factories": [], "exchanges": [], "contracts": []} for cid in ids
+    }
+
+    for user in await just_db.find(User.__tablename__, to_class=User, 
+                                   company_id={"$in": ids}):
+        by_company[user.company_id]["users"].append(user)
+
+    for factory in await just_db.find(Factory.__tablename__, to_class=Factory, 
+                                      company_id={"$in": ids}):
+        by_company[factory.company_id]["factories"].append(factory)
+
+    for exchange in await just_db.find(Exchange.__tablename__, to_class=Exchange, 
+                                       company_id={"$in": ids}):
+        by_company[exchange.company_id]["exchanges"].append(exchange)
+
+    contracts = await just_db.find(Contract.__tablename__, to_class=Contract, 
+        **{"$or": [
+            {"supplier_company_id": {"$in": ids}},
+            {"customer_company_id": {"$in": ids}}
+        ]})
+    for contract in contracts:
+        for cid in (contract.supplier_company_id, contract.customer_company_id):
+            if cid in by_company: by_company[cid]["contracts"].append(contract)
+
+    return [
+        c.serialize(sessions.get(c.session_id), view, **by_company[c.id]) 
+        for c in companies
+    ]
@@ -1,9 +1,12 @@
+from typing import Optional
 from game.session import SessionObject
 from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Reputation
 from modules.function_way import *
 from modules.websocket_manager import websocket_manager
+from modules.locks import with_company_lock, company_locks
+from game.contract_registry import contract_registries
 from modules.logs import game_logger
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
@@ -118,6 +121,7 @@ class Contract(BaseClass, SessionObject):
         self.who_creator = who_creator
 
         await self.insert()
+        await self._sync_registry()
         await websocket_manager.broadcast({
             "type": "api-contract_created",
             "data": {
@@ -128,6 +132,7 @@ class Contract(BaseClass, SessionObject):
 
         return self
 
+    @with_company_lock("supplier_company_id", "customer_company_id")
     async def execute_turn(self):
         """ Выполнение поставки за текущий ход """
         from game.company import Company
@@ -159,7 +164,16 @@ class Contract(BaseClass, SessionObject):
         if supplier_resource_amount < self.amount_per_turn:
             raise ValueError("У поставщика недостаточно ресурса для выполнения контракта")
 
-        try:
+        async def deliver() -> bool:
+            # Отмечаем поставку атомарно, чтобы параллельный вызов не отправил её дважды
+            if not await self.inc({"successful_deliveries": 1}, 
+                                  guard={"delivered_this_turn": False},
+                                  set_fields={"delivered_this_turn": True}):
+                raise ValueError("Продукт уже отправлен в этом ходе")
+            await just_db.on_rollback(
+                lambda: self.inc({"successful_deliveries": -1}, 
+                                 set_fields={"delivered_this_turn": False}))
+
             await Logistics().create(
                 from_company_id=supplier.id,
                 to_company_id=customer.id,
@@ -168,9 +182,6 @@ class Contract(BaseClass, SessionObject):
                 session_id=self.session_id
             )
 
-            self.successful_deliveries += 1
-            self.delivered_this_turn = True
-
             # Если это была последняя поставка
             if self.duration_turns == self.successful_deliveries:
                 # Добавляем репутацию за успешное выполнение
@@ -190,7 +201,6 @@ class Contract(BaseClass, SessionObject):
                 await self.delete()
                 return True
 
-            await self.save_to_base()
             await websocket_manager.broadcast({
                 "type": "api-contract_executed",
                 "data": {
@@ -202,10 +212,15 @@ class Contract(BaseClass, SessionObject):
             })
             return True
 
+        try:
+            # Отметка поставки, отправка груза и завершение контракта - одна транзакция
+            return await just_db.transaction(deliver)
+
         except ValueError as e: 
             game_logger.error(f"Ошибка при выполнении контракта: {self.id}: {e}")
             raise ValueError("Ошибка при выполнении контракта")
 
+    @with_company_lock("supplier_company_id", "customer_company_id")
     async def accept_contract(self, who_accepter: int):
         """ Принятие контракта поставщиком """
         if self.accepted:
@@ -239,6 +254,7 @@ class Contract(BaseClass, SessionObject):
 
         self.accepted = True
         await self.save_to_base()
+        await self._sync_registry()
 
         await websocket_manager.broadcast({
             "type": "api-contract_accepted",
@@ -250,6 +266,7 @@ class Contract(BaseClass, SessionObject):
         
         return self
 
+    @with_company_lock("supplier_company_id", "customer_company_id")
     async def decline_contract(self, who_decliner: int):
         """ Отклонение контракта поставщиком """
         if self.accepted:
@@ -272,6 +289,7 @@ class Contract(BaseClass, SessionObject):
         await self.delete()
         return self
 
+    @with_company_lock("supplier_company_id", "customer_company_id")
     async def cancel_with_refund(self, who_canceller: int):
         """ Отмена контракта с возвратом части денег и штрафом репутации """
         from game.company import Company
@@ -325,30 +343,18 @@ class Contract(BaseClass, SessionObject):
 
             Сбрасывает статус доставки
             Удаляет непринятые контракты в конце хода
+            Отменяет непоставленные с возвратом части денег и штрафом репутации
         """
-        # Если контракт не принят в конце хода - удаляем
-        if not self.accepted:
-            await websocket_manager.broadcast({
-                "type": "api-contract_expired",
-                "data": {
-                    "session_id": self.session_id,
-                    "contract_id": self.id,
-                    "reason": "Контракт не был принят до конца хода"
-                }
-            })
-
-            await self.delete()
-            return True  # Контракт удален
-
-        else:
-            if not self.delivered_this_turn:
-                # Отменяем контракт с возвратом части денег и штрафом репутации
-                await self.cancel_with_refund(self.who_creator)
-                return True
+        await contract_settlement.settle(self.session_id, contracts=[self])
+        return True
 
-            self.delivered_this_turn = False
-            await self.save_to_base()
-            return True
+    async def _sync_registry(self):
+        """ Обновляет контракт в реестре сессии (после коммита транзакции) """
+        async def sync():
+            registry = await contract_registries.get(self.session_id)
+            registry.add(self)
+            if self.accepted: registry.accept(self.id)
+        await just_db.on_commit(sync)
 
     def to_dict(self) -> dict:
         return {
@@ -369,10 +375,194 @@ class Contract(BaseClass, SessionObject):
     async def delete(self):
         await just_db.delete(self.__tablename__, id=self.id)
 
+        async def remove_from_registry():
+            (await contract_registries.get(self.session_id)).remove(self.id)
+        await just_db.on_commit(remove_from_registry)
+
         await websocket_manager.broadcast({
             "type": "api-contract_deleted",
             "data": {
                     "session_id": self.session_id,
                     "contract_id": self.id
                 }
-            })
\ No newline at end of file
+            })
+
+
+def refund_for(contract: Contract) -> int:
+    """ Возврат заказчику при отмене: оплата за одну из невыполненных поставок """
+    not_executed = contract.duration_turns - contract.successful_deliveries
+    if not_executed <= 0: return 0
+    return contract.payment_amount // not_executed
+
+
+class ContractSettlement:
+    """ Расчёт всех контрактов сессии за ход.
+
+        Контракты и компании загружаются одним запросом каждый, возвраты
+        и штрафы репутации считаются в памяти по порядку id контрактов,
+        затем каждая затронутая компания изменяется одной записью ($inc
+        баланса и новая репутация), контракты сбрасываются и удаляются
+        по одному запросу, а клиентам после коммита уходит одно событие 
+        api-contracts_settled. Без replica set эти записи компенсируются 
+        через on_rollback, чтобы повтор фазы не вернул деньги дважды.
+    """
+
+    async def settle(self, session_id: str, step: Optional[int] = None,
+                     contracts: Optional[list[Contract]] = None) -> dict:
+        """ Расчёт контрактов сессии (или переданных контрактов). Возвращает сводку """
+        from game.company import Company
+
+        if contracts is None:
+            parties: list[dict] = await just_db.find(
+                "companies", session_id=session_id, projection=["id"]) # type: ignore
+            lock_ids = [c["id"] for c in parties]
+        else:
+            lock_ids = [i for c in contracts 
+                        for i in (c.supplier_company_id, c.customer_company_id)]
+
+        async with company_locks.hold(*lock_ids):
+            if contracts is None:
+                contracts = await just_db.find(
+                    Contract.__tablename__, to_class=Contract,
+                    session_id=session_id) # type: ignore
+            contracts = sorted(contracts or [], key=lambda c: c.id)
+
+            company_ids = {i for c in contracts 
+                           for i in (c.supplier_company_id, c.customer_company_id)}
+            companies: dict[int, dict] = {
+                c["id"]: c for c in await just_db.find(
+                    Company.__tablename__, id={"$in": list(company_ids)},
+                    projection=["id", "balance", "reputation"]) # type: ignore
+            } if company_ids else {}
+
+            summary: dict[str, list] = {
+                "expired": [], "cancelled": [], "reset": [], "companies": []
+            }
+            # id компании -> {"balance": ..., "income": ..., "reputation": ...}
+            deltas: dict[int, dict[str, int]] = {}
+            balances = {i: c.get("balance", 0) for i, c in companies.items()}
+            reputations = {i: c.get("reputation", 0) for i, c in companies.items()}
+
+            def change(company_id: int) -> dict[str, int]:
+                return deltas.setdefault(
+                    company_id, {"balance": 0, "income": 0, "reputation": 0})
+
+            for contract in contracts:
+                # Непринятый к концу хода контракт удаляется
+                if not contract.accepted:
+                    summary["expired"].append(contract.id)
+                    continue
+
+                if contract.delivered_this_turn:
+                    summary["reset"].append(contract.id)
+                    continue
+
+                # Поставка не выполнена - отмена с возвратом и штрафом поставщику
+                supplier_id = contract.supplier_company_id
+                customer_id = contract.customer_company_id
+                refund = refund_for(contract)
+                penalty = REPUTATION.contract.failed
+
+                if supplier_id in companies and customer_id in companies:
+                    # Те же правила, что в cancel_with_refund: если денег 
+                    # не хватает, возврат пропускается с обычным штрафом,
+                    # а нулевой возврат даёт больший штраф
+                    if balances[supplier_id] < refund:
+                        refund = 0
+                    elif not refund:
+                        penalty *= 2
+                    else:
+                        balances[supplier_id] -= refund
+                        balances[customer_id] += refund
+                        change(supplier_id)["balance"] -= refund
+                        change(customer_id)["balance"] += refund
+                        change(customer_id)["income"] += refund
+
+                    new_reputation = max(0, reputations[supplier_id] - penalty)
+                    change(supplier_id)["reputation"] += \
+                        new_reputation - reputations[supplier_id]
+                    reputations[supplier_id] = new_reputation
+                else:
+                    refund, penalty = 0, 0
+
+                summary["cancelled"].append({
+                    "contract_id": contract.id,
+                    "supplier_company_id": supplier_id,
+                    "customer_company_id": customer_id,
+                    "refund": refund,
+                    "penalty": penalty
+                })
+
+            to_prison: list[int] = []
+            for company_id, delta in sorted(deltas.items()):
+                if not any(delta.values()): continue
+
+                increments: dict[str, int] = {"balance": delta["balance"]}
+                if delta["income"]: increments["this_turn_income"] = delta["income"]
+                guard = {"balance": {"$gte": -delta["balance"]}} \
+                    if delta["balance"] < 0 else None
+
+                document = await just_db.inc(
+                    Company.__tablename__, {"id": company_id}, increments, guard,
+                    {"reputation": reputations[company_id]})
+                if document is None:
+                    # Компании заблокированы, поэтому баланс не мог измениться
+                    raise ValueError(
+                        f"Не удалось применить расчёт контрактов к компании {company_id}")
+                await just_db.on_rollback(
+                    lambda company_id=company_id, increments=increments: just_db.inc(
+                        Company.__tablename__, {"id": company_id},
+                        {key: -value for key, value in increments.items()}, None,
+                        {"reputation": companies[company_id].get("reputation", 0)}))
+
+                summary["companies"].append({
+                    "company_id": company_id,
+                    "balance_delta": delta["balance"],
+                    "new_balance": document["balance"],
+                    "reputation_delta": delta["reputation"],
+                    "new_reputation": document["reputation"]
+                })
+                if delta["reputation"] < 0 and \
+                        document["reputation"] <= REPUTATION.prison.on_reputation:
+                    to_prison.append(company_id)
+
+            if summary["reset"]:
+                await just_db.update(Contract.__tablename__,
+                                     {"id": {"$in": summary["reset"]}},
+                                     {"delivered_this_turn": False})
+                await just_db.on_rollback(
+                    lambda: just_db.update(Contract.__tablename__,
+                                           {"id": {"$in": summary["reset"]}},
+                                           {"delivered_this_turn": True}))
+
+            removed = summary["expired"] + [c["contract_id"] for c in summary["cancelled"]]
+            if removed:
+                await just_db.delete(Contract.__tablename__, id={"$in": removed})
+                await just_db.on_rollback(lambda: just_db.insert_many(
+                    Contract.__tablename__, [
+                        {key: value for key, value in contract.__dict__.items()
+                         if not key.startswith('_')}
+                        for contract in contracts if contract.id in removed
+                    ]))
+
+                async def remove_from_registry():
+                    registry = await contract_registries.get(session_id)
+                    for contract_id in removed:
+                        registry.remove(contract_id)
+                await just_db.on_commit(remove_from_registry)
+
+            for company_id in to_prison:
+                company = await Company(id=company_id).reupdate()
+                await company.to_prison()
+
+        await just_db.on_commit(lambda: websocket_manager.broadcast({
+            "type": "api-contracts_settled",
+            "data": {
+                "session_id": session_id,
+                "step": step,
+                **summary
+            }
+        }))
+        return summary
+
+contract_settlement = ContractSettlement()
@@ -0,0 +1,108 @@
+import asyncio
+import contextvars
+from typing import TYPE_CHECKING
+from modules.db import just_db
+
+if TYPE_CHECKING:
+    from game.contract import Contract
+
+
+class ContractRegistry:
+    """ Контракты одной сессии по компаниям.
+
+        Для каждой компании хранятся id контрактов, где она поставщик
+        и где заказчик, и счётчик её контрактов (принятых и ожидающих
+        принятия - оба считаются в лимит), поэтому проверка лимита
+        и выборка контрактов компании не сканируют коллекцию.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # id контракта -> (поставщик, заказчик)
+        self.parties: dict[int, tuple[int, int]] = {}
+        self.as_supplier: dict[int, set[int]] = {}
+        self.as_customer: dict[int, set[int]] = {}
+        self.counts: dict[int, int] = {}
+        self.accepted: set[int] = set()
+
+    async def load(self):
+        """ Загружает контракты сессии одним запросом """
+        contracts: list[dict] = await just_db.find(
+            "contracts", session_id=self.session_id,
+            projection=["id", "supplier_company_id", 
+                        "customer_company_id", "accepted"]) # type: ignore
+
+        for contract in contracts:
+            self._put(contract["id"], contract["supplier_company_id"],
+                      contract["customer_company_id"], contract.get("accepted", False))
+        return self
+
+    def _put(self, contract_id: int, supplier_id: int, 
+             customer_id: int, accepted: bool):
+        if accepted: self.accepted.add(contract_id)
+        if contract_id in self.parties: return
+
+        self.parties[contract_id] = (supplier_id, customer_id)
+        self.as_supplier.setdefault(supplier_id, set()).add(contract_id)
+        self.as_customer.setdefault(customer_id, set()).add(contract_id)
+        for company_id in {supplier_id, customer_id}:
+            self.counts[company_id] = self.counts.get(company_id, 0) + 1
+
+    def add(self, contract: 'Contract'):
+        self._put(contract.id, contract.supplier_company_id,
+                  contract.customer_company_id, contract.accepted)
+
+    def accept(self, contract_id: int):
+        if contract_id in self.parties: self.accepted.add(contract_id)
+
+    def remove(self, contract_id: int):
+        self.accepted.discard(contract_id)
+        parties = self.parties.pop(contract_id, None)
+        if parties is None: return
+
+        supplier_id, customer_id = parties
+        self.as_supplier.get(supplier_id, set()).discard(contract_id)
+        self.as_customer.get(customer_id, set()).discard(contract_id)
+        for company_id in {supplier_id, customer_id}:
+            self.counts[company_id] -= 1
+            if not self.counts[company_id]: del self.counts[company_id]
+
+    def count(self, company_id: int) -> int:
+        """ Количество контрактов компании (с любой стороны) """
+        return self.counts.get(company_id, 0)
+
+    def contract_ids(self, company_id: int) -> list[int]:
+        """ id контрактов компании: сначала как поставщика, затем как заказчика """
+        return sorted(self.as_supplier.get(company_id, ())) + \
+            sorted(self.as_customer.get(company_id, ()))
+
+
+class ContractRegistriesManager:
+    """ Реестры контрактов сессий, загружаются при первом обращении """
+
+    def __init__(self):
+        self.registries: dict[str, ContractRegistry] = {}
+        self._loading: dict[str, asyncio.Task] = {}
+
+    async def get(self, session_id: str) -> ContractRegistry:
+        registry = self.registries.get(session_id)
+        if registry is not None: return registry
+
+        task = self._loading.get(session_id)
+        if task is None:
+            # Загрузка в чистом контексте: не должна попасть в транзакцию вызывающего
+            task = asyncio.get_running_loop().create_task(
+                ContractRegistry(session_id).load(), context=contextvars.Context())
+            self._loading[session_id] = task
+        try:
+            registry = await asyncio.shield(task)
+        finally:
+            if task.done(): self._loading.pop(session_id, None)
+
+        self.registries.setdefault(session_id, registry)
+        return self.registries[session_id]
+
+    def drop(self, session_id: str):
+        self.registries.pop(session_id, None)
+
+contract_registries = ContractRegistriesManager()
@@ -0,0 +1,82 @@
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from game.session import Session
+
+
+def _frozen(data: Optional[dict]) -> Mapping:
+    return MappingProxyType(dict(data or {}))
+
+
+@dataclass(frozen=True)
+class ActiveEffects:
+    """ Эффекты события, действующие в сессии на текущем ходе.
+        Без активного события - нейтральные значения (множители 1.0).
+    """
+    event_id: Optional[str] = None
+    cell_type: Optional[str] = None
+
+    income_multiplier: float = 1.0
+    tasks_speed: float = 1.0
+    resource_extraction_speed: float = 1.0
+    cell_logistics: float = 1.0
+    contracts_limit_decrease: int = 0
+    tax_rate_small: Optional[float] = None
+    tax_rate_large: Optional[float] = None
+
+    increase_price: Mapping[str, float] = field(default_factory=lambda: _frozen({}))
+    increase_demand: Mapping[str, float] = field(default_factory=lambda: _frozen({}))
+
+    # Заданные эффекты события (без None) - формат Session.get_event_effects
+    raw: Mapping[str, Any] = field(default_factory=lambda: _frozen({}))
+
+    @classmethod
+    def resolve(cls, session: 'Session') -> 'ActiveEffects':
+        event = session.get_event()
+        if not event or not event.get("is_active"):
+            return cls()
+
+        raw = {k: v for k, v in event.get("effects", {}).items() if v is not None}
+
+        def value(key: str, default):
+            return raw.get(key, default)
+
+        return cls(
+            event_id=event.get("id"),
+            cell_type=event.get("cell_type"),
+            income_multiplier=value("income_multiplier", 1.0),
+            tasks_speed=value("tasks_speed", 1.0),
+            resource_extraction_speed=value("resource_extraction_speed", 1.0),
+            cell_logistics=value("cell_logistics", 1.0),
+            contracts_limit_decrease=value("contracts_limit_decrease", 0),
+            tax_rate_small=raw.get("tax_rate_small"),
+            tax_rate_large=raw.get("tax_rate_large"),
+            increase_price=_frozen(raw.get("increase_price")),
+            increase_demand=_frozen(raw.get("increase_demand")),
+            raw=_frozen(raw)
+        )
+
+
+class EventEffectsCache:
+    """ Эффекты событий сессий: вычисляются один раз на (сессия, ход).
+        Сбрасываются при установке и снятии события (set_event, clear_session_event).
+    """
+
+    def __init__(self):
+        self.entries: dict[str, tuple[int, ActiveEffects]] = {}
+
+    def get(self, session: 'Session') -> ActiveEffects:
+        entry = self.entries.get(session.session_id)
+        if entry is not None and entry[0] == session.step:
+            return entry[1]
+
+        effects = ActiveEffects.resolve(session)
+        self.entries[session.session_id] = (session.step, effects)
+        return effects
+
+    def drop(self, session_id: str):
+        self.entries.pop(session_id, None)
+
+event_effects = EventEffectsCache()
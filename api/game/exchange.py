@@ -1,12 +1,14 @@
 
 from typing import Optional, Literal
-from game.session import SessionObject
+from game.session import SessionObject, session_manager
 from global_modules.models.cells import Cells
 from global_modules.db.baseclass import BaseClass
 from modules.db import just_db
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
 from modules.function_way import *
 from modules.websocket_manager import websocket_manager
+from game.order_book import order_books
+from modules.locks import company_locks, with_company_lock
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
 CELLS: Cells = ALL_CONFIGS['cells']
@@ -113,6 +115,7 @@ class Exchange(BaseClass, SessionObject):
         self.created_at = session.step
 
         await self.insert()
+        await self._sync_order_book()
 
         # Списываем товар со склада компании только после успешного создания
         try:
@@ -132,6 +135,7 @@ class Exchange(BaseClass, SessionObject):
 
         return self
 
+    @with_company_lock("company_id")
     async def update_offer(self, 
                     sell_amount_per_trade: Optional[int] = None,
                     price: Optional[int] = None, 
@@ -165,6 +169,7 @@ class Exchange(BaseClass, SessionObject):
             self.barter_amount = barter_amount
 
         await self.save_to_base()
+        await self._sync_order_book()
 
         await websocket_manager.broadcast({
             "type": "api-exchange_offer_updated",
@@ -177,6 +182,7 @@ class Exchange(BaseClass, SessionObject):
 
         return self
 
+    @with_company_lock("company_id")
     async def cancel_offer(self):
         """ Отмена предложения (возврат товара компании) """
         from game.company import Company
@@ -218,6 +224,11 @@ class Exchange(BaseClass, SessionObject):
             buyer_company_id: ID компании-покупателя
             quantity: Количество сделок (по умолчанию 1)
         """
+        # Покупатель и продавец блокируются вместе, в едином порядке
+        async with company_locks.hold(buyer_company_id, self.company_id):
+            return await self._buy(buyer_company_id, quantity)
+
+    async def _buy(self, buyer_company_id: int, quantity: int):
         from game.company import Company
         from game.logistics import Logistics
 
@@ -241,68 +252,76 @@ class Exchange(BaseClass, SessionObject):
         # Рассчитываем количество товара
         total_sell_amount = self.sell_amount_per_trade * quantity
 
-        if total_sell_amount > self.total_stock:
-            raise ValueError(f"Недостаточно запасов. Доступно: {self.total_stock}, запрошено: {total_sell_amount}")
-
-        # Переменная для хранения цены за единицу товара (для обновления истории цен)
-        unit_price = 0
-
-        # Проверяем возможность сделки
-        if self.offer_type == 'money':
-            total_price = self.price * quantity
-            unit_price = self.price // self.sell_amount_per_trade  # Цена за единицу товара
-
-            if buyer.balance < total_price:
-                raise ValueError(f"Недостаточно денег. Требуется: {total_price}, доступно: {buyer.balance}")
-
-            # Выполняем сделку за монеты
-            buyer.balance -= total_price
-            seller.balance += total_price
-
-            await buyer.save_to_base()
-            await seller.save_to_base()
-
-        elif self.offer_type == 'barter':
-            total_barter_amount = self.barter_amount * quantity
-
-            if buyer.warehouses.get(self.barter_resource, 0) < total_barter_amount:
-                raise ValueError(f"Недостаточно '{self.barter_resource}' для бартера. Требуется: {total_barter_amount}")
-
-            # Для бартера вычисляем условную цену на основе текущих цен предметов
-            barter_resource_price = await session.get_item_price(self.barter_resource)
-            unit_price = (barter_resource_price * self.barter_amount) // self.sell_amount_per_trade
+        async def trade() -> int:
+            # Резервируем запас предложения атомарно, чтобы параллельные 
+            # покупки не продали один и тот же товар дважды
+            if not await self.inc({"total_stock": -total_sell_amount}, 
+                                  guard={"total_stock": {"$gte": total_sell_amount}}):
+                await self.reupdate()
+                raise ValueError(f"Недостаточно запасов. Доступно: {self.total_stock}, запрошено: {total_sell_amount}")
+            await just_db.on_rollback(
+                lambda: self.inc({"total_stock": total_sell_amount}))
+            await self._sync_order_book()
+
+            # Цена за единицу товара (для обновления истории цен)
+            unit_price = 0
+
+            if self.offer_type == 'money':
+                total_price = self.price * quantity
+                unit_price = self.price // self.sell_amount_per_trade  # Цена за единицу товара
+
+                # Списание проверяет баланс в том же запросе
+                try:
+                    await buyer.remove_balance(total_price)
+                except ValueError:
+                    raise ValueError(f"Недостаточно денег. Требуется: {total_price}, доступно: {buyer.balance}")
+                await seller.add_balance(total_price, 0.0)
+
+            elif self.offer_type == 'barter':
+                total_barter_amount = self.barter_amount * quantity
+
+                if buyer.warehouses.get(self.barter_resource, 0) < total_barter_amount:
+                    raise ValueError(f"Недостаточно '{self.barter_resource}' для бартера. Требуется: {total_barter_amount}")
+
+                # Для бартера вычисляем условную цену на основе текущих цен предметов
+                barter_resource_price = await session.get_item_price(self.barter_resource)
+                unit_price = (barter_resource_price * self.barter_amount) // self.sell_amount_per_trade
+
+                await Logistics().create(
+                    from_company_id=buyer.id,
+                    to_company_id=seller.id,
+                    resource_type=self.barter_resource,
+                    amount=total_barter_amount,
+                    session_id=self.session_id
+                )
 
             await Logistics().create(
-                from_company_id=buyer.id,
-                to_company_id=seller.id,
-                resource_type=self.barter_resource,
-                amount=total_barter_amount,
+                sender_no_delete=True, # Потому что товар уже списан с продавца при создании предложения
+                from_company_id=seller.id,
+                to_company_id=buyer.id,
+                resource_type=self.sell_resource,
+                amount=total_sell_amount,
                 session_id=self.session_id
             )
 
-        await Logistics().create(
-            sender_no_delete=True, # Потому что товар уже списан с продавца при создании предложения
-            from_company_id=seller.id,
-            to_company_id=buyer.id,
-            resource_type=self.sell_resource,
-            amount=total_sell_amount,
-            session_id=self.session_id
-        )
+            if unit_price > 0:
+                await session.update_item_price(self.sell_resource, unit_price)
 
-        if unit_price > 0:
-            await session.update_item_price(self.sell_resource, unit_price)
+            await seller.set_economic_power(
+                total_sell_amount, self.sell_resource, 'exchange'
+            )
 
-        await seller.set_economic_power(
-            total_sell_amount, self.sell_resource, 'exchange'
-        )
+            # Запас уже обновлён в базе при резервировании
+            if self.total_stock == 0:
+                await self.delete()
 
-        # Обновляем запас предложения
-        self.total_stock -= total_sell_amount
+            return unit_price
 
-        if self.total_stock == 0:
-            await self.delete()
-        else:
-            await self.save_to_base()
+        # Все записи сделки фиксируются одной транзакцией: 
+        # при ошибке на любом шаге не остаётся ни денег, ни товара в пути.
+        # Без replica set то же дают компенсации on_rollback у каждого 
+        # изменения (запас, баланс, склад, доставка)
+        unit_price = await just_db.transaction(trade)
 
         await websocket_manager.broadcast({
             "type": "api-exchange_trade_completed",
@@ -324,6 +343,167 @@ class Exchange(BaseClass, SessionObject):
 
         return self
 
+    @staticmethod
+    async def market_buy(session_id: str, 
+                         buyer_company_id: int, 
+                         resource: str, 
+                         amount: int,
+                         max_unit_price: Optional[int] = None) -> dict:
+        """ Рыночная покупка: набирает amount единиц ресурса из денежных 
+            предложений, начиная с самых дешёвых, одной транзакцией.
+
+            Предложения продаются только целыми комплектами, поэтому 
+            куплено может быть меньше запрошенного. Для каждого продавца 
+            создаётся одна общая доставка, цена ресурса обновляется один 
+            раз средневзвешенной по объёму ценой.
+
+        Args:
+            session_id: ID сессии
+            buyer_company_id: ID компании-покупателя
+            resource: Покупаемый ресурс
+            amount: Желаемое количество единиц
+            max_unit_price: Максимальная цена за единицу (без ограничения, если None)
+        """
+        from game.company import Company
+        from game.logistics import Logistics
+
+        if amount <= 0:
+            raise ValueError("Количество должно быть положительным.")
+
+        if RESOURCES.get_resource(resource) is None:
+            raise ValueError(f"Ресурс '{resource}' не существует.")
+
+        if not await session_manager.get_session(session_id):
+            raise ValueError("Сессия не найдена.")
+
+        book = await order_books.get(session_id)
+        candidates = [
+            offer for offer in book.best_offers(resource, 'money', None)
+            if offer["company_id"] != buyer_company_id and (
+                max_unit_price is None or offer["unit_price"] <= max_unit_price)
+        ]
+        if not candidates:
+            raise ValueError("Нет подходящих предложений.")
+
+        sellers_ids = {offer["company_id"] for offer in candidates}
+
+        async with company_locks.hold(buyer_company_id, *sellers_ids):
+            buyer = await Company(id=buyer_company_id).reupdate()
+            if not buyer or buyer.session_id != session_id:
+                raise ValueError("Компания покупателя не найдена в сессии.")
+
+            session = await buyer.get_session_or_error()
+
+            async def fill() -> dict:
+                await buyer.reupdate()
+                balance_left = buyer.balance
+                remaining = amount
+
+                fills: list[dict] = []
+                # продавец -> [единиц товара, выручка]
+                by_seller: dict[int, list[int]] = {}
+                # Опустевшие предложения удаляются после всех списаний:
+                # без replica set удаление нельзя откатить компенсацией
+                emptied: list[Exchange] = []
+
+                for candidate in candidates:
+                    if remaining <= 0: break
+
+                    offer = await Exchange(id=candidate["id"]).reupdate()
+                    if not offer.session_id or offer.sell_amount_per_trade <= 0 or offer.price <= 0:
+                        continue
+
+                    per_trade = offer.sell_amount_per_trade
+                    trades = min(
+                        remaining // per_trade,
+                        offer.total_stock // per_trade,
+                        balance_left // offer.price
+                    )
+                    if trades <= 0: continue
+
+                    units = trades * per_trade
+                    if not await offer.inc({"total_stock": -units}, 
+                                           guard={"total_stock": {"$gte": units}}):
+                        continue
+                    await just_db.on_rollback(
+                        lambda offer=offer, units=units: offer.inc({"total_stock": units}))
+                    await offer._sync_order_book()
+
+                    cost = trades * offer.price
+                    remaining -= units
+                    balance_left -= cost
+
+                    seller_total = by_seller.setdefault(offer.company_id, [0, 0])
+                    seller_total[0] += units
+                    seller_total[1] += cost
+
+                    fills.append({
+                        "offer_id": offer.id,
+                        "seller_id": offer.company_id,
+                        "amount": units,
+                        "price": cost
+                    })
+
+                    if offer.total_stock == 0:
+                        emptied.append(offer)
+
+                if not fills:
+                    raise ValueError("Не удалось купить ни одного комплекта.")
+
+                total_units = sum(f["amount"] for f in fills)
+                total_cost = sum(f["price"] for f in fills)
+
+                # Одно списание с покупателя на всю сделку
+                await buyer.remove_balance(total_cost)
+
+                for seller_id, (units, revenue) in by_seller.items():
+                    seller = await Company(id=seller_id).reupdate()
+                    await seller.add_balance(revenue, 0.0)
+
+                    # Одна доставка на продавца
+                    await Logistics().create(
+                        sender_no_delete=True, # Товар списан с продавца при создании предложений
+                        from_company_id=seller_id,
+                        to_company_id=buyer.id,
+                        resource_type=resource,
+                        amount=units,
+                        session_id=session_id
+                    )
+                    await seller.set_economic_power(units, resource, 'exchange')
+
+                # Средневзвешенная по объёму цена за единицу
+                vwap = total_cost // total_units
+                if vwap > 0:
+                    await session.update_item_price(resource, vwap)
+
+                for offer in emptied:
+                    await offer.delete()
+
+                return {
+                    "session_id": session_id,
+                    "buyer_company_id": buyer.id,
+                    "resource": resource,
+                    "requested": amount,
+                    "amount": total_units,
+                    "total_price": total_cost,
+                    "unit_price": vwap,
+                    "fills": fills
+                }
+
+            result = await just_db.transaction(fill)
+
+        await websocket_manager.broadcast({
+            "type": "api-exchange_market_buy_completed",
+            "data": result
+        })
+        return result
+
+    async def _sync_order_book(self):
+        """ Обновляет предложение в стакане сессии (после коммита транзакции) """
+        async def sync():
+            (await order_books.get(self.session_id)).upsert(self)
+        await just_db.on_commit(sync)
+
     def to_dict(self) -> dict:
         """ Преобразование предложения в словарь """
         return {
@@ -344,6 +524,10 @@ class Exchange(BaseClass, SessionObject):
         """ Удаление предложения из базы данных """
         await just_db.delete(self.__tablename__, **{self.__unique_id__: self.id})
 
+        async def remove_from_book():
+            (await order_books.get(self.session_id)).remove(self.id)
+        await just_db.on_commit(remove_from_book)
+
         await websocket_manager.broadcast({
             "type": "api-exchange_offer_deleted",
             "data": {
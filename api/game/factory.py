@@ -7,6 +7,8 @@ from modules.db import just_db
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
 from modules.function_way import *
 from modules.websocket_manager import websocket_manager
+from modules.locks import with_company_lock
+from modules.logs import game_logger
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
 CELLS: Cells = ALL_CONFIGS['cells']
@@ -15,6 +17,28 @@ SETTINGS: Settings = ALL_CONFIGS['settings']
 CAPITAL: Capital = ALL_CONFIGS['capital']
 REPUTATION: Reputation = ALL_CONFIGS['reputation']
 
+def rekit_stages(old_complectation: Optional[str], new_complectation: str) -> int:
+    """ Сколько ходов займёт перекомплектация """
+    old_level = 0
+    if old_complectation is not None:
+        old_level = RESOURCES.get_resource(old_complectation).lvl # type: ignore
+
+    new_level = RESOURCES.get_resource(new_complectation).lvl # type: ignore
+
+    if new_level > old_level:
+        return new_level - old_level
+    return new_level
+
+def validate_complectation(complectation: str) -> Resource:
+    """ Ресурс, который могут производить фабрики """
+    resource = RESOURCES.get_resource(complectation)
+    if complectation not in RESOURCES.resources or resource is None:
+        raise ValueError("Неверный тип комплектации.")
+    if resource.raw:
+        raise ValueError("Невозможно производить сырьевые ресурсы.")
+    return resource
+
+
 class Factory(BaseClass, SessionObject):
 
     __tablename__ = "factories"
@@ -67,7 +91,16 @@ class Factory(BaseClass, SessionObject):
     async def is_working(self) -> bool:
         """ Проверка, работает ли фабрика
         """
+        if not self._can_work(): return False
+
+        if not await self.check_materials(): # Если нет материалов
+            return False
 
+        return True
+
+    def _can_work(self) -> bool:
+        """ Проверка состояния фабрики без учёта материалов
+        """
         if self.complectation_stages > 0: # Если идёт перекомплектация
             return False
 
@@ -77,38 +110,15 @@ class Factory(BaseClass, SessionObject):
         if not self.produce and not self.is_auto: # Если не производит и не авто
             return False
 
-        if not await self.check_materials(): # Если нет материалов
-            return False
-
         return True
 
+    @with_company_lock("company_id")
     async def pere_complete(self, new_complectation: str):
         """ Перекомплектация фабрики
         """
-        if new_complectation not in RESOURCES.resources:
-            raise ValueError("Неверный тип комплектации.")
-
-        # Проверяем, что ресурс не является сырьем
-        new_resource = RESOURCES.get_resource(new_complectation)
-        if new_resource is None:
-            raise ValueError("Ресурс не найден.")
-        
-        if new_resource.raw:
-            raise ValueError("Невозможно производить сырьевые ресурсы.")
-
-        # Получаем уровни старой и новой комплектации
-        old_level = 0
-        if self.complectation is not None:
-            old_level = RESOURCES.get_resource(self.complectation).lvl # type: ignore
-
-        new_level = new_resource.lvl # type: ignore
-
-        # Рассчитываем время перекомплектации
-        if new_level > old_level:
-            self.complectation_stages = new_level - old_level
-        else:
-            self.complectation_stages = new_level
+        new_resource = validate_complectation(new_complectation)
 
+        self.complectation_stages = rekit_stages(self.complectation, new_complectation)
         self.complectation = new_complectation
         production: Production = new_resource.production # type: ignore
         self.progress = [0, production.turns]
@@ -135,69 +145,10 @@ class Factory(BaseClass, SessionObject):
         if not session:
             return False
 
-        # Этап комплектации
-        if self.complectation_stages > 0:
-            self.complectation_stages -= 1
-            await self.save_to_base()
-
-            if self.complectation_stages == 0:
-                await websocket_manager.broadcast({
-                    "type": "api-factory-end-complectation",
-                    "data": {
-                        'factory_id': self.id,
-                        'company_id': self.company_id
-                    }
-                })
-
-        # Этап производства
-        elif await self.is_working:
-            resource = RESOURCES.get_resource(self.complectation) # type: ignore
-
-            # Снимаем материалы со склада компании при первом ходе производства
-            if self.progress[0] == 0:
-                materials = resource.production.materials # type: ignore
-
-                for mat, qty in materials.items():
-                    try:
-                        await company.remove_resource(mat, qty)
-                    except Exception as e:
-                        return False
-
-            tasks_speed = session.get_event_effects().get(
-                'tasks_speed', 1.0
-            )
-            self.progress[0] += tasks_speed
-
-            # Если производство завершено - добавляем ресурсы на склад компании
-            if self.progress[0] >= self.progress[1]:
-                output = resource.production.output # type: ignore
-
-                # Добавляем продукцию на склад компании
-                if self.complectation:
-                    await company.add_resource(
-                            self.complectation, output,
-                            max_space=True)
-                    self.produced += output
-
-                self.progress[0] = 0
-
-                # Если авто, то проверяем материалы и продолжаем производство, если есть материалы
-                if self.is_auto and await self.check_materials():
-                    self.produce = True
-                else:
-                    self.produce = False
-
-                await websocket_manager.broadcast({
-                    "type": "api-factory-end-production",
-                    "data": {
-                        'factory_id': self.id,
-                        'company_id': self.company_id
-                    }
-                })
-
-            await self.save_to_base()
+        await FactoryFleet([self]).on_new_game_stage(company, session)
         return True
 
+    @with_company_lock("company_id")
     async def set_produce(self, produce: bool):
         """ Установка статуса производства фабрики
         """
@@ -207,6 +158,7 @@ class Factory(BaseClass, SessionObject):
         else:
             raise ValueError("Нельзя изменить статус производства во время производства.")
 
+    @with_company_lock("company_id")
     async def set_auto(self, is_auto: bool):
         """ Установка статуса автоматического производства фабрики
         """
@@ -218,6 +170,15 @@ class Factory(BaseClass, SessionObject):
         """
         from game.company import Company
 
+        if self.complectation is None:
+            raise ValueError("Комплектация не установлена.")
+
+        company = await Company(self.company_id).reupdate()
+        return self.materials_in(company.warehouses)
+
+    def materials_in(self, warehouses: dict) -> bool:
+        """ Проверка наличия материалов на переданном складе (без запросов к базе)
+        """
         if self.complectation is None:
             raise ValueError("Комплектация не установлена.")
 
@@ -225,19 +186,24 @@ class Factory(BaseClass, SessionObject):
         if not resource.production: return False
 
         materials = resource.production.materials # type: ignore
-
-        company = await Company(self.company_id).reupdate()
-        all_good = True
         for mat, qty in materials.items():
-            if company.warehouses.get(mat, 0) < qty:
-                all_good = False
-                break
-
-        return all_good
+            if warehouses.get(mat, 0) < qty:
+                return False
+        return True
 
     async def to_dict(self) -> dict:
         """ Получение статуса фабрики
         """
+        from game.company import Company
+
+        company = await Company(self.company_id).reupdate()
+        return self.serialize(company.warehouses)
+
+    def serialize(self, warehouses: dict) -> dict:
+        """ Статус фабрики по уже загруженному складу компании (без запросов к базе)
+        """
+        has_materials = self.materials_in(warehouses) if self.complectation else False
+
         return {
             "id": self.id,
             "company_id": self.company_id,
@@ -246,8 +212,8 @@ class Factory(BaseClass, SessionObject):
             "produce": self.produce,
             "is_auto": self.is_auto,
             "complectation_stages": self.complectation_stages,
-            "is_working": await self.is_working,
-            "check_materials": await self.check_materials() if self.complectation else False
+            "is_working": self._can_work() and has_materials,
+            "check_materials": has_materials
         }
 
     async def delete(self):
@@ -267,4 +233,279 @@ class Factory(BaseClass, SessionObject):
             }
         })
 
-        return True
\ No newline at end of file
+        return True
+
+
+class FactoryFleet:
+    """ Фабрики одной компании, сгруппированные по (комплектация, состояние).
+
+        Состояния: rekit - идёт перекомплектация, running - производство
+        уже начато (материалы списаны), start - готова начать производство,
+        idle - не производит. Расход материалов и выпуск считаются сразу
+        для всей группы, склад компании изменяется одним $inc, состояние
+        фабрик записывается одним bulk_write. Без replica set обе записи
+        компенсируются через on_rollback, а событие api-factories_turn 
+        уходит после коммита.
+    """
+
+    def __init__(self, factories: list[Factory]):
+        self.factories = sorted(factories, key=lambda f: f.id)
+        self.groups: dict[tuple[Optional[str], str], list[Factory]] = {}
+        for factory in self.factories:
+            self.groups.setdefault(
+                (factory.complectation, self.state_of(factory)), []).append(factory)
+
+    @staticmethod
+    def state_of(factory: Factory) -> str:
+        if factory.complectation_stages > 0: return "rekit"
+        if not factory._can_work(): return "idle"
+        if factory.progress[0] > 0: return "running"
+        return "start"
+
+    @staticmethod
+    def turn_fields(factory: Factory) -> dict:
+        """ Поля фабрики, изменяемые за ход """
+        return {
+            "complectation_stages": factory.complectation_stages,
+            "progress": list(factory.progress),
+            "produce": factory.produce,
+            "produced": factory.produced
+        }
+
+    def summary(self) -> list[dict]:
+        """ Группы фабрик: количество, id и прогресс каждой фабрики группы """
+        return [
+            {
+                "complectation": complectation,
+                "state": state,
+                "count": len(group),
+                "ids": [f.id for f in group],
+                "progress": [f.progress[0] for f in group],
+                "target": group[0].progress[1],
+                "is_auto": sum(f.is_auto for f in group)
+            }
+            for (complectation, state), group in sorted(
+                self.groups.items(), key=lambda item: (str(item[0][0]), item[0][1]))
+        ]
+
+    async def on_new_game_stage(self, company, session) -> dict:
+        """ Ход всех фабрик компании. Возвращает сводку хода """
+        from game.company import warehouse_space_guard
+
+        tasks_speed = session.effects.tasks_speed
+        warehouses = dict(company.warehouses)
+        max_size = await company.get_max_warehouse_size()
+
+        consumed: dict[str, int] = {}
+        output: dict[str, int] = {}
+        changed: list[Factory] = []
+        working: list[Factory] = []
+        summary: dict[str, list] = {"end_complectation": [], "end_production": []}
+        # Состояние фабрик до хода - для компенсаций
+        before = {factory.id: self.turn_fields(factory) for factory in self.factories}
+
+        for (complectation, state), group in self.groups.items():
+            if state == "rekit":
+                for factory in group:
+                    factory.complectation_stages -= 1
+                    if factory.complectation_stages == 0:
+                        summary["end_complectation"].append(factory.id)
+                changed.extend(group)
+
+            elif state == "running":
+                # Материалы списаны при запуске - производство продолжается
+                working.extend(group)
+
+            elif state == "start":
+                # Сколько фабрик группы можно обеспечить материалами
+                production = RESOURCES.get_resource(complectation).production # type: ignore
+                if not production: continue
+
+                can_start = len(group)
+                for mat, qty in production.materials.items():
+                    can_start = min(can_start, warehouses.get(mat, 0) // qty)
+                if can_start <= 0: continue
+
+                for mat, qty in production.materials.items():
+                    warehouses[mat] -= qty * can_start
+                    consumed[mat] = consumed.get(mat, 0) + qty * can_start
+                working.extend(group[:can_start])
+
+        free_space = max_size - sum(warehouses.values())
+        finished: list[Factory] = []
+        for factory in sorted(working, key=lambda f: f.id):
+            factory.progress[0] += tasks_speed
+            changed.append(factory)
+            if factory.progress[0] < factory.progress[1]: continue
+
+            # Производство завершено - продукция на склад (сколько поместится)
+            amount = RESOURCES.get_resource(factory.complectation).production.output # type: ignore
+            stored = max(0, min(amount, free_space))
+            if stored:
+                free_space -= stored
+                warehouses[factory.complectation] = warehouses.get(factory.complectation, 0) + stored # type: ignore
+                output[factory.complectation] = output.get(factory.complectation, 0) + stored # type: ignore
+            factory.produced += amount
+            factory.progress[0] = 0
+            finished.append(factory)
+
+        # Авто-фабрики продолжают, если на складе есть материалы на следующий запуск
+        for factory in finished:
+            factory.produce = factory.is_auto and factory.materials_in(warehouses)
+            summary["end_production"].append(factory.id)
+
+        increments = {f"warehouses.{mat}": -qty for mat, qty in consumed.items()}
+        for resource, qty in output.items():
+            key = f"warehouses.{resource}"
+            increments[key] = increments.get(key, 0) + qty
+        increments = {key: value for key, value in increments.items() if value}
+
+        if increments:
+            guard = {f"warehouses.{mat}": {"$gte": qty} for mat, qty in consumed.items()}
+            added = sum(increments.values())
+            if added > 0:
+                guard.update(warehouse_space_guard(max_size - added))
+
+            if not await company.inc(increments, guard=guard):
+                # Склад изменился в обход блокировки - ход фабрик пропускается
+                await company.reupdate()
+                game_logger.warning(f"Склад компании {company.name} ({company.id}) изменился во время хода фабрик, ход фабрик пропущен.")
+                return summary
+            await just_db.on_rollback(lambda: company.inc(
+                {key: -value for key, value in increments.items()}))
+
+            empty = [key for key in increments 
+                     if company.warehouses.get(key.split('.', 1)[1]) == 0]
+            for key in empty:
+                # Удаляем пустую позицию, только если её не пополнили параллельно
+                await just_db.unset(company.__tablename__, 
+                                    {"id": company.id, key: 0}, [key])
+                company.warehouses.pop(key.split('.', 1)[1], None)
+
+        if changed:
+            await just_db.bulk_update(Factory.__tablename__, [
+                ({"id": factory.id}, self.turn_fields(factory))
+                for factory in changed
+            ])
+            await just_db.on_rollback(lambda: just_db.bulk_update(
+                Factory.__tablename__, [
+                    ({"id": factory.id}, before[factory.id]) for factory in changed
+                ]))
+
+        if changed or increments:
+            await just_db.on_commit(lambda: websocket_manager.broadcast({
+                "type": "api-factories_turn",
+                "data": {
+                    "company_id": company.id,
+                    "consumed": consumed,
+                    "output": output,
+                    **summary
+                }
+            }))
+        return summary
+
+
+# Массовые операции: один отфильтрованный update_many на операцию.
+# Вызываются под блокировкой компании (lock_companies в обработчиках).
+
+async def bulk_rekit(company_id: int, new_complectation: str, count: int,
+                     find_complectation: Optional[str] = None,
+                     produce_status: Optional[bool] = False,
+                     is_auto: Optional[bool] = None) -> dict:
+    """ Перекомплектация до count фабрик компании с комплектацией 
+        find_complectation (None - без комплектации) и produce == produce_status
+        (None - без фильтра). is_auto - установить авто-режим тем же запросом.
+    """
+    new_resource = validate_complectation(new_complectation)
+    if not isinstance(count, int) or count <= 0:
+        raise ValueError("Количество должно быть положительным целым числом.")
+
+    conditions: dict = {"company_id": company_id, "complectation": find_complectation}
+    if produce_status is not None: conditions["produce"] = produce_status
+
+    # id выбираются одним запросом, т.к. update_many не ограничивает количество
+    found: list[dict] = await just_db.find(
+        Factory.__tablename__, sort=[("id", 1)], limit=count,
+        projection=["id"], **conditions) # type: ignore
+    ids = [f["id"] for f in found]
+    if not ids:
+        return {"updated": 0, "factory_ids": []}
+
+    production: Production = new_resource.production # type: ignore
+    updates: dict = {
+        "complectation": new_complectation,
+        "complectation_stages": rekit_stages(find_complectation, new_complectation),
+        "progress": [0, production.turns if production else 0]
+    }
+    if is_auto is not None: updates["is_auto"] = is_auto
+
+    updated = await just_db.update(Factory.__tablename__, 
+                                   {**conditions, "id": {"$in": ids}}, updates)
+
+    await websocket_manager.broadcast({
+        "type": "api-factories-bulk-complectation",
+        "data": {
+            "company_id": company_id,
+            "factory_ids": ids,
+            "complectation": new_complectation,
+            "complectation_stages": updates["complectation_stages"]
+        }
+    })
+    return {"updated": updated, "factory_ids": ids, 
+            "complectation_stages": updates["complectation_stages"]}
+
+async def bulk_set_produce(company_id: int, produce: bool,
+                           complectation: Optional[str] = None) -> dict:
+    """ Запуск / остановка производства фабрик компании с комплектацией 
+        complectation (None - всех скомплектованных). Изменяются только 
+        фабрики вне перекомплектации и без начатого производства 
+        (как в Factory.set_produce).
+    """
+    if complectation is not None and complectation not in RESOURCES.resources:
+        raise ValueError("Неверный тип комплектации.")
+
+    conditions: dict = {
+        "company_id": company_id,
+        "complectation": complectation if complectation is not None else {"$ne": None},
+        "complectation_stages": 0,
+        "progress.0": 0,
+        "produce": not produce
+    }
+    updated = await just_db.update(Factory.__tablename__, conditions, {"produce": produce})
+
+    if updated:
+        await websocket_manager.broadcast({
+            "type": "api-factories-bulk-produce",
+            "data": {
+                "company_id": company_id,
+                "complectation": complectation,
+                "produce": produce,
+                "updated": updated
+            }
+        })
+    return {"updated": updated}
+
+async def bulk_set_auto(company_id: int, is_auto: bool,
+                        complectation: Optional[str] = None) -> dict:
+    """ Включение / выключение авто-производства фабрик компании 
+        с комплектацией complectation (None - всех фабрик)
+    """
+    conditions: dict = {"company_id": company_id, "is_auto": not is_auto}
+    if complectation is not None:
+        if complectation not in RESOURCES.resources:
+            raise ValueError("Неверный тип комплектации.")
+        conditions["complectation"] = complectation
+
+    updated = await just_db.update(Factory.__tablename__, conditions, {"is_auto": is_auto})
+
+    if updated:
+        await websocket_manager.broadcast({
+            "type": "api-factories-bulk-auto",
+            "data": {
+                "company_id": company_id,
+                "complectation": complectation,
+                "is_auto": is_auto,
+                "updated": updated
+            }
+        })
+    return {"updated": updated}
@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import json
+import zlib
+from datetime import datetime
+from typing import Optional
+from modules.db import just_db
+from modules.logs import game_logger
+
+HISTORY_TABLE = "game_history"
+
+# Поля компаний, которые сохраняются в снимке хода (столбцами)
+COMPANY_FIELDS = ("balance", "reputation", "economic_power", "warehouses")
+HISTORY_FIELDS = (*COMPANY_FIELDS, "prices", "demands")
+
+
+def pack(data: dict) -> bytes:
+    return zlib.compress(
+        json.dumps(data, separators=(",", ":")).encode(), 6)
+
+def unpack(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob))
+
+
+async def build_snapshot(session_id: str, step: int) -> dict:
+    """ Снимок состояния сессии в столбцовом виде:
+        компании и города - списки id и параллельные списки значений
+    """
+    from game.price_graph import session_prices
+
+    companies: list[dict] = await just_db.find(
+        "companies", session_id=session_id, sort=[("id", 1)],
+        projection=["id", *COMPANY_FIELDS]) # type: ignore
+    cities: list[dict] = await just_db.find(
+        "cities", session_id=session_id, sort=[("id", 1)],
+        projection=["id", "demands"]) # type: ignore
+    prices = await session_prices.get(session_id, step)
+
+    return {
+        "companies": {
+            "id": [c["id"] for c in companies],
+            **{field: [c.get(field) for c in companies] for field in COMPANY_FIELDS}
+        },
+        "cities": {
+            "id": [c["id"] for c in cities],
+            "demands": [c.get("demands", {}) for c in cities]
+        },
+        "prices": prices.prices_dict()
+    }
+
+async def write_snapshot(session_id: str, step: int):
+    """ Записывает снимок хода (повторная запись хода заменяет прежнюю) """
+    data = pack(await build_snapshot(session_id, step))
+
+    await just_db.delete(HISTORY_TABLE, session_id=session_id, step=step)
+    await just_db.insert(HISTORY_TABLE, {
+        "session_id": session_id,
+        "step": step,
+        "data": data,
+        "created_at": datetime.now()
+    })
+
+
+class HistoryWriter:
+    """ Фоновая запись снимков ходов: update_stage только ставит задачу
+        и не ждёт чтения коллекций и сжатия.
+    """
+
+    def __init__(self):
+        self._tasks: set[asyncio.Task] = set()
+
+    def schedule(self, session_id: str, step: int):
+        # Чистый контекст: снимок не должен попасть в транзакцию вызывающего
+        task = asyncio.get_running_loop().create_task(
+            self._write(session_id, step), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _write(self, session_id: str, step: int):
+        try:
+            await write_snapshot(session_id, step)
+        except Exception as e:
+            game_logger.error(f"Не удалось записать историю хода {step} сессии {session_id}: {e}")
+
+    async def wait(self):
+        """ Дождаться записи всех поставленных снимков """
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+history_writer = HistoryWriter()
+
+
+async def get_history(session_id: str,
+                      fields: Optional[list[str]] = None,
+                      companies: Optional[list[int]] = None,
+                      cities: Optional[list[int]] = None,
+                      items: Optional[list[str]] = None,
+                      from_step: Optional[int] = None,
+                      to_step: Optional[int] = None) -> dict:
+    """ Временные ряды по снимкам ходов (без обращения к живым коллекциям).
+
+        fields - поля из HISTORY_FIELDS (по умолчанию все),
+        companies / cities / items - фильтры по id (по умолчанию все).
+        Возвращает {"steps": [...], "companies": {id: {поле: [значения по ходам]}},
+        "cities": {id: {"demands": [...]}}, "prices": {предмет: [...]}}.
+        Если объекта не было на каком-то ходу, значение - None.
+    """
+    if fields is None: fields = list(HISTORY_FIELDS)
+    for field in fields:
+        if field not in HISTORY_FIELDS:
+            raise ValueError(f"Неизвестное поле истории: {field}. Доступны: {', '.join(HISTORY_FIELDS)}")
+
+    step_filter = {}
+    if from_step is not None: step_filter["$gte"] = from_step
+    if to_step is not None: step_filter["$lte"] = to_step
+
+    records: list[dict] = await just_db.find(
+        HISTORY_TABLE, session_id=session_id, sort=[("step", 1)],
+        **({"step": step_filter} if step_filter else {})) # type: ignore
+
+    company_fields = [f for f in fields if f in COMPANY_FIELDS]
+    result: dict = {"steps": [], "companies": {}, "cities": {}, "prices": {}}
+
+    for n, record in enumerate(records):
+        snapshot = unpack(record["data"])
+        result["steps"].append(record["step"])
+
+        if company_fields:
+            columns = snapshot["companies"]
+            for i, company_id in enumerate(columns["id"]):
+                if companies is not None and company_id not in companies: continue
+
+                series = result["companies"].setdefault(
+                    company_id, {f: [None] * n for f in company_fields})
+                for field in company_fields:
+                    series[field].append(columns[field][i])
+
+        if "demands" in fields:
+            columns = snapshot["cities"]
+            for i, city_id in enumerate(columns["id"]):
+                if cities is not None and city_id not in cities: continue
+
+                result["cities"].setdefault(
+                    city_id, {"demands": [None] * n})["demands"].append(columns["demands"][i])
+
+        if "prices" in fields:
+            for item_id, price in snapshot["prices"].items():
+                if items is not None and item_id not in items: continue
+                result["prices"].setdefault(item_id, [None] * n).append(price)
+
+        # Объекты, которых нет в этом снимке, получают None
+        for group in (result["companies"], result["cities"]):
+            for series in group.values():
+                for values in series.values():
+                    if len(values) == n: values.append(None)
+        for values in result["prices"].values():
+            if len(values) == n: values.append(None)
+
+    return result
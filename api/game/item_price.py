@@ -14,10 +14,16 @@ SETTINGS: Settings = ALL_CONFIGS['settings']
 CAPITAL: Capital = ALL_CONFIGS['capital']
 REPUTATION: Reputation = ALL_CONFIGS['reputation']
 
-RESET = 100
-ON_EVERY = 2
+RESET = 100 # Ёмкость кольцевого буфера истории цен
+ON_EVERY = 2 # Каждое ON_EVERY-е значение в истории - базовая цена (тянет цену к базовой)
 
 class ItemPrice(BaseClass, SessionObject):
+    """ Цена предмета в сессии
+
+        История цен хранится кольцевым буфером на RESET значений с 
+        поддерживаемой суммой, поэтому средняя цена считается за O(1), 
+        а при сделке в базу пишутся только изменённые поля.
+    """
 
     __tablename__ = "item_price"
     __unique_id__ = "id"
@@ -26,7 +32,10 @@ class ItemPrice(BaseClass, SessionObject):
     def __init__(self, id: str = ""):
         self.id: str = id
         self.session_id: str = ""
-        self.prices: list[int] = []
+        self.prices: list[int] = [] # Кольцевой буфер истории цен
+        self.prices_head: int = 0 # Индекс следующей записи в буфере
+        self.prices_sum: int = 0 # Сумма значений в буфере
+        self.pushes: int = 0 # Всего добавлено значений в историю
         self.current_price: int = 0
         self.material_based_price: int = 0
 
@@ -36,38 +45,91 @@ class ItemPrice(BaseClass, SessionObject):
         self.session_id = session_id
 
         self.current_price = RESOURCES.resources[item_id].basePrice
-        self.prices = [self.current_price]
+        self._push(self.current_price, {})
         self.material_based_price = await self.calculate_material_price()
 
         await self.insert()
         return self
 
+    async def reupdate(self):
+        """ Цены предметов уникальны только в паре (id, session_id) """
+        self.load_from_base(
+            await just_db.find_one(self.__tablename__, 
+                                   id=self.id, session_id=self.session_id)
+        )
+        return self
+
+    async def save_to_base(self):
+        data_to_save = {key: value for key, value in self.__dict__.items() if not key.startswith('_')}
+        await just_db.update(self.__tablename__, 
+                             {"id": self.id, "session_id": self.session_id},
+                             data_to_save)
+
     async def delete(self):
         await just_db.delete(self.__tablename__, id=self.id, session_id=self.session_id)
         return True
 
+    def history(self) -> list[int]:
+        """ История цен в хронологическом порядке """
+        if len(self.prices) < RESET: return list(self.prices)
+        return self.prices[self.prices_head:] + self.prices[:self.prices_head]
+
+    def average_price(self) -> float:
+        if not self.prices: return float(self.current_price)
+        return self.prices_sum / len(self.prices)
+
     def to_dict(self):
         return {
             "id": self.id,
             "session_id": self.session_id,
-            "prices": self.prices,
+            "prices": self.history(),
             "current_price": self.current_price,
             "material_based_price": self.material_based_price
         }
 
+    def _push(self, value: int, changes: dict):
+        """ Добавляет значение в кольцевой буфер, изменённые поля пишет в changes """
+        if len(self.prices) < RESET:
+            index = len(self.prices)
+            self.prices.append(value)
+        else:
+            index = self.prices_head
+            self.prices_sum -= self.prices[index]
+            self.prices[index] = value
+
+        self.prices_sum += value
+        self.prices_head = (index + 1) % RESET
+        self.pushes += 1
+        changes[f"prices.{index}"] = value
+
+    def _ensure_ring(self, changes: dict):
+        """ Переводит историю, сохранённую обычным списком, в кольцевой буфер """
+        if self.pushes or not self.prices: return
+
+        self.prices = self.prices[-RESET:]
+        self.prices_head = len(self.prices) % RESET
+        self.prices_sum = sum(self.prices)
+        self.pushes = len(self.prices)
+        changes["prices"] = self.prices
+
     async def calculate_material_price(self) -> int:
         resource = RESOURCES.resources.get(self.id)
         if not resource or not resource.production:
             return 0
 
+        materials = resource.production.materials
+        # Цены всех материалов одним запросом
+        materials_prices: dict[str, ItemPrice] = {
+            price.id: price for price in await just_db.find(
+                "item_price", to_class=ItemPrice,
+                id={"$in": list(materials.keys())}, 
+                session_id=self.session_id
+            ) # type: ignore
+        }
+
         total_cost = 0
-        for mat_id, qty in resource.production.materials.items():
-            mat_price_obj = cast(ItemPrice, 
-                                 await just_db.find_one("item_price", 
-                                        id=mat_id, 
-                                        session_id=self.session_id, 
-                                        to_class=ItemPrice
-                                        ))
+        for mat_id, qty in materials.items():
+            mat_price_obj = materials_prices.get(mat_id)
             if mat_price_obj:
                 mat_price = mat_price_obj.get_effective_price()
             else:
@@ -81,37 +143,40 @@ class ItemPrice(BaseClass, SessionObject):
 
     def get_effective_price(self) -> int:
         if self.material_based_price > 0 and self.prices:
-            avg_price = sum(self.prices) / len(self.prices)
-
-            if self.material_based_price > avg_price:
+            if self.material_based_price > self.average_price():
                 return self.material_based_price
 
         return self.current_price
 
-    async def add_price(self, new_price: int):
-        self.prices.append(new_price)
-
-        if len(self.prices) % ON_EVERY == 0:
-            base_price = RESOURCES.resources[self.id].basePrice
-            self.prices.append(base_price)
+    def record_price(self, new_price: int) -> dict:
+        """ Добавляет цену сделки в историю и пересчитывает текущую цену.
+            Возвращает изменённые поля для $set (без material_based_price).
+        """
+        changes: dict = {}
+        self._ensure_ring(changes)
+
+        self._push(new_price, changes)
+        if self.pushes % ON_EVERY == 0:
+            self._push(RESOURCES.resources[self.id].basePrice, changes)
+
+        self.current_price = int(self.average_price())
+
+        if "prices" in changes:
+            # Буфер переписывается целиком - отдельные ячейки не нужны
+            changes = {k: v for k, v in changes.items() if not k.startswith("prices.")}
+            changes["prices"] = self.prices
+
+        # Только изменённые ячейки буфера и счётчики
+        changes.update({
+            "prices_head": self.prices_head,
+            "prices_sum": self.prices_sum,
+            "pushes": self.pushes,
+            "current_price": self.current_price
+        })
+        return changes
 
-        if len(self.prices) > RESET:
-            # Вычислить среднее из REST элементов и начать заново
-            avg_price = int(sum(self.prices) / len(self.prices))
-            self.prices = [avg_price]
-
-        self.current_price = int(
-            sum(self.prices) / len(self.prices)
-            )
+    async def add_price(self, new_price: int):
+        """ Цена сделки с пересчётом зависимых цен (см. PriceGraph) """
+        from game.price_graph import session_prices
 
-        self.material_based_price = await self.calculate_material_price()
-        await self.save_to_base()
-
-        await websocket_manager.broadcast({
-            "type": "api-item_price_updated",
-            "data": {
-                "item_id": self.id,
-                "session_id": self.session_id,
-                "price": self.get_effective_price(),
-            }
-        })
\ No newline at end of file
+        await session_prices.update_price(self.session_id, self.id, new_price)
@@ -0,0 +1,365 @@
+import asyncio
+import contextvars
+import zlib
+from contextlib import contextmanager
+from copy import deepcopy
+from datetime import datetime
+from typing import Any, Optional
+import bson
+from modules.db import just_db
+from modules.logs import game_logger
+
+JOURNAL_TABLE = "journal"
+CHECKPOINT_TABLE = "journal_checkpoints"
+
+# Коллекции состояния сессии: в журнал попадают только их изменения
+SESSION_TABLES = (
+    "sessions", "companies", "users", "cities", "exchanges",
+    "contracts", "factories", "logistics", "item_price", "step_schedule"
+)
+# Поле уникального ключа записи (по умолчанию id)
+UNIQUE_KEYS = {"sessions": "session_id"}
+
+# (session_id, step) текущей обработки - для записей без session_id в условиях
+_scope: contextvars.ContextVar[Optional[tuple[str, int]]] = contextvars.ContextVar(
+    "journal_scope", default=None)
+
+_MISSING = object()
+
+
+def get_path(doc: Any, path: str, default: Any = _MISSING) -> Any:
+    """ Значение по пути "a.b.3" (ключи словарей и индексы списков) """
+    value = doc
+    for part in path.split('.'):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return default
+    return value
+
+def set_path(doc: dict, path: str, value: Any):
+    *parents, last = path.split('.')
+    target: Any = doc
+    for part in parents:
+        if isinstance(target, list):
+            target = target[int(part)]
+        else:
+            target = target.setdefault(part, {})
+
+    if isinstance(target, list):
+        index = int(last)
+        target.extend([None] * (index + 1 - len(target)))
+        target[index] = value
+    else:
+        target[last] = value
+
+def unset_path(doc: dict, path: str):
+    *parents, last = path.split('.')
+    target = get_path(doc, '.'.join(parents), None) if parents else doc
+    if isinstance(target, dict):
+        target.pop(last, None)
+    elif isinstance(target, list) and last.isdigit() and int(last) < len(target):
+        target[int(last)] = None
+
+def matches(doc: dict, conditions: dict) -> bool:
+    """ Проверка условий Mongo (равенство и $in, $nin, $ne, $gt, $gte, $lt, $lte) """
+    for field, expected in conditions.items():
+        value = get_path(doc, field, None)
+
+        if isinstance(expected, dict) and expected and \
+                all(key.startswith('$') for key in expected):
+            for op, arg in expected.items():
+                if op == "$in" and value not in arg: return False
+                if op == "$nin" and value in arg: return False
+                if op == "$ne" and value == arg: return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None: return False
+                    if op == "$gt" and not value > arg: return False
+                    if op == "$gte" and not value >= arg: return False
+                    if op == "$lt" and not value < arg: return False
+                    if op == "$lte" and not value <= arg: return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _entry_session(write: dict) -> Optional[str]:
+    """ Сессия записи: из условий или данных, из изменённой записи (inc) 
+        или из текущей обработки хода
+    """
+    for source in (write.get("filter"), write.get("data")):
+        if isinstance(source, dict) and isinstance(source.get("session_id"), str):
+            return source["session_id"]
+
+    if isinstance(write.get("session_id"), str):
+        return write["session_id"]
+
+    scope = _scope.get()
+    return scope[0] if scope else None
+
+def _entry_key(write: dict) -> Any:
+    field = UNIQUE_KEYS.get(write["table"], "id")
+    for source in (write.get("filter"), write.get("data")):
+        if isinstance(source, dict) and field in source:
+            return source[field]
+    return None
+
+def _entry_keys(entry: dict) -> list:
+    """ Уникальные ключи записей, которых касается запись журнала """
+    key = _entry_key(entry)
+    if isinstance(key, dict):
+        return list(key.get("$in", []))
+    return [] if key is None else [key]
+
+
+class Journal:
+    """ Журнал изменений состояния сессий (только добавление).
+
+        Каждая успешная запись в коллекции сессий (через хук MongoDatabase,
+        внутри транзакции - после коммита) получает сквозной номер seq и
+        попадает в буфер, который записывается пачками insert_many: по
+        заполнению буфера и по таймеру. В начале каждой смены хода пишется
+        полный снимок сессии (checkpoint), с которого начинается реплей.
+
+        Сессия записи без session_id в условиях (действия игроков вне хода)
+        берётся из кэша сессий объектов, а перед записью пачки - из самих
+        объектов в базе или, для удалённых, из их прошлых записей журнала.
+    """
+
+    def __init__(self, batch_size: int = 500, flush_interval: float = 0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.seq = 0
+        self._buffer: list[dict] = []
+        self._lock = asyncio.Lock()
+        self._flushing: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        # "таблица:ключ" -> session_id объекта
+        self._sessions: dict[str, str] = {}
+
+    async def start(self):
+        last: list[dict] = await just_db.find(
+            JOURNAL_TABLE, sort=[("seq", -1)], limit=1, projection=["seq"]) # type: ignore
+        self.seq = last[0]["seq"] if last else 0
+
+        just_db.add_write_hook(self.record, SESSION_TABLES)
+        self._loop_task = asyncio.get_running_loop().create_task(
+            self._flush_loop(), context=contextvars.Context())
+
+    async def stop(self):
+        if self._loop_task: self._loop_task.cancel()
+        await self.flush()
+
+    @contextmanager
+    def scope(self, session_id: str, step: int):
+        """ Записи внутри блока относятся к ходу step сессии session_id """
+        token = _scope.set((session_id, step))
+        try:
+            yield
+        finally:
+            _scope.reset(token)
+
+    def record(self, write: dict):
+        """ Хук записи MongoDatabase (только таблицы SESSION_TABLES) """
+        self.seq += 1
+        scope = _scope.get()
+        key = _entry_key(write)
+        entity = f"{write['table']}:{key}"
+
+        session_id = _entry_session(write) or self._sessions.get(entity)
+        if session_id and key is not None and not isinstance(key, dict):
+            if write["op"] == "delete":
+                self._sessions.pop(entity, None)
+            else:
+                self._sessions[entity] = session_id
+
+        self._buffer.append({
+            "seq": self.seq,
+            "session_id": session_id,
+            "step": scope[1] if scope else None,
+            "entity": entity,
+            "table": write["table"],
+            "op": write["op"],
+            "filter": write.get("filter"),
+            "data": write.get("data"),
+            "set": write.get("set"),
+            "at": datetime.now()
+        })
+
+        if len(self._buffer) >= self.batch_size and (
+                self._flushing is None or self._flushing.done()):
+            # Чистый контекст: запись журнала не должна попасть в транзакцию
+            self._flushing = asyncio.get_running_loop().create_task(
+                self.flush(), context=contextvars.Context())
+
+    async def flush(self):
+        """ Записывает буфер в базу """
+        async with self._lock:
+            while self._buffer:
+                batch, self._buffer = self._buffer, []
+                try:
+                    await self._resolve_sessions(batch)
+                    await just_db.insert_many(JOURNAL_TABLE, batch)
+                except Exception:
+                    self._buffer[:0] = batch
+                    raise
+
+    async def _resolve_sessions(self, batch: list[dict]):
+        """ Определяет сессию записей пачки, для которых она неизвестна """
+        pending = [entry for entry in batch if entry["session_id"] is None]
+        if not pending: return
+
+        missing: dict[str, set] = {}
+        for entry in pending:
+            for key in _entry_keys(entry):
+                if f"{entry['table']}:{key}" not in self._sessions:
+                    missing.setdefault(entry["table"], set()).add(key)
+
+        for table, keys in missing.items():
+            field = UNIQUE_KEYS.get(table, "id")
+            docs: list[dict] = await just_db.find(
+                table, projection=[field, "session_id"],
+                **{field: {"$in": list(keys)}}) # type: ignore
+            for doc in docs:
+                if doc.get("session_id"):
+                    self._sessions[f"{table}:{doc[field]}"] = doc["session_id"]
+
+        for entry in pending:
+            for key in _entry_keys(entry):
+                entity = f"{entry['table']}:{key}"
+                session_id = self._sessions.get(entity)
+                if session_id is None:
+                    # Объект уже удалён - сессия из его прошлых записей
+                    previous: list[dict] = await just_db.find(
+                        JOURNAL_TABLE, entity=entity, session_id={"$ne": None},
+                        limit=1, projection=["session_id"]) # type: ignore
+                    session_id = previous[0]["session_id"] if previous else None
+
+                if session_id:
+                    entry["session_id"] = session_id
+                    break
+            else:
+                game_logger.warning(f"Не удалось определить сессию записи журнала {entry['entity']} ({entry['op']})")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                game_logger.error(f"Не удалось записать журнал: {e}")
+
+    async def checkpoint(self, session_id: str, step: int):
+        """ Полный снимок сессии. Вызывается, когда изменения сессии
+            остановлены (под блокировками компаний в начале смены хода).
+        """
+        await self.flush()
+        seq = self.seq
+
+        tables = {
+            table: await just_db.find(table, session_id=session_id)
+            for table in SESSION_TABLES
+        }
+        await just_db.insert(CHECKPOINT_TABLE, {
+            "session_id": session_id,
+            "step": step,
+            "seq": seq,
+            "data": zlib.compress(bson.encode({"tables": tables}), 6)
+        })
+
+    async def delete_session(self, session_id: str):
+        await self.flush()
+        await just_db.delete(JOURNAL_TABLE, session_id=session_id)
+        await just_db.delete(CHECKPOINT_TABLE, session_id=session_id)
+        self._sessions = {entity: sid for entity, sid in self._sessions.items() 
+                          if sid != session_id}
+
+journal = Journal()
+
+
+class ReplayEngine:
+    """ Применяет записи журнала к состоянию сессии в памяти.
+        Записи ищутся по уникальному ключу без перебора, если он есть в условии.
+    """
+
+    def __init__(self, tables: Optional[dict[str, list[dict]]] = None):
+        self.tables: dict[str, dict[Any, dict]] = {
+            table: {self._key(table, doc): doc for doc in docs}
+            for table, docs in (tables or {}).items()
+        }
+        self.applied = 0
+
+    @staticmethod
+    def _key(table: str, doc: dict) -> Any:
+        return doc.get(UNIQUE_KEYS.get(table, "id"))
+
+    def _matching(self, table: str, conditions: Optional[dict]) -> list[dict]:
+        docs = self.tables.setdefault(table, {})
+        conditions = conditions or {}
+
+        key = conditions.get(UNIQUE_KEYS.get(table, "id"), _MISSING)
+        if key is not _MISSING and not isinstance(key, dict):
+            doc = docs.get(key)
+            return [doc] if doc is not None and matches(doc, conditions) else []
+        return [doc for doc in docs.values() if matches(doc, conditions)]
+
+    def apply(self, entry: dict):
+        table, op, data = entry["table"], entry["op"], entry.get("data")
+
+        if op == "insert":
+            doc = deepcopy(data)
+            self.tables.setdefault(table, {})[self._key(table, doc)] = doc
+
+        elif op == "delete":
+            docs = self.tables.get(table, {})
+            for doc in self._matching(table, entry.get("filter")):
+                docs.pop(self._key(table, doc), None)
+
+        else:
+            for doc in self._matching(table, entry.get("filter")):
+                if op == "set":
+                    for path, value in data.items():
+                        set_path(doc, path, deepcopy(value))
+                elif op == "inc":
+                    for path, value in data.items():
+                        set_path(doc, path, get_path(doc, path, 0) + value)
+                    for path, value in (entry.get("set") or {}).items():
+                        set_path(doc, path, deepcopy(value))
+                elif op == "unset":
+                    for path in data:
+                        unset_path(doc, path)
+
+        self.applied += 1
+
+    def state(self) -> dict[str, list[dict]]:
+        return {table: list(docs.values()) for table, docs in self.tables.items()}
+
+
+async def rebuild(session_id: str, until_seq: Optional[int] = None) -> ReplayEngine:
+    """ Восстанавливает состояние сессии: последний снимок до until_seq
+        и записи журнала после него
+    """
+    await journal.flush()
+
+    seq_filter = {"$lte": until_seq} if until_seq is not None else None
+    checkpoints: list[dict] = await just_db.find(
+        CHECKPOINT_TABLE, session_id=session_id, sort=[("seq", -1)], limit=1,
+        **({"seq": seq_filter} if seq_filter else {})) # type: ignore
+
+    if checkpoints:
+        tables = bson.decode(zlib.decompress(checkpoints[0]["data"]))["tables"]
+        start_seq = checkpoints[0]["seq"]
+    else:
+        tables, start_seq = {}, 0
+
+    entries: list[dict] = await just_db.find(
+        JOURNAL_TABLE, sort=[("seq", 1)],
+        session_id=session_id,
+        seq={"$gt": start_seq, **(seq_filter or {})}) # type: ignore
+
+    engine = ReplayEngine(tables)
+    for entry in entries:
+        engine.apply(entry)
+    return engine
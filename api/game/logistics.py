@@ -1,3 +1,4 @@
+from copy import deepcopy
 from typing import Optional, cast
 from game.session import SessionObject
 from global_modules.models.cells import Cells
@@ -6,6 +7,8 @@ from modules.db import just_db
 from global_modules.load_config import ALL_CONFIGS, Resources, Improvements, Settings, Capital, Reputation
 from modules.function_way import *
 from modules.websocket_manager import websocket_manager
+from modules.locks import company_locks
+from modules.logs import game_logger
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
 CELLS: Cells = ALL_CONFIGS['cells']
@@ -14,6 +17,43 @@ SETTINGS: Settings = ALL_CONFIGS['settings']
 CAPITAL: Capital = ALL_CONFIGS['capital']
 REPUTATION: Reputation = ALL_CONFIGS['reputation']
 
+
+def parse_position(position: str) -> list[int]:
+    """ "x.y" -> [x, y] """
+    x, y = position.split('.')
+    return [int(float(x)), int(float(y))]
+
+def format_position(coords: list[int]) -> str:
+    """ [x, y] -> "x.y" """
+    return f"{coords[0]}.{coords[1]}"
+
+def manhattan(a: list[int], b: list[int]) -> int:
+    """ Манхэттенское расстояние между клетками """
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+def route_point(origin: list[int], target: list[int], travelled: int) -> list[int]:
+    """ Клетка маршрута после travelled пройденных клеток
+        (маршрут идёт сначала по X, затем по Y)
+    """
+    x, y = origin
+    tx, ty = target
+
+    step_x = min(travelled, abs(tx - x))
+    x += step_x if tx >= x else -step_x
+    travelled -= step_x
+
+    step_y = min(travelled, abs(ty - y))
+    y += step_y if ty >= y else -step_y
+    return [x, y]
+
+def delivery_speed(session) -> float:
+    """ Скорость доставки в клетках за ход с учётом события сессии.
+        Вычисляется один раз на ход для всех грузов сессии.
+    """
+    mod = session.effects.cell_logistics
+    return SETTINGS.logistics_speed * mod
+
+
 class Logistics(BaseClass, SessionObject):
 
     __tablename__ = "logistics"
@@ -36,6 +76,12 @@ class Logistics(BaseClass, SessionObject):
         self.current_position: str = ""  # Текущая позиция "x.y"
         self.target_position: str = ""  # Целевая позиция "x.y"
 
+        # Те же позиции в виде [x, y], чтобы не разбирать строки на каждом ходу
+        self.origin_coords: list[int] = []
+        self.current_coords: list[int] = []
+        self.target_coords: list[int] = []
+        self.distance_total: int = 0  # Длина маршрута в клетках
+
         # Состояние доставки
         self.status: str = "in_transit"  # in_transit, waiting_pickup, delivered, failed
         self.distance_left: float = 0.0  # Оставшееся расстояние до цели
@@ -49,15 +95,17 @@ class Logistics(BaseClass, SessionObject):
         """Возвращает скорость доставки в клетках за ход"""
 
         session = await self.get_session_or_error()
+        return delivery_speed(session)
 
-        if not session:
-            mod = 1.0
-        else:
-            mod = await session.get_event_effects().get(
-                'cell_logistics', 1.0
-            )
+    def _ensure_coords(self):
+        """ Заполняет координаты у грузов, сохранённых только со строковыми позициями """
+        if self.target_coords: return
 
-        return SETTINGS.logistics_speed * mod
+        self.current_coords = parse_position(self.current_position)
+        self.target_coords = parse_position(self.target_position)
+        self.origin_coords = list(self.current_coords)
+        self.distance_total = manhattan(self.current_coords, self.target_coords)
+        self.current_position = format_position(self.current_coords)
 
     async def create(self, 
                session_id: str, resource_type: str, 
@@ -82,7 +130,7 @@ class Logistics(BaseClass, SessionObject):
         from game.company import Company
         from game.citie import Citie
 
-        sender_company = cast(Company, just_db.find_one("companies", id=from_company_id, to_class=Company))
+        sender_company = cast(Company, await just_db.find_one("companies", id=from_company_id, to_class=Company))
         if not sender_company:
             raise ValueError("Компания отправитель не найдена")
 
@@ -98,6 +146,8 @@ class Logistics(BaseClass, SessionObject):
         self.amount = amount
         self.from_company_id = from_company_id
         self.current_position = sender_company.cell_position
+        self.current_coords = parse_position(self.current_position)
+        self.origin_coords = list(self.current_coords)
         self.created_step = session.step
 
         if to_company_id is not None:
@@ -142,7 +192,9 @@ class Logistics(BaseClass, SessionObject):
             self.city_price = target_city.demands[resource_type]['price']
 
         # Рассчитываем начальное расстояние до цели
-        self.distance_left = self._calculate_distance()
+        self.target_coords = parse_position(self.target_position)
+        self.distance_total = manhattan(self.current_coords, self.target_coords)
+        self.distance_left = float(self.distance_total)
 
         if not sender_no_delete:
             # Снимаем ресурсы с компании отправителя
@@ -151,6 +203,8 @@ class Logistics(BaseClass, SessionObject):
 
         # Сохраняем в базу
         await self.insert()
+        await just_db.on_rollback(
+            lambda: just_db.delete(self.__tablename__, id=self.id))
 
         # Отправляем уведомление
         await websocket_manager.broadcast({
@@ -163,22 +217,35 @@ class Logistics(BaseClass, SessionObject):
 
         return self
 
-    def _calculate_distance(self) -> float:
-        """Рассчитывает манхэттенское расстояние между текущей и целевой позицией"""
-
-        # Парсим позиции
-        current_pos = [
-            int(x) for x in self.current_position.split('.')]
-        target_pos = [
-            int(x) for x in self.target_position.split('.')]
+    def advance(self, speed: float) -> bool:
+        """ Продвигает груз на speed клеток без сохранения.
+            Возвращает True, если груз дошёл до цели.
+        """
+        self._ensure_coords()
 
-        # Манхэттенское расстояние
-        distance = abs(current_pos[0] - target_pos[0]) + abs(current_pos[1] - target_pos[1])
-
-        return float(distance)
+        self.distance_left = max(0.0, self.distance_left - speed)
+        self._update_current_position(speed)
+        return self.distance_left <= 0
 
-    async def move_next_step(self) -> bool:
-        """Перемещает груз на следующий шаг по маршруту"""
+    def turn_fields(self) -> dict:
+        """ Поля, изменяемые за ход (для пакетной записи) """
+        return {
+            "status": self.status,
+            "waiting_turns": self.waiting_turns,
+            "current_position": self.current_position,
+            "current_coords": self.current_coords,
+            "origin_coords": self.origin_coords,
+            "target_coords": self.target_coords,
+            "distance_total": self.distance_total,
+            "distance_left": self.distance_left
+        }
+
+    async def move_next_step(self, speed: Optional[float] = None) -> bool:
+        """Перемещает груз на следующий шаг по маршруту
+        
+        Args:
+            speed: скорость доставки на этом ходу (если не передана - вычисляется)
+        """
 
         if self.status != "in_transit":
             return False
@@ -188,14 +255,11 @@ class Logistics(BaseClass, SessionObject):
             return await self._attempt_delivery()
 
         # Перемещаемся с учетом скорости
-        speed = await self.get_delivery_speed()
-        self.distance_left = max(0, self.distance_left - speed)
-
-        # Обновляем текущую позицию (приближаемся к цели)
-        self._update_current_position(speed)
+        if speed is None:
+            speed = await self.get_delivery_speed()
 
         # Проверяем, дошли ли до цели
-        if self.distance_left <= 0:
+        if self.advance(speed):
             return await self._attempt_delivery()
 
         await self.save_to_base()
@@ -213,30 +277,20 @@ class Logistics(BaseClass, SessionObject):
         return True
 
     def _update_current_position(self, speed):
-        """Обновляет текущую позицию, приближая к цели"""
+        """Обновляет текущую позицию, приближая к цели.
+        Позиция - клетка маршрута, до которой груз уже полностью дошёл,
+        поэтому при дробной скорости координаты остаются целыми.
+        """
 
         # Если уже на месте, устанавливаем целевую позицию
         if self.distance_left <= 0:
-            self.current_position = self.target_position
-            return
-
-        # Парсим позиции
-        current_pos = [
-            int(x) for x in self.current_position.split('.')]
-        target_pos = [
-            int(x) for x in self.target_position.split('.')]
-
-        # Двигаемся в сторону цели по одной клетке за раз (простая логика)
-        if current_pos[0] < target_pos[0]:
-            current_pos[0] += speed
-        elif current_pos[0] > target_pos[0]:
-            current_pos[0] -= speed
-        elif current_pos[1] < target_pos[1]:
-            current_pos[1] += speed
-        elif current_pos[1] > target_pos[1]:
-            current_pos[1] -= speed
-
-        self.current_position = f"{current_pos[0]}.{current_pos[1]}"
+            self.current_coords = list(self.target_coords)
+        else:
+            travelled = int(self.distance_total - self.distance_left)
+            self.current_coords = route_point(
+                self.origin_coords, self.target_coords, travelled)
+
+        self.current_position = format_position(self.current_coords)
 
     async def _attempt_delivery(self) -> bool:
         """Пытается доставить груз получателю"""
@@ -348,11 +402,11 @@ class Logistics(BaseClass, SessionObject):
         })
         return True
 
-    async def on_new_turn(self) -> bool:
+    async def on_new_turn(self, speed: Optional[float] = None) -> bool:
         """Обрабатывает новый ход для логистики"""
 
         if self.status == "in_transit":
-            return await self.move_next_step()
+            return await self.move_next_step(speed)
         
         elif self.status == "waiting_pickup":
             self.waiting_turns += 1
@@ -490,9 +544,267 @@ class Logistics(BaseClass, SessionObject):
             "destination_type": self.destination_type,
             "current_position": self.current_position,
             "target_position": self.target_position,
+            "current_coords": self.current_coords,
+            "target_coords": self.target_coords,
             "status": self.status,
             "distance_left": self.distance_left,
             "waiting_turns": self.waiting_turns,
             "city_price": self.city_price,
             "created_step": self.created_step
-        }
\ No newline at end of file
+        }
+
+class LogisticsEngine:
+    """ Обработка всех грузов сессии за ход.
+
+        Скорость вычисляется один раз, грузы загружаются одним запросом.
+        Доставки группируются по компании-получателю, а продажи городам -
+        по компании-отправителю, и зачисляются одним атомарным $inc на
+        компанию. Цена ресурса обновляется один раз за ход средней по
+        объёму ценой продаж городам. Состояние всех грузов записывается
+        одним bulk_write, а клиентам после коммита уходит одно событие 
+        api-logistics_tick. Без replica set все записи хода компенсируются
+        через on_rollback.
+    """
+
+    async def tick(self, session) -> dict:
+        """ Ход логистики сессии. Возвращает сводку хода """
+        speed = delivery_speed(session)
+
+        shipments: list[Logistics] = await just_db.find(
+            Logistics.__tablename__, to_class=Logistics, 
+            session_id=session.session_id) # type: ignore
+        # Состояние грузов до хода - для компенсаций
+        before = {logistics.id: deepcopy(logistics.__dict__) 
+                  for logistics in shipments}
+
+        summary: dict[str, list] = {
+            "moved": [], "delivered": [], "partial": [], 
+            "waiting": [], "failed": [], "delivered_to_city": [], 
+            "city_payments": [], "deleted": []
+        }
+        changed: list[Logistics] = []
+        by_company: dict[int, list[Logistics]] = {}
+        by_seller: dict[int, list[Logistics]] = {}
+
+        for logistics in sorted(shipments, key=lambda l: l.id):
+            if logistics.status in ("delivered", "failed"):
+                summary["deleted"].append(logistics.id)
+                continue
+
+            if logistics.status == "waiting_pickup":
+                # Через 1 ход ожидания груз доставляется частично
+                logistics.waiting_turns += 1
+                changed.append(logistics)
+                if logistics.waiting_turns >= 1:
+                    by_company.setdefault(logistics.to_company_id, []).append(logistics)
+                continue
+
+            if logistics.status != "in_transit": continue
+            changed.append(logistics)
+
+            if logistics.distance_left > 0 and not logistics.advance(speed):
+                summary["moved"].append({
+                    "logistics_id": logistics.id,
+                    "new_position": logistics.current_position,
+                    "distance_left": logistics.distance_left
+                })
+
+            elif logistics.destination_type == "company":
+                by_company.setdefault(logistics.to_company_id, []).append(logistics)
+
+            elif logistics.destination_type == "city":
+                by_seller.setdefault(logistics.from_company_id, []).append(logistics)
+
+            else:
+                logistics.status = "failed"
+                summary["failed"].append({
+                    "logistics_id": logistics.id, "reason": "no_receiver", 
+                    "lost_amount": logistics.amount})
+
+        for company_id, group in by_company.items():
+            await self._deliver_to_company(company_id, group, summary)
+
+        # ресурс -> [единиц, выручка] по продажам городам
+        city_sales: dict[str, list[int]] = {}
+        for company_id, group in by_seller.items():
+            await self._pay_city_sales(company_id, group, summary, city_sales)
+
+        for resource, (amount, payment) in city_sales.items():
+            await session.update_item_price(resource, payment // amount)
+
+        await just_db.bulk_update(Logistics.__tablename__, [
+            ({"id": logistics.id}, logistics.turn_fields())
+            for logistics in changed
+        ])
+        await just_db.on_rollback(lambda: just_db.bulk_update(
+            Logistics.__tablename__, [
+                ({"id": logistics.id}, {key: before[logistics.id][key] 
+                                        for key in logistics.turn_fields()})
+                for logistics in changed
+            ]))
+
+        if summary["deleted"]:
+            await just_db.delete(Logistics.__tablename__, 
+                                 id={"$in": summary["deleted"]})
+            await just_db.on_rollback(lambda: just_db.insert_many(
+                Logistics.__tablename__, [
+                    {key: value for key, value in before[i].items() 
+                     if not key.startswith('_')}
+                    for i in summary["deleted"]
+                ]))
+
+        await just_db.on_commit(lambda: websocket_manager.broadcast({
+            "type": "api-logistics_tick",
+            "data": {
+                "session_id": session.session_id,
+                "step": session.step,
+                **summary
+            }
+        }))
+        return summary
+
+    async def _deliver_to_company(self, company_id: int, 
+                                  group: list[Logistics], summary: dict):
+        """ Доставляет компании все прибывшие и ожидающие грузы одним $inc.
+            Прибывшие грузы, которые не помещаются на склад, начинают ждать,
+            ожидающие доставляются сколько поместится (остаток теряется).
+        """
+        from game.company import Company, warehouse_space_guard
+
+        async with company_locks.hold(company_id):
+            company = cast(Company, await just_db.find_one(
+                "companies", id=company_id, to_class=Company))
+
+            if not company:
+                for logistics in group:
+                    logistics.status = "failed"
+                    summary["failed"].append({
+                        "logistics_id": logistics.id, "reason": "no_receiver", 
+                        "lost_amount": logistics.amount})
+                return
+
+            max_size = await company.get_max_warehouse_size()
+            free_space = max_size - company.get_resources_amount()
+
+            increments: dict[str, int] = {}
+            delivered: list[tuple[Logistics, int]] = []
+            for logistics in group:
+                arrived = logistics.status == "in_transit"
+                if free_space >= logistics.amount:
+                    amount = logistics.amount
+                elif arrived:
+                    amount = 0
+                else:
+                    # Ожидающий груз: доставляем сколько поместится
+                    amount = max(free_space, 0)
+
+                if amount:
+                    free_space -= amount
+                    key = f"warehouses.{logistics.resource_type}"
+                    increments[key] = increments.get(key, 0) + amount
+                    delivered.append((logistics, amount))
+
+                elif arrived:
+                    # Недостаточно места, ждем
+                    logistics.status = "waiting_pickup"
+                    logistics.waiting_turns = 0
+                    summary["waiting"].append({
+                        "logistics_id": logistics.id,
+                        "reason": "insufficient_warehouse_space"})
+
+                else:
+                    # Весь груз теряется
+                    logistics.status = "failed"
+                    summary["failed"].append({
+                        "logistics_id": logistics.id,
+                        "reason": "no_warehouse_space",
+                        "lost_amount": logistics.amount})
+
+            if not delivered: return
+
+            total = sum(increments.values())
+            if await company.inc(
+                    increments, guard=warehouse_space_guard(max_size - total)):
+                await just_db.on_rollback(lambda: company.inc(
+                    {key: -value for key, value in increments.items()}))
+            else:
+                # Склад изменился в обход блокировки - грузы подождут следующего хода
+                for logistics, _ in delivered:
+                    logistics.status = "waiting_pickup"
+                    logistics.waiting_turns = 0
+                    summary["waiting"].append({
+                        "logistics_id": logistics.id,
+                        "reason": "insufficient_warehouse_space"})
+                return
+
+        for logistics, amount in delivered:
+            logistics.status = "delivered"
+            entry = {
+                "logistics_id": logistics.id,
+                "company_id": company_id,
+                "resource": logistics.resource_type
+            }
+
+            if amount == logistics.amount:
+                summary["delivered"].append({**entry, "amount": amount})
+            else:
+                summary["partial"].append({**entry, 
+                    "delivered_amount": amount, 
+                    "lost_amount": logistics.amount - amount})
+
+        game_logger.info(f"Компания {company.name} ({company.id}) получила грузы: {increments}")
+
+    async def _pay_city_sales(self, company_id: int, group: list[Logistics],
+                              summary: dict, city_sales: dict[str, list[int]]):
+        """ Зачисляет компании оплату всех доставленных городам грузов 
+            и экономическое влияние за них одним $inc
+        """
+        from game.company import Company, economic_power
+
+        async with company_locks.hold(company_id):
+            company = cast(Company, await just_db.find_one(
+                "companies", id=company_id, to_class=Company))
+
+            if not company:
+                for logistics in group:
+                    logistics.status = "failed"
+                    summary["failed"].append({
+                        "logistics_id": logistics.id, "reason": "no_receiver", 
+                        "lost_amount": logistics.amount})
+                return
+
+            payment = sum(l.city_price * l.amount for l in group)
+            power = sum(economic_power(l.amount, l.resource_type, 'city_sell')
+                        for l in group)
+            increments = {
+                "balance": payment,
+                "this_turn_income": payment,
+                "economic_power": power
+            }
+            await company.inc(increments)
+            await just_db.on_rollback(lambda: company.inc(
+                {key: -value for key, value in increments.items()}))
+
+        for logistics in group:
+            logistics.status = "delivered"
+            summary["delivered_to_city"].append({
+                "logistics_id": logistics.id,
+                "city_id": logistics.to_city_id,
+                "company_id": company_id,
+                "resource": logistics.resource_type,
+                "amount": logistics.amount,
+                "payment": logistics.city_price * logistics.amount
+            })
+
+            sales = city_sales.setdefault(logistics.resource_type, [0, 0])
+            sales[0] += logistics.amount
+            sales[1] += logistics.city_price * logistics.amount
+
+        summary["city_payments"].append({
+            "company_id": company_id,
+            "payment": payment,
+            "new_balance": company.balance
+        })
+        game_logger.info(f"Компания {company.name} ({company.id}) получила {payment} за {len(group)} поставок городам")
+
+logistics_engine = LogisticsEngine()
@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import random
+from typing import Optional, TYPE_CHECKING
+from global_modules.load_config import ALL_CONFIGS
+from global_modules.models.cells import Cells
+from modules.db import just_db
+
+if TYPE_CHECKING:
+    from game.session import Session
+
+cells: Cells = ALL_CONFIGS['cells']
+
+
+def parse_position(position: str) -> Optional[tuple[int, int]]:
+    """ "x.y" -> (x, y) """
+    try:
+        x, y = map(int, position.split('.'))
+        return x, y
+    except (AttributeError, ValueError):
+        return None
+
+
+class OccupancyGrid:
+    """ Занятость клеток карты одной сессии.
+
+        owners - id компании на каждой клетке (0 - свободна),
+        pickable и occupied - битовые маски (бит i - клетка с индексом
+        x * cols + y), поэтому свободные клетки = pickable & ~occupied
+        считаются одной операцией без запросов к базе.
+    """
+
+    def __init__(self, session_id: str, rows: int, cols: int):
+        self.session_id = session_id
+        self.rows = rows
+        self.cols = cols
+        self.owners: list[int] = [0] * (rows * cols)
+        self.positions: dict[int, int] = {} # id компании -> индекс клетки
+        self.pickable: int = 0
+        self.occupied: int = 0
+
+    async def load(self, session_cells: list[str]):
+        """ Строит маски по клеткам сессии и загружает позиции компаний одним запросом """
+        for index, cell_key in enumerate(session_cells[:self.rows * self.cols]):
+            cell_type = cells.types.get(cell_key)
+            if cell_type and cell_type.pickable:
+                self.pickable |= 1 << index
+
+        companies: list[dict] = await just_db.find(
+            "companies", session_id=self.session_id,
+            projection=["id", "cell_position"]) # type: ignore
+
+        for company in companies:
+            position = parse_position(company.get("cell_position", ""))
+            if position and self.in_bounds(*position):
+                self.occupy(company["id"], *position)
+        return self
+
+    def index(self, x: int, y: int) -> int:
+        return x * self.cols + y
+
+    def in_bounds(self, x: int, y: int) -> bool:
+        return 0 <= x < self.rows and 0 <= y < self.cols
+
+    def owner(self, x: int, y: int) -> int:
+        """ id компании на клетке (0 - свободна) """
+        if not self.in_bounds(x, y): return 0
+        return self.owners[self.index(x, y)]
+
+    def is_free(self, x: int, y: int) -> bool:
+        """ Клетку можно выбрать: внутри карты, доступна для выбора и не занята """
+        if not self.in_bounds(x, y): return False
+        return bool(self.free_mask >> self.index(x, y) & 1)
+
+    @property
+    def free_mask(self) -> int:
+        return self.pickable & ~self.occupied
+
+    def free_cells(self) -> list[tuple[int, int]]:
+        """ Свободные клетки в порядке индексов """
+        result = []
+        mask = self.free_mask
+        while mask:
+            low = mask & -mask
+            index = low.bit_length() - 1
+            result.append(divmod(index, self.cols))
+            mask ^= low
+        return result
+
+    def random_free(self, rng: random.Random) -> Optional[tuple[int, int]]:
+        """ Случайная свободная клетка (None, если свободных нет) """
+        free = self.free_cells()
+        return rng.choice(free) if free else None
+
+    def occupy(self, company_id: int, x: int, y: int):
+        """ Занимает клетку компанией (прежняя клетка компании освобождается) """
+        self.release(company_id)
+
+        index = self.index(x, y)
+        self.owners[index] = company_id
+        self.positions[company_id] = index
+        self.occupied |= 1 << index
+
+    def release(self, company_id: int):
+        """ Освобождает клетку компании """
+        index = self.positions.pop(company_id, None)
+        if index is None: return
+
+        self.owners[index] = 0
+        self.occupied &= ~(1 << index)
+
+
+class OccupancyManager:
+    """ Сетки занятости сессий, строятся при первом обращении """
+
+    def __init__(self):
+        self.grids: dict[str, OccupancyGrid] = {}
+        self._loading: dict[str, asyncio.Task] = {}
+
+    async def get(self, session: 'Session') -> OccupancyGrid:
+        grid = self.grids.get(session.session_id)
+        if grid is not None: return grid
+
+        task = self._loading.get(session.session_id)
+        if task is None:
+            grid = OccupancyGrid(session.session_id,
+                                 session.map_size["rows"], session.map_size["cols"])
+            # Загрузка в чистом контексте: не должна попасть в транзакцию вызывающего
+            task = asyncio.get_running_loop().create_task(
+                grid.load(list(session.cells)), context=contextvars.Context())
+            self._loading[session.session_id] = task
+        try:
+            grid = await asyncio.shield(task)
+        finally:
+            if task.done(): self._loading.pop(session.session_id, None)
+
+        self.grids.setdefault(session.session_id, grid)
+        return self.grids[session.session_id]
+
+    def release(self, session_id: str, company_id: int):
+        """ Освобождает клетку компании, если сетка сессии загружена """
+        grid = self.grids.get(session_id)
+        if grid is not None: grid.release(company_id)
+
+    def drop(self, session_id: str):
+        self.grids.pop(session_id, None)
+
+occupancy_grids = OccupancyManager()
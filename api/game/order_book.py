@@ -0,0 +1,223 @@
+import asyncio
+import contextvars
+from bisect import bisect_right, insort
+from itertools import islice
+from typing import Optional, TYPE_CHECKING
+from modules.db import just_db
+
+if TYPE_CHECKING:
+    from game.exchange import Exchange
+
+
+def unit_price(offer: dict) -> float:
+    """ Цена за единицу товара: монеты для money,
+        количество бартерного ресурса для barter
+    """
+    per_trade = offer["sell_amount_per_trade"] or 1
+    if offer["offer_type"] == "barter":
+        return offer["barter_amount"] / per_trade
+    return offer["price"] / per_trade
+
+def make_cursor(level: tuple[float, int]) -> str:
+    return f"{level[0]}:{level[1]}"
+
+def parse_cursor(cursor: str) -> tuple[float, int]:
+    try:
+        price, offer_id = cursor.split(":")
+        return float(price), int(offer_id)
+    except (AttributeError, ValueError):
+        raise ValueError("Неверный курсор.")
+
+def make_book_cursor(key: tuple[str, str], level: tuple[float, int]) -> str:
+    """ Курсор списка всех стаканов: ресурс, тип и уровень """
+    return f"{key[0]}:{key[1]}:{make_cursor(level)}"
+
+def parse_book_cursor(cursor: str) -> tuple[tuple[str, str], tuple[float, int]]:
+    try:
+        resource, offer_type, level = cursor.split(":", 2)
+    except (AttributeError, ValueError):
+        raise ValueError("Неверный курсор.")
+    return (resource, offer_type), parse_cursor(level)
+
+
+class OrderBook:
+    """ Стакан предложений биржи одной сессии.
+
+        Предложения сгруппированы по (sell_resource, offer_type) и
+        хранятся в отсортированном списке уровней (цена за единицу, id),
+        поэтому лучшие предложения и постраничный вывод получаются
+        бинарным поиском без обращения к базе.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # (ресурс, тип) -> отсортированный список (цена за единицу, id)
+        self._levels: dict[tuple[str, str], list[tuple[float, int]]] = {}
+        # id -> данные предложения (Exchange.to_dict)
+        self._offers: dict[int, dict] = {}
+        # id -> (ключ стакана, уровень), чтобы удалять без поиска по стаканам
+        self._index: dict[int, tuple[tuple[str, str], tuple[float, int]]] = {}
+
+    async def load(self):
+        """ Загружает все предложения сессии одним запросом """
+        from game.exchange import Exchange
+
+        offers: list[Exchange] = await just_db.find(
+            "exchanges", to_class=Exchange, session_id=self.session_id) # type: ignore
+
+        self._levels.clear()
+        self._offers.clear()
+        self._index.clear()
+        for offer in offers:
+            if offer.total_stock > 0:
+                self._put(offer.to_dict())
+        return self
+
+    def _put(self, offer: dict):
+        key = (offer["sell_resource"], offer["offer_type"])
+        level = (unit_price(offer), offer["id"])
+
+        insort(self._levels.setdefault(key, []), level)
+        self._offers[offer["id"]] = offer
+        self._index[offer["id"]] = (key, level)
+
+    def _pop(self, offer_id: int):
+        if offer_id not in self._index: return
+
+        key, level = self._index.pop(offer_id)
+        del self._offers[offer_id]
+
+        levels = self._levels[key]
+        i = bisect_right(levels, level) - 1
+        if i >= 0 and levels[i] == level:
+            del levels[i]
+        if not levels:
+            del self._levels[key]
+
+    def upsert(self, offer: 'Exchange'):
+        """ Добавляет или обновляет предложение """
+        data = offer.to_dict()
+        self._pop(offer.id)
+        if data["total_stock"] > 0:
+            self._put(data)
+
+    def remove(self, offer_id: int):
+        """ Удаляет предложение из стакана """
+        self._pop(offer_id)
+
+    def get(self, offer_id: int) -> Optional[dict]:
+        return self._offers.get(offer_id)
+
+    def best_offers(self, sell_resource: str,
+                    offer_type: str = "money",
+                    limit: Optional[int] = 20,
+                    cursor: Optional[str] = None) -> list[dict]:
+        """ Предложения ресурса от самого выгодного.
+            cursor - значение поля cursor последнего предложения предыдущей страницы
+        """
+        levels = self._levels.get((sell_resource, offer_type), [])
+
+        start = bisect_right(levels, parse_cursor(cursor)) if cursor else 0
+        end = len(levels) if limit is None else start + limit
+
+        return [
+            {**self._offers[offer_id], "unit_price": price,
+             "cursor": make_cursor((price, offer_id))}
+            for price, offer_id in levels[start:end]
+        ]
+
+    def offers(self,
+               sell_resource: Optional[str] = None,
+               offer_type: Optional[str] = None,
+               company_id: Optional[int] = None,
+               limit: Optional[int] = None,
+               cursor: Optional[str] = None) -> list[dict]:
+        """ Предложения с фильтрами, отсортированные по ресурсу,
+            типу и цене за единицу.
+            cursor - поле cursor последнего предложения предыдущей страницы:
+            страница начинается с его стакана бинарным поиском
+        """
+        after: Optional[tuple[tuple[str, str], tuple[float, int]]] = None
+        if cursor:
+            after = parse_book_cursor(cursor)
+
+        keys = sorted(
+            key for key in self._levels
+            if (sell_resource is None or key[0] == sell_resource) and
+               (offer_type is None or key[1] == offer_type) and
+               (after is None or key >= after[0])
+        )
+
+        result: list[dict] = []
+        for key in keys:
+            levels = self._levels[key]
+            start = bisect_right(levels, after[1]) \
+                if after is not None and key == after[0] else 0
+
+            for price, offer_id in islice(levels, start, None):
+                offer = self._offers[offer_id]
+                if company_id is not None and offer["company_id"] != company_id:
+                    continue
+
+                result.append({**offer, "unit_price": price,
+                               "cursor": make_book_cursor(key, (price, offer_id))})
+                if limit is not None and len(result) >= limit:
+                    return result
+
+        return result
+
+    def depth(self, sell_resource: str,
+              offer_type: str = "money",
+              levels: int = 10) -> list[dict]:
+        """ Глубина стакана: первые уровни цены с количеством
+            предложений и общим объёмом товара
+        """
+        result: list[dict] = []
+
+        for price, offer_id in self._levels.get((sell_resource, offer_type), []):
+            if result and result[-1]["unit_price"] == price:
+                level = result[-1]
+            elif len(result) == levels:
+                break
+            else:
+                level = {"unit_price": price, "offers": 0, "amount": 0}
+                result.append(level)
+
+            level["offers"] += 1
+            level["amount"] += self._offers[offer_id]["total_stock"]
+
+        return result
+
+
+class OrderBooksManager:
+    """ Стаканы сессий, загружаются из базы при первом обращении """
+
+    def __init__(self):
+        self.books: dict[str, OrderBook] = {}
+        self._loading: dict[str, asyncio.Task] = {}
+
+    async def get(self, session_id: str) -> OrderBook:
+        """ Стакан сессии. Параллельные вызовы ждут одну и ту же загрузку,
+            поэтому изменения не применяются к недогруженному стакану.
+        """
+        book = self.books.get(session_id)
+        if book is not None: return book
+
+        task = self._loading.get(session_id)
+        if task is None:
+            # Загрузка в чистом контексте: не должна попасть в транзакцию вызывающего
+            task = asyncio.get_running_loop().create_task(
+                OrderBook(session_id).load(), context=contextvars.Context())
+            self._loading[session_id] = task
+        try:
+            book = await asyncio.shield(task)
+        finally:
+            if task.done(): self._loading.pop(session_id, None)
+
+        self.books.setdefault(session_id, book)
+        return self.books[session_id]
+
+    def drop(self, session_id: str):
+        self.books.pop(session_id, None)
+
+order_books = OrderBooksManager()
@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+from copy import deepcopy
+from typing import Callable, Optional, TYPE_CHECKING
+from global_modules.load_config import ALL_CONFIGS, Resources
+from modules.db import just_db
+from modules.websocket_manager import websocket_manager
+
+if TYPE_CHECKING:
+    from game.item_price import ItemPrice
+
+RESOURCES: Resources = ALL_CONFIGS["resources"]
+
+
+class PriceGraph:
+    """ Граф производства: предмет -> материалы для его производства.
+
+        Строится один раз из конфига. Предметы упорядочены топологически
+        (материалы раньше продуктов), поэтому при изменении цены достаточно
+        один раз пройти по зависимым предметам в этом порядке.
+    """
+
+    def __init__(self, resources: Resources):
+        self.materials: dict[str, dict[str, int]] = {}
+        self.output: dict[str, int] = {}
+        self.dependents: dict[str, list[str]] = {
+            item_id: [] for item_id in resources.resources}
+
+        for item_id, resource in resources.resources.items():
+            if not resource.production: continue
+
+            self.materials[item_id] = dict(resource.production.materials)
+            self.output[item_id] = resource.production.output
+            for mat_id in resource.production.materials:
+                self.dependents.setdefault(mat_id, []).append(item_id)
+
+        self.order: list[str] = self._topological_order()
+        self.position: dict[str, int] = {
+            item_id: i for i, item_id in enumerate(self.order)}
+        self._downstream: dict[str, tuple[str, ...]] = {}
+
+    def _topological_order(self) -> list[str]:
+        """ Алгоритм Кана """
+        in_degree = {item_id: len(self.materials.get(item_id, {}))
+                     for item_id in self.dependents}
+        queue = [item_id for item_id, degree in in_degree.items() if degree == 0]
+
+        order = []
+        while queue:
+            item_id = queue.pop(0)
+            order.append(item_id)
+            for dependent in self.dependents[item_id]:
+                in_degree[dependent] -= 1
+                if in_degree[dependent] == 0:
+                    queue.append(dependent)
+
+        if len(order) != len(in_degree):
+            raise ValueError("Цикл в производственных цепочках ресурсов.")
+        return order
+
+    def downstream(self, item_id: str) -> tuple[str, ...]:
+        """ Все предметы, цена которых зависит от item_id, в топологическом порядке """
+        if item_id not in self._downstream:
+            seen: set[str] = set()
+            stack = list(self.dependents.get(item_id, []))
+            while stack:
+                node = stack.pop()
+                if node in seen: continue
+                seen.add(node)
+                stack.extend(self.dependents.get(node, []))
+
+            self._downstream[item_id] = tuple(
+                sorted(seen, key=self.position.__getitem__))
+        return self._downstream[item_id]
+
+    def material_price(self, item_id: str,
+                       effective_price: Callable[[str], int]) -> int:
+        """ Цена единицы предмета по ценам материалов (0 для сырья) """
+        materials = self.materials.get(item_id)
+        if not materials: return 0
+
+        total_cost = sum(effective_price(mat_id) * qty
+                         for mat_id, qty in materials.items())
+        return int(total_cost / self.output[item_id])
+
+price_graph = PriceGraph(RESOURCES)
+
+
+class SessionPrices:
+    """ Цены предметов одной сессии на одном ходу.
+        Загружаются одним запросом, недостающие строки создаются сразу при загрузке.
+    """
+
+    def __init__(self, session_id: str, step: int):
+        self.session_id = session_id
+        self.step = step
+        self.items: dict[str, 'ItemPrice'] = {}
+        self.lock = asyncio.Lock()
+
+    async def load(self):
+        from game.item_price import ItemPrice
+
+        self.items = {
+            price.id: price for price in await just_db.find(
+                "item_price", to_class=ItemPrice, session_id=self.session_id)
+        } # type: ignore
+
+        # Недостающие цены создаются в топологическом порядке,
+        # чтобы цена по материалам сразу учитывала цены материалов
+        for item_id in price_graph.order:
+            if item_id in self.items or item_id not in RESOURCES.resources: continue
+
+            item = ItemPrice(item_id)
+            item.session_id = self.session_id
+            item.current_price = RESOURCES.resources[item_id].basePrice
+            item._push(item.current_price, {})
+            item.material_based_price = price_graph.material_price(
+                item_id, self.effective_price)
+            await item.insert()
+            self.items[item_id] = item
+
+        return self
+
+    def effective_price(self, item_id: str) -> int:
+        item = self.items.get(item_id)
+        if item: return item.get_effective_price()
+
+        resource = RESOURCES.resources.get(item_id)
+        return resource.basePrice if resource else 0
+
+    def prices_dict(self) -> dict[str, int]:
+        return {item_id: item.get_effective_price()
+                for item_id, item in self.items.items()}
+
+
+class SessionPricesManager:
+    """ Кэш цен по сессиям: сбрасывается при смене хода """
+
+    def __init__(self):
+        self.sessions: dict[str, SessionPrices] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def get(self, session_id: str, step: Optional[int] = None) -> SessionPrices:
+        if step is None:
+            from game.session import session_manager
+
+            session = await session_manager.get_session(session_id)
+            step = session.step if session else 0
+
+        prices = self.sessions.get(session_id)
+        if prices and prices.step == step: return prices
+
+        lock = self._locks.setdefault(session_id, asyncio.Lock())
+        async with lock:
+            prices = self.sessions.get(session_id)
+            if prices is None or prices.step != step:
+                # Загрузка в чистом контексте: создаваемые строки не должны 
+                # попасть в транзакцию вызывающего и откатиться вместе с ней
+                prices = await asyncio.get_running_loop().create_task(
+                    SessionPrices(session_id, step).load(), 
+                    context=contextvars.Context())
+                self.sessions[session_id] = prices
+        return prices
+
+    def drop(self, session_id: str):
+        self.sessions.pop(session_id, None)
+        self._locks.pop(session_id, None)
+
+    async def update_price(self, session_id: str, item_id: str,
+                           new_price: int, step: Optional[int] = None):
+        """ Записывает цену сделки и пересчитывает цены по материалам
+            у всех зависимых предметов. Все изменения пишутся одним
+            bulk_write и отправляются одним сообщением. Если запись 
+            не удалась, кэш цен возвращается к состоянию до изменения.
+        """
+        prices = await self.get(session_id, step)
+
+        if item_id not in prices.items:
+            raise ValueError(f"Ресурс '{item_id}' не существует.")
+
+        async with prices.lock:
+            item = prices.items[item_id]
+            before = prices.prices_dict()
+
+            nodes = (item_id, *price_graph.downstream(item_id))
+            saved = {node: deepcopy(prices.items[node].__dict__) for node in nodes}
+            try:
+                updates: dict[str, dict] = {item_id: item.record_price(new_price)}
+
+                for node in nodes:
+                    node_item = prices.items[node]
+                    material_price = price_graph.material_price(
+                        node, prices.effective_price)
+
+                    if material_price != node_item.material_based_price:
+                        node_item.material_based_price = material_price
+                        updates.setdefault(node, {})[
+                            "material_based_price"] = material_price
+
+                await just_db.bulk_update("item_price", [
+                    ({"id": node, "session_id": session_id}, fields)
+                    for node, fields in updates.items()
+                ])
+            except BaseException:
+                for node, state in saved.items():
+                    prices.items[node].__dict__.update(state)
+                raise
+
+            changed = [
+                {"item_id": node, "price": prices.effective_price(node)}
+                for node in updates
+                if node == item_id or prices.effective_price(node) != before[node]
+            ]
+
+        await websocket_manager.broadcast({
+            "type": "api-item_price_updated",
+            "data": {
+                "item_id": item_id,
+                "session_id": session_id,
+                "price": prices.effective_price(item_id),
+                "items": changed
+            }
+        })
+        return item
+
+session_prices = SessionPricesManager()
@@ -1,9 +1,9 @@
 import asyncio
-from collections import Counter
+import contextvars
 from datetime import datetime, timedelta
 from enum import Enum
 import random
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 import uuid
 
 from game.stages import stage_game_updater
@@ -15,10 +15,14 @@ from global_modules.models.events import Events
 
 from modules.db import just_db
 from modules.generate import generate_code
+from modules.locks import company_locks, session_locks
 from modules.logs import game_logger
 from modules.sheduler import scheduler
 from modules.websocket_manager import websocket_manager
 
+if TYPE_CHECKING:
+    from game.event_effects import ActiveEffects
+
 # Глобальные конфиги для оптимизации
 settings: Settings = ALL_CONFIGS['settings']
 cells: Cells = ALL_CONFIGS['cells']
@@ -29,6 +33,12 @@ GAME_TIME = settings.time_on_game_stage * 60
 CHANGETURN_TIME = settings.time_on_change_stage * 60
 TURN_CELL_TIME = settings.turn_cell_time_minutes * 60
 
+# Вложенные коллекции, которые можно запросить в Session.to_dict
+SESSION_INCLUDES = ("companies", "users", "cities", "item_prices", "cells")
+
+# Фоновые задачи смены стадии (ссылки, чтобы задачи не собрал GC)
+_stage_tasks: set[asyncio.Task] = set()
+
 class SessionStages(Enum):
     FreeUserConnect = "FreeUserConnect" # Подключаем пользователей
     CellSelect = "CellSelect" # Выбираем клетки
@@ -47,9 +57,12 @@ class Session(BaseClass):
                  map_pattern: str = "random",
                  map_size: Optional[dict] = None,
                  max_steps: int = 15,
-                 bots_count: int = 2
+                 bots_count: int = 2,
+                 seed: str = ""
                  ): 
         self.session_id = session_id
+        # Seed именованных потоков случайных чисел (см. rng)
+        self.seed: str = seed
         self.cells: list[str] = []
         self.map_size: dict = map_size if map_size else {
             "rows": 7, "cols": 7}
@@ -65,12 +78,17 @@ class Session(BaseClass):
         self.event_start: Optional[int] = None
         self.event_end: Optional[int] = None
 
+        # Прогресс текущей смены хода: {"step", "done": [фазы], "companies": [id]}
+        self.turn_progress: dict = {}
+
     async def start(self):
         if not self.session_id:
             self.session_id = generate_code(8, use_letters=True, 
                                             use_numbers=True, 
                                             use_uppercase=True
                                             )
+        if not self.seed:
+            self.seed = uuid.uuid4().hex
         self.stage = SessionStages.FreeUserConnect.value
 
         await self.insert()
@@ -84,8 +102,29 @@ class Session(BaseClass):
         game_logger.info(f"Сессия {self.session_id} запущена.")
         return self
 
+    def rng(self, name: str, *salt) -> random.Random:
+        """ Именованный поток случайных чисел сессии: map, cities, events, demand.
+
+            Поток выводится из seed сессии, поэтому при том же seed и тех же
+            действиях игроков игра воспроизводится полностью. salt (например,
+            номер хода) делает поток независимым от числа вызовов на прошлых ходах.
+        """
+        seed = self.seed or self.session_id
+        return random.Random(":".join(map(str, (seed, name, *salt))))
+
     async def update_stage(self, new_stage: SessionStages, 
                      whitout_shedule: bool = False):
+        """ Смена стадии под блокировкой сессии: смены стадий и ходов одной 
+            сессии (шедулер, resume_turn, обработчики) идут строго по очереди.
+            Состояние сессии перечитывается, так как его могла изменить 
+            предыдущая смена.
+        """
+        async with session_locks.hold(self.session_id):
+            await self.reupdate()
+            return await self._update_stage(new_stage, whitout_shedule)
+
+    async def _update_stage(self, new_stage: SessionStages, 
+                            whitout_shedule: bool):
         if not isinstance(new_stage, SessionStages):
             game_logger.error(f"Неверный тип новой стадии: {new_stage}")
             raise ValueError("new_stage должен быть экземпляром SessionStages Enum")
@@ -105,9 +144,13 @@ class Session(BaseClass):
 
         elif new_stage == SessionStages.Game:
             from game.company import Company
-            from game.logistics import Logistics
 
             if self.step == 0:
+                from game.occupancy import occupancy_grids
+
+                grid = await occupancy_grids.get(self)
+                rng = self.rng("map", "placement")
+
                 companies = await self.companies
                 for company in companies:
                     company: Company
@@ -118,17 +161,15 @@ class Session(BaseClass):
                         continue
 
                     elif not company.cell_position:
-                        free_cells = await self.get_free_cells()
+                        cell = grid.random_free(rng)
 
-                        if not free_cells: 
+                        if not cell: 
                             await company.delete()
                             game_logger.warning(f"Нет свободных клеток для компании {company.name} в сессии {self.session_id}. Компания удалена.")
                             continue
 
-                        cell = random.choice(free_cells)
                         await company.set_position(cell[0], cell[1])
 
-                        await company.save_to_base()
                         await company.reupdate()
                         game_logger.info(f"Компании {company.name} в сессии {self.session_id} назначена клетка {company.cell_position}.")
 
@@ -142,25 +183,7 @@ class Session(BaseClass):
                     self.change_turn_schedule_id = sh_id
                     await self.save_to_base()
 
-            for company in await self.companies:
-                if company is not None:
-                    await company.on_new_game_stage(self.step + 1)
-
-            # Обновляем города
-            for city in await self.cities:
-                await city.on_new_game_stage()
-
-            # Обновляем логистику
-            logistics_list: list[Logistics] = await just_db.find(Logistics.__tablename__,
-                                          to_class=Logistics, session_id=self.session_id) # type: ignore
-            for logistics in logistics_list:
-                await logistics.on_new_turn()
-
-            # Генерируем события каждые 5 этапов
-            await self.events_generator()
-
-            self.step += 1
-            await self.execute_step_schedule(self.step)
+            await self._process_turn()
 
         elif new_stage == SessionStages.End:
             await self.end_game()
@@ -170,6 +193,12 @@ class Session(BaseClass):
 
         await self.save_to_base()
 
+        if new_stage == SessionStages.Game:
+            from game.history import history_writer
+
+            # Снимок хода пишется в фоне и не задерживает смену стадии
+            history_writer.schedule(self.session_id, self.step)
+
         game_logger.info(f"В сессии {self.session_id} изменена стадия с {old_stage} на {self.stage}.")
 
         asyncio.create_task(websocket_manager.broadcast({
@@ -183,6 +212,187 @@ class Session(BaseClass):
 
         return self
 
+    def _stage_task(self, coro):
+        """ Запускает смену стадии отдельной задачей в чистом контексте 
+            (без блокировок и транзакции вызывающего)
+        """
+        task = asyncio.get_running_loop().create_task(
+            coro, context=contextvars.Context())
+        _stage_tasks.add(task)
+        task.add_done_callback(_stage_tasks.discard)
+
+    def start_game_when_ready(self):
+        """ Запускает игру отдельной задачей, когда все компании выбрали клетки.
+            Параллельные вызовы запускают игру один раз.
+        """
+        self._stage_task(self._start_game_when_ready())
+
+    async def _start_game_when_ready(self):
+        try:
+            async with session_locks.hold(self.session_id):
+                await self.reupdate()
+                if self.stage != SessionStages.CellSelect.value: return
+                if not await self.all_companies_have_cells(): return
+
+                await self.update_stage(SessionStages.Game)
+        except Exception as e:
+            game_logger.error(f"Не удалось запустить игру в сессии {self.session_id}: {e}")
+
+    async def _save_turn_progress(self, progress: dict):
+        self.turn_progress = progress
+        await just_db.update(self.__tablename__, 
+                             {"session_id": self.session_id}, 
+                             {"turn_progress": progress})
+
+    async def _process_turn(self):
+        """ Смена хода по фазам: банк, компании, контракты, города, логистика, события.
+
+            Каждая фаза выполняется в одной транзакции с отметкой о ней в 
+            прогрессе (turn_progress), фаза компаний - в транзакции на каждую 
+            компанию, а события - в одной транзакции с переходом на новый ход.
+            Поэтому прерванную смену хода можно завершить через resume_turn, 
+            не применяя уже выполненные части повторно.
+
+            Без replica set фазы не атомарны, а компенсации on_rollback не 
+            выполняются при падении процесса, поэтому прерванная смена хода
+            не завершается: частично применённую фазу нельзя отличить от 
+            неприменённой.
+        """
+        from game.bank_engine import bank_engine
+        from game.citie import update_cities_demands
+        from game.contract import contract_settlement
+        from game.journal import journal
+        from game.logistics import logistics_engine
+
+        progress = self.turn_progress
+        fresh = progress.get("step") != self.step
+        if not fresh and not await just_db.supports_transactions():
+            game_logger.error(f"Смена хода {self.step} в сессии {self.session_id} была прервана, а MongoDB запущена без replica set. Прогресс: {progress}")
+            raise ValueError(
+                "Прерванную смену хода нельзя безопасно завершить без replica set MongoDB: "
+                "проверьте данные сессии и очистите turn_progress вручную.")
+
+        if fresh:
+            progress = {"step": self.step, "done": [], "companies": []}
+            await self._save_turn_progress(progress)
+
+        with journal.scope(self.session_id, self.step):
+            if "companies" not in progress["done"]:
+                # На время обработки хода действия игроков с компаниями сессии ждут.
+                # Все компании блокируются разом, поэтому действия с контрагентами 
+                # внутри хода не могут взаимно заблокироваться
+                companies = await self.companies
+                async with company_locks.hold(*(c.id for c in companies)):
+                    if fresh:
+                        await journal.checkpoint(self.session_id, self.step)
+
+                    # Вклады и кредиты всех компаний одним проходом
+                    if "bank" not in progress["done"]:
+                        async def bank_step(progress=progress):
+                            await bank_engine.step(self)
+                            await self._save_turn_progress(
+                                {**progress, "done": [*progress["done"], "bank"]})
+
+                        await just_db.transaction(bank_step)
+                        progress = self.turn_progress
+
+                    for company in companies:
+                        if company.id in progress["companies"]: continue
+
+                        async def process(company=company):
+                            await company.reupdate()
+                            await company.on_new_game_stage(self.step + 1)
+                            await self._save_turn_progress({
+                                **progress, 
+                                "companies": [*progress["companies"], company.id]
+                            })
+
+                        await just_db.transaction(process)
+                        progress = self.turn_progress
+
+                await self._save_turn_progress(
+                    {**progress, "done": [*progress["done"], "companies"]})
+                progress = self.turn_progress
+
+            # Расчёт контрактов: все контракты сессии одним проходом,
+            # в одной транзакции с отметкой фазы
+            if "contracts" not in progress["done"]:
+                async def settle(progress=progress):
+                    await contract_settlement.settle(self.session_id, self.step)
+                    await self._save_turn_progress(
+                        {**progress, "done": [*progress["done"], "contracts"]})
+
+                await just_db.transaction(settle)
+                progress = self.turn_progress
+
+            # Обновляем спрос всех городов одним проходом
+            if "cities" not in progress["done"]:
+                async def demands(progress=progress):
+                    await update_cities_demands(self, await self.cities)
+                    await self._save_turn_progress(
+                        {**progress, "done": [*progress["done"], "cities"]})
+
+                await just_db.transaction(demands)
+                progress = self.turn_progress
+
+            # Обновляем логистику
+            if "logistics" not in progress["done"]:
+                async def tick(progress=progress):
+                    await logistics_engine.tick(self)
+                    await self._save_turn_progress(
+                        {**progress, "done": [*progress["done"], "logistics"]})
+
+                await just_db.transaction(tick)
+                progress = self.turn_progress
+
+            # Генерируем события каждые 5 этапов, новый ход и сброс 
+            # прогресса - одной транзакцией
+            async def next_step():
+                # Повтор транзакции начинается с состояния сессии в базе
+                await self.reupdate()
+                await self.events_generator()
+                await just_db.update(self.__tablename__, 
+                                     {"session_id": self.session_id}, 
+                                     {"step": self.step + 1, "turn_progress": {}})
+
+            await just_db.transaction(next_step)
+            self.step += 1
+            self.turn_progress = {}
+
+        await self.execute_step_schedule(self.step)
+
+    async def resume_turn(self, wait: bool = False) -> bool:
+        """ Завершает прерванную смену хода (повторный вызов ничего не делает).
+            Возвращает False, если незавершённой смены хода нет.
+
+            Во время идущей смены стадии её прогресс тоже совпадает с текущим 
+            ходом, поэтому вызов отклоняется, а с wait=True - ждёт её окончания.
+        """
+        if not wait and session_locks.locked(self.session_id):
+            raise ValueError("Смена хода уже выполняется.")
+
+        async with session_locks.hold(self.session_id):
+            await self.reupdate()
+            if self.stage == SessionStages.End.value: return False
+            if not self.turn_progress or self.turn_progress.get("step") != self.step:
+                return False
+
+            game_logger.warning(f"В сессии {self.session_id} завершается прерванная смена хода {self.step}. Прогресс: {self.turn_progress}")
+            await self.update_stage(SessionStages.Game, whitout_shedule=True)
+            return True
+
+    def resume_turn_in_background(self):
+        """ Завершает прерванную смену хода отдельной задачей 
+            (после смены стадии, которую мог начать шедулер)
+        """
+        self._stage_task(self._resume_turn_in_background())
+
+    async def _resume_turn_in_background(self):
+        try:
+            await self.resume_turn(wait=True)
+        except Exception as e:
+            game_logger.error(f"Не удалось завершить смену хода в сессии {self.session_id}: {e}")
+
     async def execute_step_schedule(self, step):
         from game.step_shedule import StepSchedule
 
@@ -267,7 +477,8 @@ class Session(BaseClass):
                             rows: int = 0,
                             cols: int = 0,
                             x_operation: int = 0,
-                            y_operation: int = 0
+                            y_operation: int = 0,
+                            rng: Optional[random.Random] = None
                             ) -> list[int]:
         """
         label 
@@ -282,14 +493,17 @@ class Session(BaseClass):
             - смещение по X от найденной клетки
         y_operation
             - смещение по Y от найденной клетки
+        rng
+            - генератор для label random (по умолчанию модуль random)
         """
+        rng = rng or random
 
         if label == "center":
             result_row = rows // 2
             result_col = cols // 2
         elif label == "random":
-            result_row = random.randint(0, rows - 1)
-            result_col = random.randint(0, cols - 1)
+            result_row = rng.randint(0, rows - 1)
+            result_col = rng.randint(0, cols - 1)
         elif label == "right-top":
             result_row = 0
             result_col = cols - 1
@@ -317,14 +531,17 @@ class Session(BaseClass):
         return [result_row, result_col]
 
     async def generate_cells(self):
+        from game.cell_map import CellMap, CELL_INDEX, cell_maps
+        from game.occupancy import occupancy_grids
+
         if self.cells:
             game_logger.warning(f"Попытка повторной генерации клеток в сессии {self.session_id}.")
             raise ValueError("Клетки уже были сгенерированы для этой сессии.")
 
-        # Ограничения на размер карты
-        for r in range(self.map_size["rows"]):
-            for c in range(self.map_size["cols"]):
-                self.cells.append('null')
+        rng = self.rng("map")
+
+        # Карта хранится по байту на клетку, все клетки изначально пустые ('null')
+        cell_map = CellMap(self.map_size["rows"], self.map_size["cols"])
 
         # Установка объектов со стандартной позицией
         for cell_key, cell_info in cells.types.items():
@@ -339,10 +556,10 @@ class Session(BaseClass):
                     rows=self.map_size["rows"],
                     cols=self.map_size["cols"],
                     x_operation=location.x,
-                    y_operation=location.y
+                    y_operation=location.y,
+                    rng=rng
                 )
-                index = x * self.map_size["cols"] + y
-                self.cells[index] = cell_key
+                cell_map.set(x, y, cell_key)
  
 
         # Заполнение остальных клеток
@@ -351,21 +568,27 @@ class Session(BaseClass):
             types = list(
                 key for key, value in cells.types.items() if value.pickable
             )
-            null_indices = [i for i, cell in enumerate(self.cells) if cell == 'null']
+            null_indices = cell_map.indices_of('null')
 
             if null_indices and types:
                 # Создаем равномерное распределение типов для null клеток
                 types_cycle = (types * ((len(null_indices) // len(types)) + 1))[:len(null_indices)]
-                random.shuffle(types_cycle)
+                rng.shuffle(types_cycle)
+
+                for index, cell_key in zip(null_indices, types_cycle):
+                    cell_map.data[index] = CELL_INDEX[cell_key]
 
-                for i, index in enumerate(null_indices):
-                    self.cells[index] = types_cycle[i]
+        self.cells = cell_map.to_cells()
+        cell_maps.set(self.session_id, cell_map)
 
         # Подсчёт каждого типа клетки
-        self.cell_counts = dict(Counter(self.cells))
+        self.cell_counts = cell_map.counts()
         game_logger.info(f"В сессии {self.session_id} сгенерированы клетки. Распределение: {self.cell_counts}")
 
         await self.save_to_base()
+
+        # Сетка занятости строится по клеткам, поэтому пересобирается
+        occupancy_grids.drop(self.session_id)
         
         # Создаём города на клетках с типом 'city'
         await self._create_cities()
@@ -376,8 +599,9 @@ class Session(BaseClass):
         """Создаёт города на клетках типа 'city'"""
         from game.citie import Citie, NAMES
 
+        rng = self.rng("cities")
         cities_count = self.cell_counts['city']
-        city_names = random.sample(NAMES, cities_count)
+        city_names = rng.sample(NAMES, cities_count)
         city_index = 0
 
         for index, cell_type in enumerate(self.cells):
@@ -395,7 +619,7 @@ class Session(BaseClass):
 
                 if not existing_city:
                     city = await Citie().create(self.session_id, x, y,
-                                          city_names[city_index]
+                                          city_names[city_index], rng=rng
                                         )
                     city_index += 1
 
@@ -404,94 +628,80 @@ class Session(BaseClass):
     async def can_select_cell(self, x: int, y: int):
         """ Проверяет, можно ли выбрать клетку с координатами (x, y) для компании.
         """
+        from game.occupancy import occupancy_grids
+
         if not self.can_select_cells():
             raise ValueError("Текущая стадия сессии не позволяет выбирать клетки.")
 
-        index = x * self.map_size["cols"] + y
-        cell_type_key = self.cells[index]
-        cell_type = cells.types.get(cell_type_key)
-
-        if not cell_type or not cell_type.pickable or await self.get_company_oncell(x, y):
-            return False
-
-        return True
+        grid = await occupancy_grids.get(self)
+        return grid.is_free(x, y)
 
     async def get_company_oncell(self, x: int, y: int):
         """ Возвращает компанию, которая занимает клетку с координатами (x, y)
         """
+        from game.occupancy import occupancy_grids
+
+        grid = await occupancy_grids.get(self)
+        company_id = grid.owner(x, y)
+        if not company_id: return None
+
         company = await just_db.find_one(
-            "companies", session_id=self.session_id, cell_position=f"{x}.{y}")
+            "companies", session_id=self.session_id, id=company_id)
         return company
 
     async def get_free_cells(self):
         """ Возвращает список свободных клеток (без компаний)
         """
-        free_cells = []
-        for x in range(self.map_size["rows"]):
-            for y in range(self.map_size["cols"]):
-                if await self.can_select_cell(x, y):
-                    free_cells.append((x, y))
-        return free_cells
+        from game.occupancy import occupancy_grids
+
+        grid = await occupancy_grids.get(self)
+        return grid.free_cells()
 
     async def get_item_price(self, item_id: str) -> int:
         """ Получить цену предмета в данной сессии
         """
-        from game.item_price import ItemPrice
-        
-        item_price_data: dict = await just_db.find_one(
-                        "item_price", 
-                        id=item_id, 
-                        session_id=self.session_id) # type: ignore
-        if not item_price_data:
-            item_price_obj = await ItemPrice().create(self.session_id, item_id)
-            return item_price_obj.get_effective_price()
-        else:
-            item_price_obj = ItemPrice(item_id)
-            item_price_obj.load_from_base(item_price_data)
-            return item_price_obj.get_effective_price()
+        from game.price_graph import session_prices
+
+        prices = await session_prices.get(self.session_id, self.step)
+        return prices.effective_price(item_id)
 
     async def initialize_all_item_prices(self):
         """ Инициализировать цены для всех предметов из конфига
         """
-        from game.item_price import ItemPrice
-        
-        resources = ALL_CONFIGS["resources"]
-        for item_id in resources.resources.keys():
-            existing_price = await just_db.find_one("item_price", id=item_id, session_id=self.session_id)
-            if not existing_price:
-                item = ItemPrice()
-                await item.create(self.session_id, item_id)
+        from game.price_graph import session_prices
 
+        # Недостающие цены создаются при загрузке цен сессии
+        await session_prices.get(self.session_id, self.step)
         return True
 
     async def update_item_price(self, item_id: str, new_price: int):
-        """ Обновить цену предмета
+        """ Обновить цену предмета (и зависимые от неё цены по материалам).
+            Внутри транзакции обновление выполняется после коммита.
         """
-        from game.item_price import ItemPrice
-        
-        item_price_data: dict = await just_db.find_one(
-                        "item_price", 
-                        id=item_id, 
-                        session_id=self.session_id) # type: ignore
+        from game.price_graph import session_prices
 
-        if not item_price_data:
-            item_price = await ItemPrice().create(self.session_id, item_id)
-        else:
-            item_price = ItemPrice(item_id)
-            item_price.load_from_base(item_price_data)
-            
-        await item_price.add_price(new_price)
-        return item_price
+        await just_db.on_commit(
+            lambda: session_prices.update_price(
+                self.session_id, item_id, new_price, self.step)
+        )
 
     async def get_all_item_prices_dict(self) -> dict[str, int]:
         """ Получить словарь всех цен предметов в сессии
         """
-        prices_dict = {}
-        for item_price in await self.item_prices:
-            prices_dict[item_price.id] = item_price.get_effective_price()
-        return prices_dict
+        from game.price_graph import session_prices
+
+        prices = await session_prices.get(self.session_id, self.step)
+        return prices.prices_dict()
 
     async def delete(self):
+        from game.cell_map import cell_maps
+        from game.contract_registry import contract_registries
+        from game.event_effects import event_effects
+        from game.journal import journal
+        from game.occupancy import occupancy_grids
+        from game.order_book import order_books
+        from game.price_graph import session_prices
+
         for company in await self.companies: await company.delete()
         for user in await self.users: await user.delete()
         for city in await self.cities: await city.delete()
@@ -503,8 +713,18 @@ class Session(BaseClass):
         await just_db.delete("step_schedule", 
                        session_id=self.session_id)
 
+        await just_db.delete("game_history", 
+                       session_id=self.session_id)
+        await journal.delete_session(self.session_id)
+
         await just_db.delete(self.__tablename__, session_id=self.session_id)
         await session_manager.remove_session(self.session_id)
+        order_books.drop(self.session_id)
+        session_prices.drop(self.session_id)
+        occupancy_grids.drop(self.session_id)
+        cell_maps.drop(self.session_id)
+        contract_registries.drop(self.session_id)
+        event_effects.drop(self.session_id)
 
         game_logger.info(f"Сессия {self.session_id} и все связанные с ней данные удалены.")
 
@@ -563,9 +783,10 @@ class Session(BaseClass):
                 minus_rep += company.overdue_steps * 10
             minus_balance += company.tax_debt
 
-            company.balance -= minus_balance
-            company.reputation -= minus_rep
-            await company.save_to_base()
+            await company.inc({
+                "balance": -minus_balance, 
+                "reputation": -minus_rep
+            })
 
             game_logger.info(f'Компания {company.name} в сессии {self.session_id} завершила игру с балансом {company.balance} и репутацией {company.reputation}. Штрафы: {minus_balance} (баланс), {minus_rep} (репутация) за {company.overdue_steps} просроченных шагов оплаты налогов, {company.tax_debt} (налоги), {len(company.credits)} (количество кредитов)')
 
@@ -608,12 +829,13 @@ class Session(BaseClass):
         """
         from modules.sheduler import scheduler
 
-        get_schedule: dict = await scheduler.get_scheduled_tasks(
+        if not self.change_turn_schedule_id: return 0
+
+        execute_at = await scheduler.get_execute_at(
             self.change_turn_schedule_id
-            ) # type: ignore
-        if get_schedule:
-            return int((datetime.fromisoformat(
-                get_schedule['execute_at']) - datetime.now()).total_seconds())
+            )
+        if execute_at:
+            return int((execute_at - datetime.now()).total_seconds())
         return 0
 
     async def set_event(self, event_id: str, start_step: int, end_step: int):
@@ -624,6 +846,7 @@ class Session(BaseClass):
             start_step: этап начала события
             end_step: этап окончания события
         """
+        from game.event_effects import event_effects
         from game.stages import clear_session_event
         
         # Проверяем, что событие существует в конфиге
@@ -631,11 +854,20 @@ class Session(BaseClass):
             game_logger.error(f"Попытка установить несуществующее событие '{event_id}' в сессии {self.session_id}.")
             raise ValueError(f"Событие '{event_id}' не найдено в конфигурации")
             
+        previous = {"event_type": self.event_type, 
+                    "event_start": self.event_start, "event_end": self.event_end}
         self.event_type = event_id
         self.event_start = start_step
         self.event_end = end_step
 
-        await self.save_to_base()
+        await self.save_fields("event_type", "event_start", "event_end")
+        event_effects.drop(self.session_id)
+
+        async def restore():
+            self.load_from_base(previous)
+            await self.save_fields("event_type", "event_start", "event_end")
+            event_effects.drop(self.session_id)
+        await just_db.on_rollback(restore)
 
         game_logger.info(f"В сессии {self.session_id} установлено событие '{event_id}' с шага {start_step} по {end_step}.")
 
@@ -679,16 +911,19 @@ class Session(BaseClass):
             "steps_until_end": max(0, self.event_end - self.step) if self.event_end else 0
         }
     
+    @property
+    def effects(self) -> 'ActiveEffects':
+        """ Эффекты события на текущем ходе (вычисляются один раз за ход) """
+        from game.event_effects import event_effects
+        return event_effects.get(self)
+
     def get_event_effects(self) -> dict:
         """ Возвращает только эффекты текущего события для применения в игре
         
         Returns:
             dict с эффектами события или пустой dict если события нет
         """
-        event_data = self.get_event()
-        if event_data and event_data.get("is_active"):
-            return {k: v for k, v in event_data.get("effects", {}).items() if v is not None}
-        return {}
+        return dict(self.effects.raw)
 
     def public_event_data(self) -> dict:
         """ Выдает публичную информацию о событии для сайта
@@ -753,12 +988,14 @@ class Session(BaseClass):
         if not available_events:
             return False
             
+        rng = self.rng("events", self.step)
+
         # Выбираем случайное событие
-        event = random.choice(available_events)
+        event = rng.choice(available_events)
         
         # Определяем длительность события
         if event.duration.min is not None and event.duration.max is not None:
-            duration = random.randint(event.duration.min, event.duration.max)
+            duration = rng.randint(event.duration.min, event.duration.max)
         elif event.duration.min is not None:
             duration = event.duration.min
         elif event.duration.max is not None:
@@ -783,28 +1020,36 @@ class Session(BaseClass):
         
         game_logger.info(f"В сессии {self.session_id} сгенерировано событие '{event.id}'.")
         
-        # Отправляем уведомление
-        asyncio.create_task(websocket_manager.broadcast({
+        # Отправляем уведомление (после коммита смены хода)
+        event_data = self.public_event_data()
+        await just_db.on_commit(lambda: websocket_manager.broadcast({
             "type": "api-event_generated",
             "data": {
                 "session_id": self.session_id,
-                "event": self.public_event_data()
+                "event": event_data
             }
         }))
         
         return True
 
-    async def to_dict(self):
+    async def summary(self, 
+                      companies_count: Optional[int] = None, 
+                      users_count: Optional[int] = None) -> dict:
+        """ Лёгкое представление сессии без вложенных коллекций.
+            Количества можно передать заранее (например, посчитанные 
+            одним запросом для страницы сессий).
+        """
+        if companies_count is None:
+            companies_count = await just_db.count(
+                "companies", session_id=self.session_id)
+        if users_count is None:
+            users_count = await just_db.count(
+                "users", session_id=self.session_id)
+
         return {
             "id": self.session_id,
-            "companies": [await company.to_dict() for company in await self.companies],
-            "users": [user.to_dict() for user in await self.users],
-            "cities": [city.to_dict() for city in await self.cities],
-            "item_prices": [item_price.to_dict() for item_price in await self.item_prices],
-            "cells": self.cells,
             "map_size": self.map_size,
             "map_pattern": self.map_pattern,
-            "cell_counts": self.cell_counts,
             "stage": self.stage,
             "step": self.step,
             "max_steps": self.max_steps,
@@ -815,10 +1060,47 @@ class Session(BaseClass):
                 "start": self.event_start,
                 "end": self.event_end
             },
-            
-            "bots_count": self.bots_count
+
+            "bots_count": self.bots_count,
+            "companies_count": companies_count,
+            "users_count": users_count
         }
 
+    async def to_dict(self, include: Optional[list[str]] = None, 
+                      companies_count: Optional[int] = None, 
+                      users_count: Optional[int] = None):
+        """ Представление сессии. 
+            include - список вложенных коллекций из SESSION_INCLUDES, 
+            None - все коллекции (полное представление).
+        """
+        from game.company import companies_to_dict
+
+        if include is None: include = list(SESSION_INCLUDES)
+        for key in include:
+            if key not in SESSION_INCLUDES:
+                raise ValueError(f"Неизвестная коллекция: {key}. Доступны: {', '.join(SESSION_INCLUDES)}")
+
+        companies = await self.companies if "companies" in include else None
+        users = await self.users if "users" in include else None
+        if companies is not None: companies_count = len(companies)
+        if users is not None: users_count = len(users)
+
+        data = await self.summary(companies_count, users_count)
+
+        if companies is not None:
+            data["companies"] = await companies_to_dict(companies)
+        if users is not None:
+            data["users"] = [user.to_dict() for user in users]
+        if "cities" in include:
+            data["cities"] = [city.to_dict() for city in await self.cities]
+        if "item_prices" in include:
+            data["item_prices"] = [item_price.to_dict() for item_price in await self.item_prices]
+        if "cells" in include:
+            data["cells"] = self.cells
+            data["cell_counts"] = self.cell_counts
+
+        return data
+
 class SessionObject:
     session_id: str
     _id: uuid.UUID
@@ -838,8 +1120,8 @@ class SessionsManager():
     def __init__(self):
         self.sessions = {}
 
-    async def create_session(self, session_id: str = ""):
-        session = await Session(session_id=session_id).start()
+    async def create_session(self, session_id: str = "", seed: str = ""):
+        session = await Session(session_id=session_id, seed=seed).start()
         if session.session_id in self.sessions:
             game_logger.error(f"Попытка создать сессию с уже существующим ID: {session.session_id}")
             raise ValueError("Сессия с этим ID уже существует в памяти.")
@@ -863,6 +1145,10 @@ class SessionsManager():
             session = Session(s['session_id'])
             session.load_from_base(s)
             self.sessions[session.session_id] = session
+
+            # Смена хода была прервана (например, падением сервера)
+            if session.turn_progress and session.stage != SessionStages.End.value:
+                session.resume_turn_in_background()
         game_logger.info(f"Загружено {len(ss)} сессий из базы данных.")
 
 session_manager = SessionsManager()
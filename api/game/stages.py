@@ -1,6 +1,7 @@
 from modules.sheduler import scheduler
 from datetime import datetime, timedelta
 from global_modules.load_config import ALL_CONFIGS, Settings
+from modules.locks import session_locks
 from modules.logs import game_logger
 
 settings: Settings = ALL_CONFIGS['settings']
@@ -9,8 +10,13 @@ GAME_TIME = settings.time_on_game_stage * 60
 CHANGETURN_TIME = settings.time_on_change_stage * 60
 
 async def stage_game_updater(session_id: str):
-    """ Фнукция для цикличного обновления стадии игры
+    """ Фнукция для цикличного обновления стадии игры.
+        Смена стадии и планирование следующей - под блокировкой сессии
     """
+    async with session_locks.hold(session_id):
+        return await _stage_game_updater(session_id)
+
+async def _stage_game_updater(session_id: str):
     from game.session import SessionStages, session_manager
     session = await session_manager.get_session(session_id)
 
@@ -57,6 +63,7 @@ async def leave_from_prison(session_id: str, company_id: int):
 async def clear_session_event(session_id: str):
     """ Функция для очистки события сессии (вызывается через шедулер)
     """
+    from game.event_effects import event_effects
     from game.session import session_manager
 
     session = await session_manager.get_session(session_id)
@@ -67,6 +74,7 @@ async def clear_session_event(session_id: str):
     session.event_start = None
     session.event_end = None
     await session.save_to_base()
+    event_effects.drop(session_id)
     
     game_logger.info(f"Event cleared for session {session_id}")
     return 1
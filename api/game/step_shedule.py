@@ -58,12 +58,19 @@ class StepSchedule(BaseClass, SessionObject):
         if not session.step <= self.in_step:
             raise ValueError("Неверный шаг для добавления функции.")
 
-        self.functions.append({
+        entry = {
             "function": func_to_str(function),
             "args": kwargs
-        })
+        }
+        self.functions.append(entry)
         await self.save_to_base()
         await self.reupdate()
+
+        async def remove():
+            await self.reupdate()
+            if entry in self.functions: self.functions.remove(entry)
+            await self.save_fields("functions")
+        await just_db.on_rollback(remove)
         return True
 
     async def execute(self):
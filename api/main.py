@@ -15,6 +15,7 @@ from modules.sheduler import scheduler
 from game.session import session_manager
 from game.exchange import Exchange
 from game.citie import Citie
+from game.journal import journal
 from os import getenv
 from global_modules.logs import main_logger
 
@@ -35,18 +36,23 @@ async def lifespan(app: FastAPI):
     websocket_logger.info("Creating missing tables on startup...")
     # await just_db.drop_all() # Тестово
 
-    await just_db.create_table('sessions') # Таблица сессий
-    await just_db.create_table('users') # Таблица пользователей
-    await just_db.create_table('companies') # Таблица компаний
-    await just_db.create_table('game_history') # Таблица c историей ходов
+    await just_db.create_table('sessions', ['session_id', 'stage']) # Таблица сессий
+    await just_db.create_table('users', ['session_id']) # Таблица пользователей
+    await just_db.create_table('companies', ['session_id']) # Таблица компаний
+    await just_db.create_table('game_history', ['session_id,step']) # Таблица c историей ходов
     await just_db.create_table('time_schedule') # Таблица с задачами по времени
     await just_db.create_table('step_schedule') # Таблица с задачами по шагам
     await just_db.create_table('contracts') # Таблица с контрактами
-    await just_db.create_table('cities') # Таблица с городами
+    await just_db.create_table('cities', ['session_id']) # Таблица с городами
     await just_db.create_table('exchanges') # Таблица с биржей
     await just_db.create_table('factories') # Таблица с заводами
-    await just_db.create_table('item_price') # Таблица с ценами на товары
+    await just_db.create_table('item_price', ['session_id,id']) # Таблица с ценами на товары
     await just_db.create_table('logistics') # Таблица с логистикой
+    await just_db.create_table('journal', ['seq', 'session_id,seq', 'entity']) # Журнал изменений
+    await just_db.create_table('journal_checkpoints', ['session_id,seq']) # Снимки сессий для реплея
+
+    websocket_logger.info("Starting journal...")
+    await journal.start()
 
     websocket_logger.info("Loading sessions from database...")
     await session_manager.load_from_base()
@@ -66,6 +72,9 @@ async def lifespan(app: FastAPI):
     scheduler.stop()
     await scheduler.cleanup_shutdown_tasks()
 
+    websocket_logger.info("Flushing journal...")
+    await journal.stop()
+
 app = get_fastapi_app(
     title="API",
     version="6.6.6",
@@ -5,6 +5,6 @@ just_db = MongoDatabase(
             connection_string=getenv(
                 'MONGODB_URL', 'mongodb://localhost:27017'
             ),
-            database_name='api_database',
+            database_name=getenv('MONGODB_DATABASE', 'api_database'),
             auto_connect=True
             )
\ No newline at end of file
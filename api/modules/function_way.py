@@ -1,4 +1,8 @@
 import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from game.cell_map import CellMap
 
 def func_to_str(func):
     """Преобразует функцию в строку вида 'модуль.имя_функции'."""
@@ -12,55 +16,26 @@ def str_to_func(func_path):
     return getattr(module, func_name)
 
 
-def get_neighboring_cells(x: int, y: int, radius: int, map_size: dict) -> list[tuple[int, int]]:
-    """Получает соседние клетки в радиусе от заданной координаты.
-    
-    Args:
-        x: координата X
-        y: координата Y
-        radius: радиус поиска
-        map_size: размер карты {"rows": int, "cols": int}
-    
-    Returns:
-        Список кортежей с координатами соседних клеток
-    """
-    neighbors = []
-    rows = map_size["rows"]
-    cols = map_size["cols"]
-    
-    for dx in range(-radius, radius + 1):
-        for dy in range(-radius, radius + 1):
-            # Пропускаем центральную клетку
-            if dx == 0 and dy == 0:
-                continue
-            
-            new_x = x + dx
-            new_y = y + dy
-            
-            # Проверяем, что координаты в пределах карты
-            if 0 <= new_x < rows and 0 <= new_y < cols:
-                neighbors.append((new_x, new_y))
-    
-    return neighbors
-
-
 async def determine_city_branch(
     x: int, y: int, 
-    session_id: str, cells: list[str], 
-    map_size: dict) -> str:
+    session_id: str, cell_map: 'CellMap', 
+    rng=None) -> str:
     """Определяет приоритетную ветку ресурсов для города на основе соседних клеток.
     
     Args:
         x: координата X города
         y: координата Y города
         session_id: ID сессии
-        cells: список клеток карты
-        map_size: размер карты
+        cell_map: карта сессии (CellMap)
+        rng: генератор случайных чисел (random.Random), по умолчанию модуль random
     
     Returns:
         Название ветки ('oil', 'metal', 'wood', 'cotton')
     """
     from modules.db import just_db
+    import random
+
+    rng = rng or random
     
     # Маппинг типов клеток на ветки ресурсов
     cell_to_branch = {
@@ -83,24 +58,19 @@ async def determine_city_branch(
                 occupied_branches[(city_x, city_y)] = city['branch']
     
     radius = 1
-    max_radius = max(map_size["rows"], map_size["cols"]) // 2
+    max_radius = max(cell_map.rows, cell_map.cols) // 2
     
     while radius <= max_radius:
-        neighbors = get_neighboring_cells(x, y, radius, map_size)
-        branch_counts = {'oil': 0, 'metal': 0, 'wood': 0, 'cotton': 0}
-        
-        # Подсчитываем ресурсы в радиусе
-        for nx, ny in neighbors:
-            index = nx * map_size["cols"] + ny
-            if index < len(cells):
-                cell_type = cells[index]
-                if cell_type in cell_to_branch:
-                    branch = cell_to_branch[cell_type]
-                    branch_counts[branch] += 1
+        # Подсчитываем ресурсы в радиусе (по префиксным суммам карты)
+        branch_counts = {
+            branch: cell_map.window_count(cell_type, x, y, radius)
+            for cell_type, branch in cell_to_branch.items()
+        }
         
         # Исключаем ветки, занятые другими городами в этом радиусе
         for (city_x, city_y), branch in occupied_branches.items():
-            if (city_x, city_y) in neighbors:
+            if (city_x, city_y) != (x, y) and \
+                    max(abs(city_x - x), abs(city_y - y)) <= radius:
                 # Уменьшаем приоритет занятой ветки
                 branch_counts[branch] = max(0, branch_counts[branch] - 2)
         
@@ -116,8 +86,7 @@ async def determine_city_branch(
             
             if available_branches:
                 # Возвращаем случайную из доступных топовых веток
-                import random
-                return random.choice(available_branches)
+                return rng.choice(available_branches)
             elif len(top_branches) == 1 or max_count >= radius * 2:
                 # Если только одна ветка лидирует или явное преимущество
                 return top_branches[0]
@@ -126,8 +95,7 @@ async def determine_city_branch(
         radius += 1
     
     # Если ничего не нашли, возвращаем случайную ветку
-    import random
     available = [b for b in ['oil', 'metal', 'wood', 'cotton'] 
                  if b not in occupied_branches.values()]
-    return random.choice(available) if available else random.choice(
+    return rng.choice(available) if available else rng.choice(
         ['oil', 'metal', 'wood', 'cotton'])
\ No newline at end of file
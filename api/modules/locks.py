@@ -0,0 +1,110 @@
+import asyncio
+from contextlib import asynccontextmanager
+from functools import wraps
+from typing import Any, Callable, Hashable, Optional
+
+
+class _KeyLock:
+    """ Блокировка одного ключа с владельцем-задачей (для реентерабельности) """
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.owner: Optional[asyncio.Task] = None
+        self.depth: int = 0
+        self.users: int = 0 # владелец + ожидающие, для очистки реестра
+
+
+class KeyedLock:
+    """ Реестр реентерабельных asyncio-блокировок по ключу.
+
+        Операции над одним ключом выполняются строго по очереди,
+        операции над разными ключами - параллельно. Повторный захват
+        ключа той же задачей не блокирует. Блокировки создаются по
+        требованию и удаляются, когда их никто не держит и не ждёт.
+
+        Несколько ключей нужно захватывать одним вызовом hold(a, b):
+        они берутся в отсортированном порядке, что исключает взаимную
+        блокировку двух задач.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._locks: dict[Hashable, _KeyLock] = {}
+
+    async def _acquire(self, key: Hashable):
+        task = asyncio.current_task()
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = _KeyLock()
+
+        if entry.owner is task:
+            entry.depth += 1
+            return
+
+        entry.users += 1
+        try:
+            await entry.lock.acquire()
+        except BaseException:
+            entry.users -= 1
+            if not entry.users: self._locks.pop(key, None)
+            raise
+
+        entry.owner = task
+        entry.depth = 1
+
+    def _release(self, key: Hashable):
+        entry = self._locks[key]
+        entry.depth -= 1
+        if entry.depth: return
+
+        entry.owner = None
+        entry.users -= 1
+        entry.lock.release()
+        if not entry.users: del self._locks[key]
+
+    @asynccontextmanager
+    async def hold(self, *keys: Any):
+        """ Захватывает блокировки всех переданных ключей (None пропускается) """
+        ordered = sorted({str(key) for key in keys if key is not None})
+
+        acquired = []
+        try:
+            for key in ordered:
+                await self._acquire(key)
+                acquired.append(key)
+            yield
+        finally:
+            for key in reversed(acquired):
+                self._release(key)
+
+    def locked(self, key: Any) -> bool:
+        """ Занят ли ключ """
+        entry = self._locks.get(str(key))
+        return entry is not None and entry.lock.locked()
+
+
+# Блокировки изменений компаний (ключ - id компании)
+company_locks = KeyedLock("company")
+
+# Блокировки смены стадий сессии (ключ - id сессии). Смена хода берёт
+# блокировки всех компаний сессии, поэтому её нельзя запускать под
+# блокировкой отдельной компании - только из задачи без блокировок
+session_locks = KeyedLock("session")
+
+
+def with_company_lock(*fields: str):
+    """ Декоратор асинхронного метода: выполняет его под блокировкой
+        компаний, id которых лежат в указанных атрибутах объекта.
+
+        Пример:
+        @with_company_lock("supplier_company_id", "customer_company_id")
+        async def accept_contract(self, ...): ...
+    """
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            async with company_locks.hold(
+                    *(getattr(self, field) for field in fields)):
+                return await func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,18 +1,43 @@
-from typing import Callable, Optional
+from collections import deque
+from typing import Callable, Hashable, Optional
 from modules.db import just_db
 from modules.function_way import *
 import asyncio
+import contextvars
 from datetime import datetime
 import json
 
 
 class TaskScheduler:
+    """ Планировщик задач по времени.
+
+        Наступившие задачи раскладываются по очередям: у каждой сессии 
+        (kwargs["session_id"]) своя очередь, задачи одной сессии выполняются 
+        строго по порядку, разные сессии - параллельно. Общее число 
+        одновременно выполняемых задач ограничено семафором (ожидающие 
+        очереди получают его по порядку). Задача, уже стоящая в очереди 
+        или выполняемая, повторно не ставится.
+    """
 
     __table_name__ = 'time_schedule'
 
-    def __init__(self, db=just_db):
+    def __init__(self, db=just_db, max_concurrency: int = 8):
         self.db = db
         self.running = False
+        # id задачи -> время выполнения, чтобы не ходить в базу за таймерами
+        self._execute_at: dict[int, datetime] = {}
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queues: dict[Hashable, deque[dict]] = {}
+        self._workers: dict[Hashable, asyncio.Task] = {}
+        self._in_flight: set[int] = set()
+        # Задачи, завершённые во время чтения таблицы: чтение могло их не увидеть
+        self._completed: set[int] = set()
+        # Задержка начала выполнения относительно execute_at (секунды)
+        self._delays: deque[float] = deque(maxlen=1000)
+        self._delay_max: float = 0.0
+        self._executed: int = 0
+
         asyncio.create_task(self._init_schedule_table())
 
     async def _init_schedule_table(self):
@@ -38,13 +63,90 @@ class TaskScheduler:
 
     async def _check_and_execute_tasks(self):
         current_time = datetime.now()
+        self._completed.clear()
         tasks =  await self.db.find(self.__table_name__)
         tasks: list[dict] = list(tasks)
 
-        for task in tasks:
-            task_time = datetime.fromisoformat(task['execute_at'])
-            if task_time <= current_time:
-                await self._execute_task(task)
+        self._execute_at = {
+            task['id']: datetime.fromisoformat(task['execute_at']) 
+            for task in tasks
+        }
+
+        due = [task for task in tasks 
+               if self._execute_at[task['id']] <= current_time 
+               and task['id'] not in self._in_flight
+               and task['id'] not in self._completed]
+        due.sort(key=lambda task: (self._execute_at[task['id']], task['id']))
+
+        for task in due:
+            self._enqueue(task)
+
+    @staticmethod
+    def _queue_key(task: dict) -> Hashable:
+        """ Очередь задачи: сессия из kwargs, задачи без сессии - общая очередь """
+        try:
+            kwargs = json.loads(task.get('kwargs', '{}'))
+        except (TypeError, ValueError):
+            kwargs = {}
+        return kwargs.get('session_id') if isinstance(kwargs, dict) else None
+
+    def _enqueue(self, task: dict):
+        key = self._queue_key(task)
+        self._in_flight.add(task['id'])
+        self._queues.setdefault(key, deque()).append(task)
+
+        if key not in self._workers:
+            # Чистый контекст: задачи не наследуют состояние цикла планировщика
+            self._workers[key] = asyncio.get_running_loop().create_task(
+                self._run_queue(key), context=contextvars.Context())
+
+    async def _run_queue(self, key: Hashable):
+        """ Выполняет задачи очереди по порядку, пока она не опустеет """
+        queue = self._queues[key]
+        try:
+            while queue:
+                task = queue[0]
+                async with self._semaphore:
+                    self._record_delay(task)
+                    try:
+                        await self._execute_task(task)
+                    except Exception as e:
+                        print(f"Ошибка при завершении задачи {task['function_path']}: {e}")
+                    finally:
+                        queue.popleft()
+                        self._in_flight.discard(task['id'])
+                        self._completed.add(task['id'])
+        finally:
+            self._workers.pop(key, None)
+            if not queue: self._queues.pop(key, None)
+
+    def _record_delay(self, task: dict):
+        execute_at = self._execute_at.get(task['id']) or \
+            datetime.fromisoformat(task['execute_at'])
+        delay = max(0.0, (datetime.now() - execute_at).total_seconds())
+
+        self._delays.append(delay)
+        self._delay_max = max(self._delay_max, delay)
+        self._executed += 1
+
+    def metrics(self) -> dict:
+        """ Метрики планировщика: задержка начала выполнения задач 
+            относительно назначенного времени (по последним 1000 задачам)
+        """
+        delays = sorted(self._delays)
+        def percentile(p: float) -> float:
+            if not delays: return 0.0
+            return delays[min(len(delays) - 1, int(len(delays) * p))]
+
+        return {
+            "executed": self._executed,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+            "active_queues": len(self._workers),
+            "delay_avg": sum(delays) / len(delays) if delays else 0.0,
+            "delay_p50": percentile(0.5),
+            "delay_p95": percentile(0.95),
+            "delay_max": self._delay_max
+        }
 
     async def _execute_task(self, task):
         func = str_to_func(task['function_path'])
@@ -69,9 +171,11 @@ class TaskScheduler:
                            {'id': task['id']}, 
                            {'execute_at': next_execute_time.isoformat()}
                            )
+            self._execute_at[task['id']] = next_execute_time
 
         else:
             await self.db.delete(self.__table_name__, id=task['id'])
+            self._execute_at.pop(task['id'], None)
 
     async def schedule_task(self, function: Callable, 
                       execute_at: datetime, 
@@ -92,7 +196,9 @@ class TaskScheduler:
             'delete_on_shutdown': delete_on_shutdown
         }
 
-        return await self.db.insert(self.__table_name__, task_data)
+        task_id = await self.db.insert(self.__table_name__, task_data)
+        self._execute_at[task_id] = execute_at
+        return task_id
 
     async def cleanup_shutdown_tasks(self):
         """
@@ -101,6 +207,7 @@ class TaskScheduler:
         """
         try:
             deleted_count = await self.db.delete(self.__table_name__, delete_on_shutdown=True)
+            self._execute_at.clear()
             print(f"Удалено {deleted_count} задач при завершении работы")
             return deleted_count
         except Exception as e:
@@ -113,5 +220,20 @@ class TaskScheduler:
         """
         return await self.db.find_one(self.__table_name__, id=id)
 
+    async def get_execute_at(self, id: int) -> Optional[datetime]:
+        """
+        Возвращает время выполнения задачи. Сначала смотрит в памяти, 
+        при промахе загружает задачу из базы.
+        """
+        if id in self._execute_at:
+            return self._execute_at[id]
+
+        task = await self.get_scheduled_tasks(id)
+        if not task: return None
+
+        execute_at = datetime.fromisoformat(task['execute_at'])
+        self._execute_at[id] = execute_at
+        return execute_at
+
 
 scheduler = TaskScheduler()
\ No newline at end of file
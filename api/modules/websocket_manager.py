@@ -2,6 +2,7 @@ from fastapi import WebSocket, WebSocketDisconnect
 from typing import Dict, List, Any
 import json
 from modules.logs import websocket_logger
+from modules.db import just_db
 
 class WebSocketManager:
     """Менеджер для управления WebSocket соединениями"""
@@ -115,6 +116,16 @@ class WebSocketManager:
         Returns:
             int: Количество клиентов, которым успешно доставлено сообщение
         """
+        if just_db.in_transaction():
+            # Изменения внутри транзакции ещё могут быть отменены,
+            # поэтому сообщение отправляется только после коммита
+            await just_db.on_commit(lambda: self._broadcast(message, exclude))
+            return 0
+
+        return await self._broadcast(message, exclude)
+
+    async def _broadcast(self, message: Any, 
+                         exclude: List[str] = None) -> int:
         exclude = exclude or []
         success_count = 0
 
@@ -1,6 +1,7 @@
 # Реестр обработчиков сообщений
 from typing import Callable, Dict, List, Union
 from modules.websocket_manager import websocket_manager
+from modules.locks import company_locks
 from modules.logs import websocket_logger
 from modules.logs import routers_logger
 import traceback
@@ -10,7 +11,8 @@ MESSAGE_HANDLERS: Dict[str, dict[str, Union[Callable, str]]] = {}
 def message_handler(message_type: str, 
                     doc: str = "", 
                     datatypes: list[str] = [],
-                    messages: list[str] = []
+                    messages: list[str] = [],
+                    lock_companies: list[str] = []
                     ):
     """
     Декоратор для регистрации обработчиков сообщений
@@ -26,12 +28,15 @@ def message_handler(message_type: str,
         doc: Описание обработчика
         datatypes: Список типов данных, которые ожидает обработчик [user_id: int, action: Optional[str], ...]
         messages: На какие типы сообщений отправляет ответ при обработке
+        lock_companies: Поля сообщения с id компаний, изменения которых 
+            выполняются под блокировкой (по очереди для одной компании)
     """
     def decorator(func: Callable):
         MESSAGE_HANDLERS[message_type] = {
             "handler": func, "doc": doc,
             "datatypes": datatypes,
-            "messages": messages
+            "messages": messages,
+            "lock_companies": lock_companies
             }
         websocket_logger.info(f"Зарегистрирован обработчик для типа сообщения: {message_type}")
         return func
@@ -53,7 +58,11 @@ async def handle_message(client_id: str, message: dict):
             routers_logger.info(f"Обработка сообщения типа {message_type} от клиента {client_id}")
 
             handler = MESSAGE_HANDLERS[message_type]["handler"]
-            result = await handler(client_id, message)
+            lock_fields: list[str] = MESSAGE_HANDLERS[message_type]["lock_companies"] # type: ignore
+
+            async with company_locks.hold(
+                    *(message.get(field) for field in lock_fields)):
+                result = await handler(client_id, message)
 
             if 'request_id' in message:
                 # Если есть request_id, отправляем ответ
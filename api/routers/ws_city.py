@@ -65,7 +65,8 @@ async def handle_get_city(client_id: str, message: dict):
         "password: str",
         "request_id: str"
     ],
-    messages=["api-city-trade (broadcast)"]
+    messages=["api-city-trade (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_sell_to_city(client_id: str, message: dict):
     """Обработчик продажи ресурса городу"""
@@ -3,15 +3,16 @@ from modules.websocket_manager import websocket_manager
 from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
-from game.company import Company
+from game.company import Company, companies_to_dict
 
 @message_handler(
     "get-companies", 
-    doc="Обработчик получения списка компаний. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка компаний. Отправляет ответ на request_id. view - уровень детализации (summary, finance, full), по умолчанию full", 
     datatypes=[
         "session_id: Optional[int]", 
         "in_prison: Optional[bool]",
         "cell_position: Optional[str]",
+        "view: Optional[Literal['summary', 'finance', 'full']]",
         "request_id: str"
         ])
 async def handle_get_companies(client_id: str, message: dict):
@@ -27,7 +28,10 @@ async def handle_get_companies(client_id: str, message: dict):
     companies: list[Company] = await just_db.find('companies', to_class=Company,
                          **{k: v for k, v in conditions.items() if v is not None}) # type: ignore
 
-    return [await company.to_dict() for company in companies]
+    try:
+        return await companies_to_dict(companies, message.get("view") or "full")
+    except ValueError as e:
+        return {"error": str(e)}
 
 @message_handler(
     "get-company", 
@@ -40,6 +44,7 @@ async def handle_get_companies(client_id: str, message: dict):
         "in_prison: Optional[bool]",
         "session_id: Optional[str]",
         "cell_position: Optional[str]",
+        "view: Optional[Literal['summary', 'finance', 'full']]",
         "request_id: str"
         ])
 async def handle_get_company(client_id: str, message: dict):
@@ -59,7 +64,12 @@ async def handle_get_company(client_id: str, message: dict):
     company = await just_db.find_one('companies', to_class=Company,
                          **{k: v for k, v in conditions.items() if v is not None})
 
-    return await company.to_dict() if company else None
+    if not company: return None
+
+    try:
+        return await company.to_dict(message.get("view") or "full")
+    except ValueError as e:
+        return {"error": str(e)}
 
 @message_handler(
     "create-company", 
@@ -143,7 +153,8 @@ async def handle_update_company_add_user(client_id: str, message: dict):
         "password: str",
         "request_id: str"
     ],
-    messages=["api-company_set_position (broadcast)"]
+    messages=["api-company_set_position (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_set_company_position(client_id: str, message: dict):
     """Обработчик обновления компании"""
@@ -183,7 +194,8 @@ async def handle_set_company_position(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-user_left_company (broadcast)"]
+    messages=["api-user_left_company (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_update_company_left_user(client_id: str, message: dict):
     """Обработчик выхода пользователя из компании"""
@@ -213,7 +225,8 @@ async def handle_update_company_left_user(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-company_deleted (broadcast)"]
+    messages=["api-company_deleted (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_delete_company(client_id: str, message: dict):
     """Обработчик удаления компании."""
@@ -296,7 +309,8 @@ async def handle_get_company_improvement_info(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-company_improvement_upgraded (broadcast)"]
+    messages=["api-company_improvement_upgraded (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_update_company_improve(client_id: str, message: dict):
     """Обработчик улучшения компании"""
@@ -330,7 +344,8 @@ async def handle_update_company_improve(client_id: str, message: dict):
         "request_id: str",
         "password: str"
     ],
-    messages=["api-company_credit_taken (broadcast)"]
+    messages=["api-company_credit_taken (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_company_take_credit(client_id: str, message: dict):
     """Обработчик получения кредита компанией"""
@@ -356,6 +371,36 @@ async def handle_company_take_credit(client_id: str, message: dict):
 
     return credit_data
 
+@message_handler(
+    "quote-credit", 
+    doc="Обработчик расчёта кредита без оформления: условия по репутации компании и график платежей по ходам. Отправляет ответ на request_id.",
+    datatypes=[
+        "company_id: int",
+        "amount: int",
+        "period: int",
+
+        "request_id: str"
+    ]
+)
+async def handle_quote_credit(client_id: str, message: dict):
+    """Обработчик расчёта кредита"""
+
+    company_id = message.get("company_id")
+    amount = message.get("amount")
+    period = message.get("period")
+
+    for i in [company_id, amount, period]:
+        if i is None: return {"error": "Missing required fields."}
+
+    try:
+        company = await Company(id=company_id).reupdate()
+        if not company: raise ValueError("Компания не найдена.")
+
+        return await company.quote_credit(amount, period)
+
+    except ValueError as e:
+        return {"error": str(e)}
+
 @message_handler(
     "company-pay-credit", 
     doc="Обработчик погашения кредита компанией. Требуется пароль для взаимодействия.",
@@ -366,7 +411,8 @@ async def handle_company_take_credit(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-company_credit_paid (broadcast)"]
+    messages=["api-company_credit_paid (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_company_pay_credit(client_id: str, message: dict):
     """Обработчик погашения кредита компанией"""
@@ -401,7 +447,8 @@ async def handle_company_pay_credit(client_id: str, message: dict):
         "request_id: str",
         "password: str"
     ],
-    messages=["api-company_deposit_taken (broadcast)"]
+    messages=["api-company_deposit_taken (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_company_take_deposit(client_id: str, message: dict):
     """Обработчик создания вклада компанией"""
@@ -436,7 +483,8 @@ async def handle_company_take_deposit(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-company_deposit_withdrawn (broadcast)"]
+    messages=["api-company_deposit_withdrawn (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_company_withdraw_deposit(client_id: str, message: dict):
     """Обработчик снятия вклада компанией"""
@@ -470,7 +518,8 @@ async def handle_company_withdraw_deposit(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-company_tax_paid (broadcast)"]
+    messages=["api-company_tax_paid (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_company_pay_taxes(client_id: str, message: dict):
     """Обработчик погашения налогов компанией"""
@@ -505,7 +554,8 @@ async def handle_company_pay_taxes(client_id: str, message: dict):
 
         "password: str"
     ],
-    messages=["api-factory-start-complectation (broadcast для каждой фабрики)"]
+    messages=["api-factories-bulk-complectation (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_company_complete_free_factories(client_id: str, message: dict):
     """Обработчик массовой перекомплектации свободных фабрик компании"""
@@ -529,14 +579,14 @@ async def handle_company_complete_free_factories(client_id: str, message: dict):
         if not company: raise ValueError("Компания не найдена.")
 
         # Вызываем метод массовой перекомплектации
-        await company.complete_free_factories(
+        result = await company.complete_free_factories(
             find_resource=find_resource,
             new_resource=new_resource,
             count=count,
             produce_status=produce_status
         )
 
-        return {"success": True}
+        return {"success": True, **result}
 
     except ValueError as e:
         return {"error": str(e)}
@@ -550,7 +600,8 @@ async def handle_company_complete_free_factories(client_id: str, message: dict):
         "balance_change: int",
         "password: str"
     ],
-    messages=[]
+    messages=[],
+    lock_companies=["company_id"]
 )
 async def handle_notforgame_update_company_balance(
     client_id: str, message: dict):
@@ -589,7 +640,8 @@ async def handle_notforgame_update_company_balance(
         "ignore_space: Optional[bool]",
         "password: str"
     ],
-    messages=[]
+    messages=[],
+    lock_companies=["company_id"]
 )
 async def handle_notforgame_update_company_items(
     client_id: str, message: dict):
@@ -629,7 +681,8 @@ async def handle_notforgame_update_company_items(
         "new_name: str",
         "password: str"
     ],
-    messages=['api-company_name_updated (broadcast)']
+    messages=['api-company_name_updated (broadcast)'],
+    lock_companies=["company_id"]
 )
 async def handle_notforgame_update_company_name(
     client_id: str, message: dict):
@@ -651,7 +704,7 @@ async def handle_notforgame_update_company_name(
         if not company: raise ValueError("Компания не найдена.")
 
         company.name = new_name
-        await company.save_to_base()
+        await company.save_fields("name")
 
         await websocket_manager.broadcast({
             "type": "api-company_name_updated",
@@ -671,7 +724,8 @@ async def handle_notforgame_update_company_name(
     datatypes=[
         "company_id: int",
         "password: str"
-    ]
+    ],
+    lock_companies=["company_id"]
 )
 async def handle_notforgame_to_prison(
     client_id: str, message: dict):
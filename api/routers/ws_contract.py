@@ -89,7 +89,8 @@ async def handle_get_contract(client_id: str, message: dict):
         "password: str",
         "request_id: str"
     ],
-    messages=["api-contract_created (broadcast)"]
+    messages=["api-contract_created (broadcast)"],
+    lock_companies=["supplier_company_id", "customer_company_id"]
 )
 async def handle_create_contract(client_id: str, message: dict):
     """Обработчик создания контракта"""
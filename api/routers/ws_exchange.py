@@ -3,23 +3,45 @@ from modules.check_password import check_password
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
 from game.exchange import Exchange
+from game.order_book import order_books
+from game.session import session_manager
 
 @message_handler(
     "get-exchanges", 
-    doc="Обработчик получения списка предложений на бирже. Отправляет ответ на request_id.", 
+    doc="Обработчик получения списка предложений на бирже. Отправляет ответ на request_id. С session_id предложения берутся из стакана сессии и отсортированы по ресурсу, типу и цене за единицу; limit - размер страницы, cursor - поле cursor последнего предложения предыдущей страницы.", 
     datatypes=[
         "session_id: Optional[str]",
         "company_id: Optional[int]",
         "sell_resource: Optional[str]",
         "offer_type: Optional[str]",
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
         "request_id: str"
     ])
 async def handle_get_exchanges(client_id: str, 
                                message: dict):
     """Обработчик получения списка предложений на бирже"""
 
+    session_id = message.get("session_id")
+
+    if session_id is not None:
+        # Стакан строится и кэшируется только для существующих сессий
+        if not await session_manager.get_session(session_id):
+            return {"error": "Session not found."}
+
+        book = await order_books.get(session_id)
+        try:
+            return book.offers(
+                sell_resource=message.get("sell_resource"),
+                offer_type=message.get("offer_type"),
+                company_id=message.get("company_id"),
+                limit=message.get("limit"),
+                cursor=message.get("cursor")
+            )
+        except ValueError as e:
+            return {"error": str(e)}
+
     conditions = {
-        "session_id": message.get("session_id"),
         "company_id": message.get("company_id"),
         "sell_resource": message.get("sell_resource"),
         "offer_type": message.get("offer_type")
@@ -32,6 +54,40 @@ async def handle_get_exchanges(client_id: str,
 
     return [offer.to_dict() for offer in offers] # type: ignore
 
+@message_handler(
+    "get-exchange-depth", 
+    doc="Обработчик получения глубины стакана ресурса: уровни цены за единицу с количеством предложений и объёмом товара. Отправляет ответ на request_id.", 
+    datatypes=[
+        "session_id: str",
+        "sell_resource: str",
+        "offer_type: Optional[Literal['money', 'barter']]",
+        "levels: Optional[int]",
+        "request_id: str"
+    ])
+async def handle_get_exchange_depth(client_id: str, message: dict):
+    """Обработчик получения глубины стакана"""
+
+    session_id = message.get("session_id")
+    sell_resource = message.get("sell_resource")
+
+    if session_id is None or sell_resource is None:
+        return {"error": "Missing required fields: session_id, sell_resource"}
+
+    if not await session_manager.get_session(session_id):
+        return {"error": "Session not found."}
+
+    book = await order_books.get(session_id)
+    return {
+        "session_id": session_id,
+        "sell_resource": sell_resource,
+        "offer_type": message.get("offer_type", "money"),
+        "levels": book.depth(
+            sell_resource, 
+            message.get("offer_type", "money"), 
+            message.get("levels", 10)
+        )
+    }
+
 @message_handler(
     "get-exchange", 
     doc="Обработчик получения конкретного предложения на бирже. Отправляет ответ на request_id.", 
@@ -75,7 +131,8 @@ async def handle_get_exchange(client_id: str, message: dict):
         "password: str",
         "request_id: str"
     ],
-    messages=["api-exchange_offer_created (broadcast)"]
+    messages=["api-exchange_offer_created (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_create_exchange_offer(client_id: str, message: dict):
     """Обработчик создания предложения на бирже"""
@@ -275,4 +332,45 @@ async def handle_buy_exchange_offer(
     except ValueError as e:
         return {"error": str(e)}
 
-    return result
\ No newline at end of file
+    return result
+
+@message_handler(
+    "market-buy-exchange", 
+    doc="Обработчик рыночной покупки: набирает amount единиц ресурса из самых дешёвых денежных предложений одной сделкой. Требуется пароль для взаимодействия. Отправляет ответ на request_id.",
+    datatypes=[
+        "session_id: str",
+        "buyer_company_id: int",
+        "resource: str",
+        "amount: int",
+        "max_unit_price: Optional[int]",
+        "password: str",
+        "request_id: str"
+    ],
+    messages=["api-exchange_market_buy_completed (broadcast)"]
+)
+async def handle_market_buy_exchange(
+    client_id: str, message: dict):
+    """Обработчик рыночной покупки"""
+
+    session_id = message.get("session_id")
+    buyer_company_id = message.get("buyer_company_id")
+    resource = message.get("resource")
+    amount = message.get("amount")
+    password = message.get("password")
+
+    required_fields = [session_id, buyer_company_id, resource, amount, password]
+    if any(field is None for field in required_fields):
+        return {"error": "Missing required fields: session_id, buyer_company_id, resource, amount, password"}
+
+    try:
+        check_password(password)
+
+        return await Exchange.market_buy(
+            session_id=session_id, # type: ignore
+            buyer_company_id=buyer_company_id, # type: ignore
+            resource=resource, # type: ignore
+            amount=amount, # type: ignore
+            max_unit_price=message.get("max_unit_price")
+        )
+    except ValueError as e:
+        return {"error": str(e)}
@@ -1,7 +1,7 @@
 
 from modules.ws_hadnler import message_handler
 from modules.db import just_db
-from game.factory import Factory
+from game.factory import Factory, FactoryFleet, bulk_rekit, bulk_set_produce, bulk_set_auto
 from modules.check_password import check_password
 
 @message_handler(
@@ -26,11 +26,40 @@ async def handle_get_factories(client_id: str, message: dict):
     }
 
     # Получаем список фабрик из базы данных
-    factories = await just_db.find('factories',
+    factories: list[Factory] = await just_db.find('factories',
                              to_class=Factory,
-                         **{k: v for k, v in conditions.items() if v is not None})
+                         **{k: v for k, v in conditions.items() if v is not None}) # type: ignore
 
-    return [await factory.to_dict() for factory in factories]
+    # Склады всех компаний загружаются одним запросом
+    company_ids = list({factory.company_id for factory in factories})
+    warehouses = {
+        company["id"]: company.get("warehouses", {})
+        for company in await just_db.find(
+            'companies', id={"$in": company_ids}, 
+            projection=["id", "warehouses"]) # type: ignore
+    } if company_ids else {}
+
+    return [factory.serialize(warehouses.get(factory.company_id, {})) 
+            for factory in factories]
+
+@message_handler(
+    "get-factory-fleet", 
+    doc="Обработчик получения фабрик компании группами по комплектации и состоянию (rekit, running, start, idle): количество, id и прогресс фабрик группы. Отправляет ответ на request_id", 
+    datatypes=[
+        "company_id: int",
+
+        "request_id: str"
+        ])
+async def handle_get_factory_fleet(client_id: str, message: dict):
+    """Обработчик получения групп фабрик компании"""
+
+    company_id = message.get("company_id")
+    if company_id is None:
+        return {"error": "company_id is required"}
+
+    factories: list[Factory] = await just_db.find('factories', 
+                             to_class=Factory, company_id=company_id) # type: ignore
+    return FactoryFleet(factories).summary()
 
 @message_handler(
     "get-factory", 
@@ -150,4 +179,98 @@ async def handle_factory_set_auto(client_id: str, message: dict):
 
         return {"success": True}
     except ValueError as e:
-        return {"error": str(e)}
\ No newline at end of file
+        return {"error": str(e)}
+
+@message_handler(
+    "factories-bulk-rekit", 
+    doc="Обработчик массовой перекомплектации: до count фабрик компании с комплектацией find_complectation (null - без комплектации) одним запросом. produce_status - фильтр по produce (null - без фильтра), is_auto - установить авто-режим. Требуется пароль для взаимодействия. Отправляет ответ на request_id.",
+    datatypes=[
+        "company_id: int",
+        "new_complectation: str",
+        "count: int",
+        "find_complectation: Optional[str]",
+        "produce_status: Optional[bool]",
+        "is_auto: Optional[bool]",
+
+        "request_id: str",
+        "password: str"
+    ],
+    messages=["api-factories-bulk-complectation (broadcast)"],
+    lock_companies=["company_id"]
+)
+async def handle_factories_bulk_rekit(client_id: str, message: dict):
+    """Обработчик массовой перекомплектации фабрик"""
+
+    password = message.get("password")
+    company_id = message.get("company_id")
+    new_complectation = message.get("new_complectation")
+    count = message.get("count")
+
+    for i in [company_id, new_complectation, count, password]:
+        if i is None: return {"error": "Missing required fields."}
+
+    try:
+        check_password(password)
+
+        return await bulk_rekit(
+            company_id, new_complectation, count,
+            find_complectation=message.get("find_complectation"),
+            produce_status=message.get("produce_status"),
+            is_auto=message.get("is_auto")
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+
+@message_handler(
+    "factories-bulk-set-produce", 
+    doc="Обработчик запуска / остановки производства фабрик компании с комплектацией complectation (null - всех скомплектованных) одним запросом. Отправляет ответ на request_id.",
+    datatypes=[
+        "company_id: int",
+        "produce: bool",
+        "complectation: Optional[str]",
+
+        "request_id: str"
+    ],
+    messages=["api-factories-bulk-produce (broadcast)"],
+    lock_companies=["company_id"]
+)
+async def handle_factories_bulk_set_produce(client_id: str, message: dict):
+    """Обработчик массовой установки статуса производства фабрик"""
+
+    company_id = message.get("company_id")
+    produce = message.get("produce")
+
+    for i in [company_id, produce]:
+        if i is None: return {"error": "Missing required fields."}
+
+    try:
+        return await bulk_set_produce(company_id, produce, message.get("complectation"))
+    except ValueError as e:
+        return {"error": str(e)}
+
+@message_handler(
+    "factories-bulk-set-auto", 
+    doc="Обработчик включения / выключения авто-производства фабрик компании с комплектацией complectation (null - всех фабрик) одним запросом. Отправляет ответ на request_id.",
+    datatypes=[
+        "company_id: int",
+        "is_auto: bool",
+        "complectation: Optional[str]",
+
+        "request_id: str"
+    ],
+    messages=["api-factories-bulk-auto (broadcast)"],
+    lock_companies=["company_id"]
+)
+async def handle_factories_bulk_set_auto(client_id: str, message: dict):
+    """Обработчик массовой установки авто-производства фабрик"""
+
+    company_id = message.get("company_id")
+    is_auto = message.get("is_auto")
+
+    for i in [company_id, is_auto]:
+        if i is None: return {"error": "Missing required fields."}
+
+    try:
+        return await bulk_set_auto(company_id, is_auto, message.get("complectation"))
+    except ValueError as e:
+        return {"error": str(e)}
@@ -18,4 +18,15 @@ async def handle_ping(client_id: str, message: dict):
     }
 
     await websocket_manager.send_message(client_id, pong_message)
-    websocket_logger.debug(f"Отправлен pong клиенту {client_id}")
\ No newline at end of file
+    websocket_logger.debug(f"Отправлен pong клиенту {client_id}")
+
+
+@message_handler(
+    "get-scheduler-metrics", 
+    doc="Обработчик получения метрик планировщика: число выполненных и ожидающих задач, активные очереди сессий и задержка начала выполнения задач относительно назначенного времени (секунды). Отправляет ответ на request_id.", 
+    datatypes=["request_id: str"])
+async def handle_get_scheduler_metrics(client_id: str, message: dict):
+    """Обработчик получения метрик планировщика"""
+    from modules.sheduler import scheduler
+
+    return scheduler.metrics()
@@ -44,7 +44,8 @@ async def handle_get_logistics(client_id: str, message: dict):
         "password: str",
         "request_id: str"
     ],
-    messages=["api-logistics_picked_up (broadcast)"]
+    messages=["api-logistics_picked_up (broadcast)"],
+    lock_companies=["company_id"]
 )
 async def handle_logistics_pickup(client_id: str, message: dict):
     """Обработчик получения ожидающего груза"""
@@ -6,31 +6,55 @@ from modules.check_password import check_password
 
 @message_handler(
     "get-sessions", 
-    doc="Обработчик получения списка сессий. Отправляет ответ на request_id", 
+    doc="Обработчик получения списка сессий (краткое представление). Отправляет ответ на request_id. Постраничный вывод: limit - размер страницы, cursor - id последней сессии предыдущей страницы. include - список вложенных коллекций (companies, users, cities, item_prices, cells)", 
     datatypes=[
         "stage: Optional[str]", 
+        "limit: Optional[int]",
+        "cursor: Optional[str]",
+        "include: Optional[list[str]]",
         "request_id: str"
         ])
 async def handle_get_sessions(client_id: str, message: dict):
     """Обработчик получения списка сессий"""
 
+    limit = message.get("limit")
+    cursor = message.get("cursor")
+    include = message.get("include") or []
+
     conditions = {
         "stage": message.get("stage"),
+        "session_id": {"$gt": cursor} if cursor else None
     }
 
-    # Получаем список сессий из базы данных
-    sessions = await just_db.find('sessions',
+    # Получаем страницу сессий из базы данных одним запросом по индексу
+    sessions: list[Session] = await just_db.find('sessions',
                             to_class=Session,
-                         **{k: v for k, v in conditions.items() if v is not None})
+                            sort=[("session_id", 1)],
+                            limit=limit,
+                         **{k: v for k, v in conditions.items() if v is not None}) # type: ignore
+
+    session_ids = [s.session_id for s in sessions]
+    companies_count = await just_db.count_by(
+        'companies', 'session_id', session_id={"$in": session_ids})
+    users_count = await just_db.count_by(
+        'users', 'session_id', session_id={"$in": session_ids})
 
-    return [await s.to_dict() for s in sessions]
+    try:
+        return [await s.to_dict(
+            include,
+            companies_count=companies_count.get(s.session_id, 0),
+            users_count=users_count.get(s.session_id, 0)
+            ) for s in sessions]
+    except ValueError as e:
+        return {"error": str(e)}
 
 @message_handler(
     "get-session", 
-    doc="Обработчик получения сессии. Отправляет ответ на request_id.", 
+    doc="Обработчик получения сессии. Отправляет ответ на request_id. include - список вложенных коллекций (companies, users, cities, item_prices, cells), по умолчанию все.", 
     datatypes=[
         "session_id: Optional[str]", 
         "stage: Optional[str]",
+        "include: Optional[list[str]]",
         "request_id: str"
         ])
 async def handle_get_session(client_id: str, message: dict):
@@ -46,13 +70,19 @@ async def handle_get_session(client_id: str, message: dict):
                                to_class=Session,
                          **{k: v for k, v in conditions.items() if v is not None})
 
-    return await session.to_dict() if session else None
+    if not session: return None
+
+    try:
+        return await session.to_dict(message.get("include"))
+    except ValueError as e:
+        return {"error": str(e)}
 
 @message_handler(
     "create-session", 
     doc="Обработчик создания сессии. Отправляет ответ на request_id. Требуется пароль для взаимодействия.",
     datatypes=[
         "session_id: Optional[str]",
+        "seed: Optional[str]",
         "password: str",
         "request_id: str"
     ]
@@ -61,12 +91,14 @@ async def handle_create_session(client_id: str, message: dict):
     """Обработчик создания сессии"""
 
     session_id = message.get("session_id", "")
+    seed = message.get("seed", "")
     password = message.get("password", "")
 
     try:
         check_password(password)
 
-        session = await session_manager.create_session(session_id=session_id)
+        session = await session_manager.create_session(
+            session_id=session_id, seed=seed or "")
     except ValueError as e:
         return {"error": str(e)}
 
@@ -137,6 +169,125 @@ async def handle_get_sessions_free_cells(
     except ValueError as e:
         return {"error": str(e)}
 
+@message_handler(
+    "get-session-cells", 
+    doc="Обработчик получения карты сессии по частям (для больших карт). start_row - первая строка, rows - количество строк (по умолчанию 10). В ответе next_row - начало следующей части (None, если карта передана целиком). Отправляет ответ на request_id",
+    datatypes=[
+        "session_id: str",
+        "start_row: Optional[int]",
+        "rows: Optional[int]",
+        "request_id: str",
+    ]
+)
+async def handle_get_session_cells(client_id: str, message: dict):
+    """Обработчик получения карты сессии по частям"""
+    from game.cell_map import cell_maps
+
+    session_id = message.get("session_id", "")
+    start_row = message.get("start_row") or 0
+    rows = message.get("rows") or 10
+
+    try:
+        session = await session_manager.get_session(session_id=session_id)
+        if not session: raise ValueError("Сессия не найдена.")
+
+        return cell_maps.get(session).rows_chunk(int(start_row), int(rows))
+
+    except (ValueError, TypeError) as e:
+        return {"error": str(e)}
+
+@message_handler(
+    "get-session-history", 
+    doc="Обработчик получения истории сессии по ходам (временные ряды для графиков). fields - поля (balance, reputation, economic_power, warehouses, prices, demands), по умолчанию все. companies / cities / items - фильтры по id. from_step / to_step - диапазон ходов. Отправляет ответ на request_id",
+    datatypes=[
+        "session_id: str",
+        "fields: Optional[list[str]]",
+        "companies: Optional[list[int]]",
+        "cities: Optional[list[int]]",
+        "items: Optional[list[str]]",
+        "from_step: Optional[int]",
+        "to_step: Optional[int]",
+        "request_id: str",
+    ]
+)
+async def handle_get_session_history(client_id: str, message: dict):
+    """Обработчик получения истории сессии"""
+    from game.history import get_history
+
+    try:
+        return await get_history(
+            message.get("session_id", ""),
+            fields=message.get("fields"),
+            companies=message.get("companies"),
+            cities=message.get("cities"),
+            items=message.get("items"),
+            from_step=message.get("from_step"),
+            to_step=message.get("to_step")
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+
+@message_handler(
+    "resume-turn", 
+    doc="Обработчик завершения прерванной смены хода. Повторный вызов безопасен: уже выполненные части хода не применяются снова. Во время идущей смены стадии или хода возвращает ошибку. Требуется пароль для взаимодействия. Отправляет ответ на request_id",
+    datatypes=[
+        "session_id: str",
+        "password: str",
+        "request_id: str",
+    ],
+    messages=["api-update_session_stage (broadcast)"]
+)
+async def handle_resume_turn(client_id: str, message: dict):
+    """Обработчик завершения прерванной смены хода"""
+
+    session_id = message.get("session_id", "")
+    password = message.get("password", "")
+
+    try:
+        check_password(password)
+
+        session = await session_manager.get_session(session_id=session_id)
+        if not session: raise ValueError("Сессия не найдена.")
+
+        resumed = await session.resume_turn()
+        return {"resumed": resumed, "step": session.step}
+
+    except ValueError as e:
+        return {"error": str(e)}
+
+@message_handler(
+    "replay-session", 
+    doc="Обработчик восстановления состояния сессии из журнала (последний снимок + записи журнала) без изменения данных. until_seq - восстановить состояние на момент записи журнала с этим номером. Возвращает количество применённых записей, время и количество объектов по коллекциям. Требуется пароль для взаимодействия. Отправляет ответ на request_id",
+    datatypes=[
+        "session_id: str",
+        "until_seq: Optional[int]",
+        "password: str",
+        "request_id: str",
+    ]
+)
+async def handle_replay_session(client_id: str, message: dict):
+    """Обработчик восстановления состояния сессии из журнала"""
+    from time import perf_counter
+    from game.journal import rebuild
+
+    session_id = message.get("session_id", "")
+    password = message.get("password", "")
+
+    try:
+        check_password(password)
+
+        started = perf_counter()
+        engine = await rebuild(session_id, message.get("until_seq"))
+
+        return {
+            "applied": engine.applied,
+            "seconds": round(perf_counter() - started, 4),
+            "counts": {table: len(docs) for table, docs in engine.tables.items()}
+        }
+
+    except ValueError as e:
+        return {"error": str(e)}
+
 @message_handler(
     "delete-session", 
     doc="Обработчик удаления сессии. ВНИМАНИЕ! Это приведёт к удалению всех привязанных игроков и компаний. Требуется пароль для взаимодействия. Требуется `really=true` для подтверждения удаления.",
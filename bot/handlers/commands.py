@@ -301,7 +301,7 @@ async def on_update_session_stage(message: dict):
     
     if new_stage == "CellSelect":
         # Получаем все компании в сессии
-        companies = await get_companies(session_id=session_id)
+        companies = await get_companies(session_id=session_id, view='summary')
         
         for company in companies:
             company_id = company.get('id')
@@ -325,7 +325,7 @@ async def on_update_session_stage(message: dict):
     
     elif new_stage == "Game":
         # Проверяем каждую компанию на нахождение в тюрьме
-        companies = await get_companies(session_id=session_id)
+        companies = await get_companies(session_id=session_id, view='summary')
         
         for company in companies:
             company_id = company.get('id')
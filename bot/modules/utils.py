@@ -46,7 +46,7 @@ async def update_page(user_company_id, page_name, user_id = None):
 
 
 async def go_to_page(session_id, old_page_name, new_page_name):
-    companies = await get_companies(session_id=session_id)
+    companies = await get_companies(session_id=session_id, view='summary')
     for c in companies:
         company_id = c.get('id')
         users = await get_users(session_id=session_id, company_id=company_id)
@@ -18,13 +18,15 @@ ws_client = create_client(
 )
 
 # Функции для работы с компаниями
-async def get_companies(session_id: Optional[str] = None, in_prison: Optional[bool] = None, cell_position: Optional[str] = None):
+async def get_companies(session_id: Optional[str] = None, in_prison: Optional[bool] = None, cell_position: Optional[str] = None,
+                        view: Literal['summary', 'finance', 'full'] = 'full'):
     """Получение списка компаний"""
     return await ws_client.send_message(
         "get-companies",
         session_id=session_id,
         in_prison=in_prison,
         cell_position=cell_position,
+        view=view,
         wait_for_response=True,
         timeout=50
     )
@@ -132,6 +134,16 @@ async def company_take_credit(company_id: str, amount: int, period: int):
         wait_for_response=True
     )
 
+async def quote_credit(company_id: str, amount: int, period: int):
+    """Расчёт кредита без оформления (условия и график платежей)"""
+    return await ws_client.send_message(
+        "quote-credit",
+        company_id=company_id,
+        amount=amount,
+        period=period,
+        wait_for_response=True
+    )
+
 async def company_pay_credit(company_id: str, credit_index: int, amount: int):
     """Погашение кредита компанией"""
     return await ws_client.send_message(
@@ -461,6 +473,14 @@ async def get_factory(factory_id: int):
         wait_for_response=True
     )
 
+async def get_factory_fleet(company_id: int):
+    """Получение фабрик компании группами (комплектация, состояние)"""
+    return await ws_client.send_message(
+        "get-factory-fleet",
+        company_id=company_id,
+        wait_for_response=True
+    )
+
 async def factory_recomplectation(factory_id: int, new_complectation: str):
     """Перекомплектация фабрики"""
     return await ws_client.send_message(
@@ -489,12 +509,57 @@ async def factory_set_auto(factory_id: int, is_auto: bool):
         wait_for_response=True
     )
 
+async def factories_bulk_rekit(company_id: int, new_complectation: str, count: int,
+                               find_complectation: Optional[str] = None,
+                               produce_status: Optional[bool] = None,
+                               is_auto: Optional[bool] = None):
+    """Массовая перекомплектация фабрик компании одним запросом"""
+    return await ws_client.send_message(
+        "factories-bulk-rekit",
+        company_id=company_id,
+        new_complectation=new_complectation,
+        count=count,
+        find_complectation=find_complectation,
+        produce_status=produce_status,
+        is_auto=is_auto,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
+async def factories_bulk_set_produce(company_id: int, produce: bool, 
+                                     complectation: Optional[str] = None):
+    """Запуск / остановка производства группы фабрик"""
+    return await ws_client.send_message(
+        "factories-bulk-set-produce",
+        company_id=company_id,
+        produce=produce,
+        complectation=complectation,
+        wait_for_response=True
+    )
+
+async def factories_bulk_set_auto(company_id: int, is_auto: bool, 
+                                  complectation: Optional[str] = None):
+    """Включение / выключение авто-производства группы фабрик"""
+    return await ws_client.send_message(
+        "factories-bulk-set-auto",
+        company_id=company_id,
+        is_auto=is_auto,
+        complectation=complectation,
+        wait_for_response=True
+    )
+
 # Функции для работы с сессиями
-async def get_sessions(stage: Optional[str] = None):
-    """Получение списка сессий"""
+async def get_sessions(stage: Optional[str] = None, 
+                       limit: Optional[int] = None,
+                       cursor: Optional[str] = None,
+                       include: Optional[list[str]] = None):
+    """Получение списка сессий (краткое представление)"""
     return await ws_client.send_message(
         "get-sessions",
         stage=stage,
+        limit=limit,
+        cursor=cursor,
+        include=include,
         wait_for_response=True
     )
 
@@ -507,11 +572,94 @@ async def get_session(session_id: Optional[str] = None, stage: Optional[str] = N
         wait_for_response=True
     )
 
-async def create_session(session_id: Optional[str] = None):
-    """Создание сессии"""
+async def get_session_cells(session_id: str, 
+                            start_row: Optional[int] = None, 
+                            rows: Optional[int] = None):
+    """Получение карты сессии по частям
+    
+    Args:
+        session_id: ID сессии
+        start_row: первая строка части
+        rows: количество строк в части
+    """
+    return await ws_client.send_message(
+        "get-session-cells",
+        session_id=session_id,
+        start_row=start_row,
+        rows=rows,
+        wait_for_response=True
+    )
+
+async def get_session_history(session_id: str, 
+                              fields: Optional[list[str]] = None,
+                              companies: Optional[list[int]] = None,
+                              cities: Optional[list[int]] = None,
+                              items: Optional[list[str]] = None,
+                              from_step: Optional[int] = None,
+                              to_step: Optional[int] = None):
+    """Получение истории сессии по ходам
+    
+    Args:
+        session_id: ID сессии
+        fields: поля (balance, reputation, economic_power, warehouses, prices, demands)
+        companies: ID компаний
+        cities: ID городов
+        items: ID предметов для цен
+        from_step: первый ход
+        to_step: последний ход
+    """
+    return await ws_client.send_message(
+        "get-session-history",
+        session_id=session_id,
+        fields=fields,
+        companies=companies,
+        cities=cities,
+        items=items,
+        from_step=from_step,
+        to_step=to_step,
+        wait_for_response=True
+    )
+
+async def resume_turn(session_id: str):
+    """Завершение прерванной смены хода
+    
+    Args:
+        session_id: ID сессии
+    """
+    return await ws_client.send_message(
+        "resume-turn",
+        session_id=session_id,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
+async def replay_session(session_id: str, until_seq: Optional[int] = None):
+    """Восстановление состояния сессии из журнала (проверка реплея)
+    
+    Args:
+        session_id: ID сессии
+        until_seq: номер записи журнала, до которой восстанавливать
+    """
+    return await ws_client.send_message(
+        "replay-session",
+        session_id=session_id,
+        until_seq=until_seq,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
+async def create_session(session_id: Optional[str] = None, 
+                         seed: Optional[str] = None):
+    """Создание сессии
+    
+    Args:
+        session_id: ID сессии
+        seed: seed случайных чисел сессии (для воспроизводимых игр)
+    """
     return await ws_client.send_message(
         "create-session",
         session_id=session_id,
+        seed=seed,
         password=UPDATE_PASSWORD,
         wait_for_response=True
     )
@@ -708,14 +856,29 @@ async def delete_user(user_id: int):
 
 # Функции биржи (Exchange)
 async def get_exchanges(session_id: Optional[str] = None, company_id: Optional[int] = None, 
-                       sell_resource: Optional[str] = None, offer_type: Optional[str] = None):
-    """Получить список предложений биржи с фильтрацией"""
+                       sell_resource: Optional[str] = None, offer_type: Optional[str] = None,
+                       limit: Optional[int] = None, cursor: Optional[str] = None):
+    """Получить список предложений биржи с фильтрацией (от самых выгодных)"""
     return await ws_client.send_message(
         "get-exchanges",
         session_id=session_id,
         company_id=company_id,
         sell_resource=sell_resource,
         offer_type=offer_type,
+        limit=limit,
+        cursor=cursor,
+        wait_for_response=True
+    )
+
+async def get_exchange_depth(session_id: str, sell_resource: str, 
+                             offer_type: Literal['money', 'barter'] = 'money', levels: int = 10):
+    """Получить глубину стакана ресурса на бирже"""
+    return await ws_client.send_message(
+        "get-exchange-depth",
+        session_id=session_id,
+        sell_resource=sell_resource,
+        offer_type=offer_type,
+        levels=levels,
         wait_for_response=True
     )
 
@@ -792,6 +955,28 @@ async def cancel_exchange_offer(offer_id: int):
         wait_for_response=True
     )
 
+async def market_buy_exchange(session_id: str, buyer_company_id: int, resource: str, amount: int,
+                              max_unit_price: Optional[int] = None):
+    """Рыночная покупка ресурса с биржи по самым дешёвым предложениям
+    
+    Args:
+        session_id: ID сессии
+        buyer_company_id: ID компании-покупателя
+        resource: Покупаемый ресурс
+        amount: Желаемое количество единиц
+        max_unit_price: Максимальная цена за единицу
+    """
+    return await ws_client.send_message(
+        "market-buy-exchange",
+        session_id=session_id,
+        buyer_company_id=buyer_company_id,
+        resource=resource,
+        amount=amount,
+        max_unit_price=max_unit_price,
+        password=UPDATE_PASSWORD,
+        wait_for_response=True
+    )
+
 async def buy_exchange_offer(offer_id: int, buyer_company_id: int, quantity: int):
     """Купить предложение с биржи
     
@@ -349,7 +349,7 @@ class AdminPanelPage(Page):
         scene_data = self.scene.get_data('scene')
         page = scene_data.get('admin_page', 0)
         
-        companies = await get_companies()
+        companies = await get_companies(view='summary')
         if not companies:
             companies = []
         
@@ -400,7 +400,7 @@ class AdminPanelPage(Page):
             await self.scene.set_data('scene', scene_data)
         
         # Получаем и показываем список компаний
-        companies = await get_companies()
+        companies = await get_companies(view='summary')
         if not companies or len(companies) == 0:
             text += "📋 Нет зарегистрированных компаний\n\n"
         else:
@@ -427,7 +427,7 @@ class AdminPanelPage(Page):
         scene_data = self.scene.get_data('scene')
         page = scene_data.get('admin_page', 0)
         
-        companies = await get_companies()
+        companies = await get_companies(view='summary')
         if not companies or len(companies) == 0:
             return "📋 *Нет зарегистрированных компаний*"
         
@@ -453,7 +453,7 @@ class AdminPanelPage(Page):
         scene_data = self.scene.get_data('scene')
         page = scene_data.get('admin_page', 0)
         
-        companies = await get_companies()
+        companies = await get_companies(view='summary')
         if not companies:
             companies = []
         
@@ -1,8 +1,8 @@
 from oms import Page
 from aiogram.types import CallbackQuery, Message
-from modules.ws_client import get_company, company_take_credit, company_pay_credit, get_session
+from modules.ws_client import get_company, company_take_credit, company_pay_credit, get_session, quote_credit
 from oms.utils import callback_generator
-from global_modules.bank import get_credit_conditions, calc_credit, CAPITAL
+from global_modules.bank import get_credit_conditions, CAPITAL
 from global_modules.load_config import ALL_CONFIGS
 
 class BankCreditPage(Page):
@@ -197,18 +197,19 @@ class BankCreditPage(Page):
         credit_period = scene_data.get('credit_period', 0)
         credit_amount = scene_data.get('credit_amount', 0)
         
-        # Получаем условия кредитования
-        conditions = get_credit_conditions(reputation)
-        
-        # Расчитываем параметры кредита
-        total, pay_per_turn, extra = calc_credit(
-            S=credit_amount,
-            free=conditions.without_interest,
-            r_percent=conditions.percent,
-            T=credit_period
+        # Условия и график платежей считает сервер одним запросом
+        quote = await quote_credit(
+            company_id=scene_data.get('company_id'),
+            amount=credit_amount,
+            period=credit_period
         )
+        if isinstance(quote, str):
+            return f"❌ Ошибка при расчёте кредита: {quote}"
+        if isinstance(quote, dict) and 'error' in quote:
+            return f"❌ {quote['error']}"
         
-        percent = conditions.percent * 100
+        percent = quote['percent'] * 100
+        schedule = quote.get('schedule', [])
         
         text = f"""💳 *Подтверждение кредита*
 
@@ -218,15 +219,22 @@ class BankCreditPage(Page):
 
 *Условия:*
 Процентная ставка: {percent}%
-Льготный период: {conditions.without_interest} ход(ов)
-Ходов с процентами: {extra}
+Льготный период: {quote['without_interest']} ход(ов)
+Ходов с процентами: {quote['extra']}
 
 *К оплате:*
-Всего к возврату: {total:,} 💰
-Платеж за ход: {pay_per_turn:,} 💰
-
-Подтвердите взятие кредита:""".replace(",", " ")
+Всего к возврату: {quote['total']:,} 💰
+Платеж за ход: {quote['pay_per_turn']:,} 💰""".replace(",", " ")
+        
+        # Показываем график, если платежи по ходам различаются
+        if len(set(schedule)) > 1:
+            text += "\n\n*График платежей:*\n"
+            text += "\n".join(
+                f"Ход {i}: {payment:,} 💰".replace(",", " ")
+                for i, payment in enumerate(schedule, 1)
+            )
         
+        text += "\n\nПодтвердите взятие кредита:"
         return text
     
     async def buttons_worker(self):
@@ -23,7 +23,7 @@ class CompanyCreate(Page):
         session_id = scene_data['session']
 
         # Проверяем, не существует ли уже компания с таким именем в этой сессии
-        existing_companies = await get_companies(session_id=session_id)
+        existing_companies = await get_companies(session_id=session_id, view='summary')
         for company in existing_companies or []:
             if company.get('name', '').lower() == company_name.lower():
                 self.content = self.__page__.content
@@ -8,6 +8,9 @@ from .oneuser_page import OneUserPage
 
 RESOURCES: Resources = ALL_CONFIGS["resources"]
 
+# Предложений на странице списка
+ITEMS_PER_PAGE = 5
+
 
 class ExchangePage(OneUserPage):
     
@@ -86,10 +89,42 @@ class ExchangePage(OneUserPage):
         
         return "❌ Неизвестное состояние"
     
+    async def _load_list_page(self, scene_data: dict, session_id: str):
+        """Страница предложений с сервера по курсору
+
+        scene_data['list_cursors'][n] - курсор начала страницы n
+        (None для первой). Запрашивается на одно предложение больше
+        страницы, чтобы узнать, есть ли следующая.
+
+        Returns:
+            (предложения страницы, есть ли следующая) или (ошибка, False)
+        """
+        cursors = scene_data.get('list_cursors') or [None]
+        page = min(scene_data.get('list_page', 0), len(cursors) - 1)
+
+        exchanges = await get_exchanges(
+            session_id=session_id,
+            sell_resource=scene_data.get('filter_resource'),
+            limit=ITEMS_PER_PAGE + 1,
+            cursor=cursors[page]
+        )
+        if not isinstance(exchanges, list):
+            return exchanges, False
+
+        has_next = len(exchanges) > ITEMS_PER_PAGE
+        exchanges = exchanges[:ITEMS_PER_PAGE]
+
+        del cursors[page + 1:]
+        if has_next:
+            cursors.append(exchanges[-1].get('cursor'))
+
+        scene_data['list_page'] = page
+        scene_data['list_cursors'] = cursors
+        return exchanges, has_next
+
     async def _list_screen(self, scene_data: dict, session_id: str, company_id: int):
         """Основной экран со списком предложений"""
         success_message = scene_data.get('success_message', '')
-        current_page = scene_data.get('list_page', 0)
         filter_resource = scene_data.get('filter_resource', None)
         
         text = "📈 *Биржа*\n\n"
@@ -100,45 +135,27 @@ class ExchangePage(OneUserPage):
             scene_data['success_message'] = ''
             await self.scene.set_data('scene', scene_data)
         
-        # Получаем предложения
+        # Получаем предложения текущей страницы
         if filter_resource:
             resource = RESOURCES.get_resource(filter_resource)
             if resource:
                 text += f"🔍 Поиск: {resource.emoji} {resource.label}\n\n"
-            exchanges = await get_exchanges(
-                session_id=session_id,
-                sell_resource=filter_resource
-            )
         else:
             text += "📋 Все предложения:\n\n"
-            exchanges = await get_exchanges(session_id=session_id)
-        
-        if isinstance(exchanges, str):
-            return f"❌ Ошибка при получении предложений: {exchanges}"
+
+        page_exchanges, _ = await self._load_list_page(scene_data, session_id)
+        await self.scene.set_data('scene', scene_data)
+
+        if not isinstance(page_exchanges, list):
+            return f"❌ Ошибка при получении предложений: {page_exchanges}"
         
-        if not exchanges or len(exchanges) == 0:
+        if not page_exchanges:
             text += "_Нет доступных предложений_\n\n"
             if filter_resource:
                 text += "Попробуйте сбросить фильтр или выбрать другой ресурс"
             return text
         
-        # Пагинация (5 предложений на страницу)
-        items_per_page = 5
-        total_pages = max(1, (len(exchanges) + items_per_page - 1) // items_per_page)
-        
-        # Нормализуем номер страницы
-        current_page = current_page % total_pages
-        scene_data['list_page'] = current_page
-        scene_data['total_pages'] = total_pages
-        await self.scene.set_data('scene', scene_data)
-        
-        # Получаем предложения для текущей страницы
-        start_idx = current_page * items_per_page
-        end_idx = start_idx + items_per_page
-        page_exchanges = exchanges[start_idx:end_idx]
-        
-        text += f"Найдено предложений: {len(exchanges)}\n"
-        text += f"Страница: {current_page + 1}/{total_pages}\n\n"
+        text += f"Страница: {scene_data['list_page'] + 1}\n\n"
         
         # Отображаем предложения (краткая информация)
         for i, exchange in enumerate(page_exchanges, 1):
@@ -417,27 +434,12 @@ class ExchangePage(OneUserPage):
         
         # Кнопки для списка предложений
         if exchange_state == 'list':
-            filter_resource = scene_data.get('filter_resource', None)
-            
-            # Получаем предложения для генерации кнопок
-            if filter_resource:
-                exchanges = await get_exchanges(
-                    session_id=session_id,
-                    sell_resource=filter_resource
-                )
-            else:
-                exchanges = await get_exchanges(session_id=session_id)
+            # Получаем предложения текущей страницы для генерации кнопок
+            page_exchanges, has_next = await self._load_list_page(scene_data, session_id)
+            await self.scene.set_data('scene', scene_data)
+            current_page = scene_data.get('list_page', 0)
             
-            if isinstance(exchanges, list) and len(exchanges) > 0:
-                # Пагинация
-                items_per_page = 5
-                current_page = scene_data.get('list_page', 0)
-                total_pages = scene_data.get('total_pages', 1)
-                
-                start_idx = current_page * items_per_page
-                end_idx = start_idx + items_per_page
-                page_exchanges = exchanges[start_idx:end_idx]
-                
+            if isinstance(page_exchanges, list) and len(page_exchanges) > 0:
                 # Кнопки предложений
                 for exchange in page_exchanges:
                     sell_res = RESOURCES.get_resource(exchange.get('sell_resource', ''))
@@ -469,18 +471,18 @@ class ExchangePage(OneUserPage):
                     })
                 
                 # Навигация между страницами (если страниц больше одной)
-                if total_pages > 1:
+                if current_page > 0 or has_next:
                     nav_row = []
                     
-                    prev_page = (current_page - 1) % total_pages
-                    nav_row.append({
-                        'text': '◀️ Назад',
-                        'callback_data': callback_generator(
-                            self.scene.__scene_name__,
-                            'list_page',
-                            str(prev_page)
-                        )
-                    })
+                    if current_page > 0:
+                        nav_row.append({
+                            'text': '◀️ Назад',
+                            'callback_data': callback_generator(
+                                self.scene.__scene_name__,
+                                'list_page',
+                                str(current_page - 1)
+                            )
+                        })
                     
                     # Кнопка фильтра посередине
                     nav_row.append({
@@ -491,15 +493,15 @@ class ExchangePage(OneUserPage):
                         )
                     })
                     
-                    next_page = (current_page + 1) % total_pages
-                    nav_row.append({
-                        'text': 'Вперёд ▶️',
-                        'callback_data': callback_generator(
-                            self.scene.__scene_name__,
-                            'list_page',
-                            str(next_page)
-                        )
-                    })
+                    if has_next:
+                        nav_row.append({
+                            'text': 'Вперёд ▶️',
+                            'callback_data': callback_generator(
+                                self.scene.__scene_name__,
+                                'list_page',
+                                str(current_page + 1)
+                            )
+                        })
                     
                     # Добавляем навигацию
                     for i, btn in enumerate(nav_row):
@@ -872,7 +874,8 @@ class ExchangePage(OneUserPage):
         # Проверяем, есть ли предложения с этим ресурсом
         exchanges = await get_exchanges(
             session_id=session_id,
-            sell_resource=resource_id
+            sell_resource=resource_id,
+            limit=1
         )
         
         if isinstance(exchanges, str) or not exchanges or len(exchanges) == 0:
@@ -887,6 +890,7 @@ class ExchangePage(OneUserPage):
         scene_data['filter_resource'] = resource_id
         scene_data['exchange_state'] = 'list'
         scene_data['list_page'] = 0
+        scene_data['list_cursors'] = [None]
         await self.scene.set_data('scene', scene_data)
         
         resource_name = self.item_filter.get_resource_name(resource_id)
@@ -901,6 +905,7 @@ class ExchangePage(OneUserPage):
         scene_data['filter_resource'] = None
         scene_data['exchange_state'] = 'list'
         scene_data['list_page'] = 0
+        scene_data['list_cursors'] = [None]
         await self.scene.set_data('scene', scene_data)
         
         await self.scene.update_message()
@@ -1150,6 +1155,7 @@ class ExchangePage(OneUserPage):
         # Успешное создание
         scene_data['exchange_state'] = 'list'
         scene_data['list_page'] = 0
+        scene_data['list_cursors'] = [None]
         scene_data['success_message'] = 'Предложение успешно создано!'
         
         # Очищаем данные создания
@@ -1250,6 +1256,7 @@ class ExchangePage(OneUserPage):
         scene_data = self.scene.get_data('scene')
         scene_data['exchange_state'] = 'list'
         scene_data['list_page'] = 0
+        scene_data['list_cursors'] = [None]
         scene_data['filter_page'] = 0
         scene_data['filter_resource'] = None
         scene_data['selected_exchange_id'] = None
@@ -3,7 +3,7 @@ from aiogram.types import CallbackQuery
 from oms.utils import callback_generator
 from global_modules.logs import Logger
 from global_modules.load_config import ALL_CONFIGS, Resources
-from modules.ws_client import company_complete_free_factories, get_factories, factory_set_auto, factory_recomplectation
+from modules.ws_client import company_complete_free_factories, get_factories, factories_bulk_rekit
 
 bot_logger = Logger.get_logger("bot")
 RESOURCES: Resources = ALL_CONFIGS["resources"]
@@ -134,24 +134,20 @@ class FactoryRekitProduce(Page):
             await callback.answer(f"❌ Недостаточно заводов! Доступно: {len(target_factories)}", show_alert=True)
             return
         
-        # Перекомплектуем и устанавливаем is_auto для каждого завода
+        # Перекомплектуем заводы группы и устанавливаем is_auto одним запросом
+        rekit_result = await factories_bulk_rekit(
+            company_id=company_id,
+            new_complectation=resource_key,
+            count=count,
+            find_complectation=None if group_type == 'idle' else group_type,
+            is_auto=is_auto
+        )
         success_count = 0
-        for i in range(min(count, len(target_factories))):
-            factory = target_factories[i]
-            factory_id = factory['id']
-            
-            # Перекомплектация
-            rekit_result = await factory_recomplectation(factory_id, resource_key)
-            if rekit_result and isinstance(rekit_result, dict) and rekit_result.get('success'):
-                # Устанавливаем is_auto
-                auto_result = await factory_set_auto(factory_id, is_auto)
-                if auto_result:
-                    success_count += 1
-                    bot_logger.info(f"Successfully recompleted and set is_auto={is_auto} for factory {factory_id}")
-                else:
-                    bot_logger.error(f"Failed to set is_auto for factory {factory_id}")
-            else:
-                bot_logger.error(f"Failed to recomplete factory {factory_id}: {rekit_result}")
+        if isinstance(rekit_result, dict) and 'error' not in rekit_result:
+            success_count = rekit_result.get('updated', 0)
+            bot_logger.info(f"Recompleted {success_count} factories with is_auto={is_auto}: {rekit_result.get('factory_ids')}")
+        else:
+            bot_logger.error(f"Failed to recomplete factories: {rekit_result}")
         
         if success_count > 0:
             resource = RESOURCES.get_resource(resource_key)
@@ -1,7 +1,7 @@
 from oms import Page
 from aiogram.types import CallbackQuery
 from oms.utils import callback_generator
-from modules.ws_client import factory_set_produce, get_factories
+from modules.ws_client import factories_bulk_set_produce, get_factories
 from modules.resources import get_resource
 
 
@@ -191,12 +191,9 @@ class FactoryStartGroups(Page):
             await callback.answer("❌ Нет заводов для запуска в этой группе", show_alert=True)
             return
         
-        # Запускаем заводы группы
-        success_count = 0
-        for factory_id in target_factories:
-            result = await factory_set_produce(factory_id, True)
-            if result:
-                success_count += 1
+        # Запускаем заводы группы одним запросом
+        result = await factories_bulk_set_produce(company_id, True, resource_key)
+        success_count = result.get('updated', 0) if isinstance(result, dict) else 0
         
         if success_count > 0:
             resource_display = self.get_resource_name(resource_key)
@@ -238,12 +235,9 @@ class FactoryStartGroups(Page):
             await callback.answer("❌ Нет заводов для запуска", show_alert=True)
             return
         
-        # Запускаем все (устанавливаем produce=True для каждого)
-        success_count = 0
-        for factory_id in target_factories:
-            result = await factory_set_produce(factory_id, True)
-            if result:
-                success_count += 1
+        # Запускаем все скомплектованные заводы одним запросом
+        result = await factories_bulk_set_produce(company_id, True)
+        success_count = result.get('updated', 0) if isinstance(result, dict) else 0
         
         if success_count > 0:
             await callback.answer(
@@ -1,7 +1,33 @@
+from bisect import bisect_right
+from functools import lru_cache
 from global_modules.load_config import Capital, ALL_CONFIGS
 
 CAPITAL: Capital = ALL_CONFIGS['capital']
 
+
+class ConditionTable:
+    """ Условия банка по репутации.
+        Диапазоны (не пересекаются) отсортированы по нижней границе,
+        условие находится двоичным поиском.
+    """
+
+    def __init__(self, conditions: list):
+        self.conditions = sorted(conditions, key=lambda c: c.on_reputation.min)
+        self.starts = [c.on_reputation.min for c in self.conditions]
+
+    def find(self, reputation: int):
+        """ Условие для репутации или None """
+        index = bisect_right(self.starts, reputation) - 1
+        if index < 0: return None
+
+        condition = self.conditions[index]
+        if reputation > condition.on_reputation.max: return None
+        return condition
+
+CREDIT_CONDITIONS = ConditionTable(CAPITAL.bank.credit.conditions)
+DEPOSIT_CONDITIONS = ConditionTable(CAPITAL.bank.contribution.conditions)
+
+
 def calc_credit(S: int, 
                 free: int, 
                 r_percent: float, T: int):
@@ -24,16 +50,31 @@ def calc_credit(S: int,
     pay_per_turn = total / T
     return int(total), int(pay_per_turn), extra
 
+@lru_cache(maxsize=4096)
+def credit_schedule(S: int, 
+                    free: int, 
+                    r_percent: float, T: int) -> tuple[int, ...]:
+    """ График платежей по кредиту (по правилам credits_step):
+        платёж хода i - остаток долга, делённый на оставшиеся ходы,
+        при условии, что каждый ход платится ровно начисленная сумма.
+        Сумма платежей равна total из calc_credit.
+    """
+    total, _, _ = calc_credit(S, free, r_percent, T)
+
+    payments, paid = [], 0
+    for steps_now in range(T):
+        payment = (total - paid) // max(1, T - steps_now)
+        payments.append(payment)
+        paid += payment
+    return tuple(payments)
+
 def get_credit_conditions(reputation: int):
     """ Получаем условия кредита в зависимости от репутации
     """
-    conditions = CAPITAL.bank.credit.conditions
-    for condition in conditions:
-        rep = condition.on_reputation
-        if rep.min <= reputation <= rep.max:
-            return condition
-
-    raise ValueError("No credit conditions found for the given reputation.")
+    condition = CREDIT_CONDITIONS.find(reputation)
+    if condition is None:
+        raise ValueError("No credit conditions found for the given reputation.")
+    return condition
 
 def check_max_credit_steps(credit_steps: int, 
                            step_now: int, max_steps: int):
@@ -63,13 +104,10 @@ def calc_deposit(S: int, r_percent: float, T: int):
 def get_deposit_conditions(reputation: int):
     """ Получаем условия вклада в зависимости от репутации
     """
-    conditions = CAPITAL.bank.contribution.conditions
-    for condition in conditions:
-        rep = condition.on_reputation
-        if rep.min <= reputation <= rep.max:
-            return condition
-
-    raise ValueError("No deposit conditions found for the given reputation.")
+    condition = DEPOSIT_CONDITIONS.find(reputation)
+    if condition is None:
+        raise ValueError("No deposit conditions found for the given reputation.")
+    return condition
 
 
 def check_max_deposit_steps(deposit_steps: int, 
@@ -80,3 +118,59 @@ def check_max_deposit_steps(deposit_steps: int,
     if step_now + deposit_steps > max_steps:
         return False
     return True
+
+
+# Пошаговые правила банка над столбцами (array) всех инструментов сессии.
+# Элемент i каждого столбца относится к одному кредиту / вкладу.
+
+def credits_step(total_to_pay, need_pay, paid, 
+                 steps_now, steps_total, max_overdue: int):
+    """ Ход по всем кредитам: начисляет плату за ход и сдвигает срок.
+        Столбцы need_pay и steps_now изменяются на месте.
+
+        return:
+            overdue - индексы просроченных кредитов (штраф репутации)
+            prison - индексы кредитов с просрочкой больше max_overdue
+    """
+    overdue, prison = [], []
+    for i in range(len(steps_now)):
+        now, total_steps = steps_now[i], steps_total[i]
+
+        if now < total_steps:
+            steps_left = max(1, total_steps - now)
+            need_pay[i] += (total_to_pay[i] - need_pay[i] - paid[i]) // steps_left
+            steps_now[i] = now + 1
+
+        elif now == total_steps:
+            # Последний ход - только сдвигаем срок
+            steps_now[i] = now + 1
+
+        else:
+            # Просрочка - срок больше не растёт
+            overdue.append(i)
+
+        if steps_now[i] - total_steps > max_overdue:
+            prison.append(i)
+
+    return overdue, prison
+
+
+def deposits_step(current_balance, total_earned, income_per_turn, 
+                  steps_now, steps_total):
+    """ Ход по всем вкладам: начисляет проценты на баланс вклада и сдвигает срок.
+        Столбцы current_balance, total_earned и steps_now изменяются на месте.
+
+        return:
+            matured - индексы вкладов с истёкшим сроком
+    """
+    matured = []
+    for i in range(len(steps_now)):
+        if steps_now[i] < steps_total[i]:
+            current_balance[i] += income_per_turn[i]
+            total_earned[i] += income_per_turn[i]
+
+        steps_now[i] += 1
+        if steps_now[i] >= steps_total[i]:
+            matured.append(i)
+
+    return matured
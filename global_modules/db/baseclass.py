@@ -27,6 +27,15 @@ class BaseClass:
                 data_to_save
                 )
 
+    async def save_fields(self, *fields: str):
+        """ Сохраняет в базу данных только указанные атрибуты объекта.
+            Остальные поля записи (например, изменённые через inc) не трогает.
+        """
+        await self.__db_object__.update(self.__tablename__,
+                {self.__unique_id__: self.__dict__[self.__unique_id__]},
+                {field: self.__dict__[field] for field in fields}
+                )
+
     async def insert(self):
         """ Вставляет текущие атрибуты объекта в базу данных.
         """
@@ -52,6 +61,22 @@ class BaseClass:
         await self.__db_object__.insert(self.__tablename__, data_to_save)
         await self.reupdate()
 
+    async def inc(self, increments: dict, 
+                  guard: Optional[dict] = None, 
+                  set_fields: Optional[dict] = None) -> bool:
+        """ Атомарно изменяет числовые поля объекта в базе данных 
+            и загружает в объект состояние после изменения.
+            Возвращает False, если guard не выполнен (объект не изменяется).
+        """
+        document = await self.__db_object__.inc(self.__tablename__, 
+                {self.__unique_id__: self.__dict__[self.__unique_id__]},
+                increments, guard, set_fields
+                )
+        if document is None: return False
+
+        self.load_from_base(document)
+        return True
+
     async def reupdate(self):
         """ Обновляет атрибуты объекта из базы данных.
         """
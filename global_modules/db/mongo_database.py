@@ -1,14 +1,30 @@
 import asyncio
-from typing import Any, Dict, List, Optional, Union, TYPE_CHECKING, Type
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar, Union, TYPE_CHECKING, Type
 from datetime import datetime
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase, AsyncIOMotorCollection
-from pymongo import IndexModel
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorClientSession, AsyncIOMotorDatabase, AsyncIOMotorCollection
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
 import os
 from copy import deepcopy
 
 if TYPE_CHECKING:
     from global_modules.db.baseclass import BaseClass
 
+T = TypeVar('T')
+
+
+class _TransactionState:
+    """Состояние текущей транзакции: сессия клиента и отложенные до коммита действия"""
+
+    def __init__(self, session: Optional[AsyncIOMotorClientSession]):
+        self.session = session
+        self.on_commit: List[Callable[[], Awaitable[Any]]] = []
+        self.on_rollback: List[Callable[[], Awaitable[Any]]] = []
+        # Записи, о которых хуки узнают только после коммита
+        self.writes: List[Dict[str, Any]] = []
+
+
 class MongoDatabase:
     """MongoDB база данных с использованием motor для асинхронных операций"""
     
@@ -25,6 +41,13 @@ class MongoDatabase:
         self.client: Optional[AsyncIOMotorClient] = None
         self.db: Optional[AsyncIOMotorDatabase] = None
         self._collections: Dict[str, AsyncIOMotorCollection] = {}
+        self._supports_transactions: Optional[bool] = None
+        # Текущая транзакция для задачи; операции внутри неё используют её сессию
+        self._transaction: ContextVar[Optional[_TransactionState]] = ContextVar(
+            f'{database_name}_transaction', default=None)
+        # Хуки записи и их таблицы (None - все): вызываются после каждой успешной записи
+        self._write_hooks: List[tuple[Callable[[Dict[str, Any]], None], 
+                                      Optional[frozenset]]] = []
         
         if auto_connect:
             asyncio.create_task(self.connect())
@@ -59,14 +82,182 @@ class MongoDatabase:
             self._collections[table_name] = self.db[table_name]
         return self._collections[table_name]
 
+    def _session(self) -> Optional[AsyncIOMotorClientSession]:
+        """Сессия текущей транзакции (None вне транзакции)"""
+        state = self._transaction.get()
+        return state.session if state else None
+
+    def add_write_hook(self, hook: Callable[[Dict[str, Any]], None],
+                       tables: Optional[Iterable[str]] = None):
+        """Регистрирует хук записи
+
+        hook(write) вызывается синхронно после каждой успешной записи
+        в таблицы tables (по умолчанию - во все), а внутри транзакции - 
+        после её коммита. write - словарь {"table", "op", "filter", "data"}, 
+        op: insert, set, inc, unset, delete. Для inc в "set" лежат поля, 
+        установленные тем же запросом, а в "session_id" - session_id 
+        изменённой записи.
+        """
+        self._write_hooks.append(
+            (hook, frozenset(tables) if tables is not None else None))
+
+    def _hooks_for(self, table_name: str) -> List[Callable[[Dict[str, Any]], None]]:
+        return [hook for hook, tables in self._write_hooks 
+                if tables is None or table_name in tables]
+
+    def _notify_write(self, table_name: str, op: str,
+                      conditions: Optional[Dict[str, Any]] = None,
+                      data: Any = None, **extra):
+        # Копия записи нужна только хукам этой таблицы
+        hooks = self._hooks_for(table_name)
+        if not hooks: return
+
+        write = deepcopy({"table": table_name, "op": op, 
+                          "filter": conditions, "data": data, **extra})
+        state = self._transaction.get()
+        if state is not None and state.session is not None:
+            state.writes.append(write)
+            return
+        for hook in hooks: hook(write)
+
+    def in_transaction(self) -> bool:
+        """Выполняется ли код внутри transaction()"""
+        return self._transaction.get() is not None
+
+    async def supports_transactions(self) -> bool:
+        """Поддерживает ли сервер транзакции (replica set или mongos)"""
+        if self.db is None:
+            await self.connect()
+
+        if self._supports_transactions is None:
+            hello = await self.client.admin.command('hello') # type: ignore
+            self._supports_transactions = (
+                'setName' in hello or hello.get('msg') == 'isdbgrid'
+            )
+            if not self._supports_transactions:
+                print("MongoDB запущена без replica set: транзакции выполняются без изоляции")
+        return self._supports_transactions
+
+    async def on_commit(self, callback: Callable[[], Awaitable[Any]]):
+        """Выполняет callback после успешного коммита текущей транзакции
+        (ошибка callback только логируется). Вне транзакции callback 
+        выполняется сразу.
+        """
+        state = self._transaction.get()
+        if state is None:
+            await callback()
+        else:
+            state.on_commit.append(callback)
+
+    async def on_rollback(self, callback: Callable[[], Awaitable[Any]]):
+        """Регистрирует компенсирующее действие для текущей транзакции.
+
+        Нужно только когда сервер не поддерживает транзакции: тогда при 
+        ошибке компенсации выполняются в обратном порядке. В настоящей 
+        транзакции и вне транзакции ничего не делает.
+        """
+        state = self._transaction.get()
+        if state is not None and state.session is None:
+            state.on_rollback.append(callback)
+
+    async def transaction(self, 
+                          func: Callable[[], Awaitable[T]], 
+                          max_retries: int = 5) -> T:
+        """Выполняет func в одной транзакции
+
+        Все операции MongoDatabase внутри func (в том числе через BaseClass) 
+        попадают в транзакцию. При TransientTransactionError транзакция 
+        повторяется целиком, поэтому func должна быть повторяемой. 
+        Любое исключение из func отменяет все изменения.
+
+        Вложенный вызов становится частью внешней транзакции. 
+        Если сервер не поддерживает транзакции, func выполняется как есть, 
+        а при ошибке выполняются компенсации из on_rollback.
+        """
+        if self._transaction.get() is not None:
+            return await func()
+
+        if not await self.supports_transactions():
+            state = _TransactionState(None)
+            token = self._transaction.set(state)
+            try:
+                result = await func()
+            except BaseException:
+                self._transaction.reset(token)
+                for callback in reversed(state.on_rollback): await callback()
+                raise
+            self._transaction.reset(token)
+            await self._run_on_commit(state)
+            return result
+
+        async with await self.client.start_session() as session: # type: ignore
+            attempt = 0
+            while True:
+                attempt += 1
+                state = _TransactionState(session)
+                token = self._transaction.set(state)
+                try:
+                    session.start_transaction()
+                    try:
+                        result = await func()
+                    except BaseException:
+                        if session.in_transaction:
+                            await session.abort_transaction()
+                        raise
+                    await self._commit_with_retry(session)
+
+                except PyMongoError as e:
+                    if e.has_error_label('TransientTransactionError') and attempt < max_retries:
+                        continue
+                    raise
+                finally:
+                    self._transaction.reset(token)
+
+                for write in state.writes:
+                    for hook in self._hooks_for(write["table"]): hook(write)
+                await self._run_on_commit(state)
+                return result
+
+    async def _run_on_commit(self, state: _TransactionState):
+        """Выполняет действия после коммита. Данные уже зафиксированы, поэтому
+        ошибка одного действия не отменяет остальные и не уходит вызывающему
+        """
+        for callback in state.on_commit:
+            try:
+                await callback()
+            except Exception as e:
+                print(f"Ошибка действия после коммита транзакции: {e!r}")
+
+    async def _commit_with_retry(self, session: AsyncIOMotorClientSession):
+        """Коммит с повтором при UnknownTransactionCommitResult"""
+        while True:
+            try:
+                await session.commit_transaction()
+                return
+            except PyMongoError as e:
+                if e.has_error_label('UnknownTransactionCommitResult'):
+                    continue
+                raise
+
     async def create_table(self, table_name: str, indexes: Optional[List[str]] = None):
-        """Создаёт новую коллекцию с индексами"""
+        """Создаёт новую коллекцию с индексами
+
+        indexes - список полей, по каждому создаётся восходящий индекс. 
+        Составной индекс задаётся строкой через запятую: "session_id,id"
+        """
         if self.db is None:
             raise RuntimeError("Database not connected")
 
         if table_name not in await self.db.list_collection_names():
             await self.db.create_collection(table_name)
 
+        if indexes:
+            collection = self._get_collection(table_name)
+            await collection.create_indexes([
+                IndexModel([(field.strip(), 1) for field in index.split(',')])
+                for index in indexes
+            ])
+
     async def insert(self, table_name: str, record: Dict[str, Any]) -> int:
         """Вставляет запись в коллекцию"""
         if self.db is None:
@@ -85,24 +276,47 @@ class MongoDatabase:
         record['updated_at'] = datetime.now()
 
         # Вставляем запись
-        result = await collection.insert_one(record)
+        result = await collection.insert_one(record, session=self._session())
+        self._notify_write(table_name, "insert", data=record)
         return record['id']
 
+    async def insert_many(self, table_name: str, records: List[Dict[str, Any]]) -> int:
+        """Вставляет много записей одним запросом (без автоматических полей)"""
+        if self.db is None:
+            await self.connect()
+
+        if not records: return 0
+
+        collection = self._get_collection(table_name)
+        result = await collection.insert_many(
+            records, ordered=True, session=self._session())
+        for record in records:
+            self._notify_write(table_name, "insert", data=record)
+        return len(result.inserted_ids)
+
     async def find(self, 
                    table_name: str, 
                    to_class: Optional[Type['BaseClass']] = None,
                    limit: Optional[int] = None,
                    skip: Optional[int] = None,
                    sort: Optional[List[tuple]] = None,
+                   projection: Optional[List[str]] = None,
                    **conditions) -> List[Union[Dict[str, Any], 'BaseClass']]:
-        """Находит записи по условиям"""
+        """Находит записи по условиям
+
+        projection - список полей, которые нужно вернуть (остальные не загружаются)
+        """
         if self.db is None:
             await self.connect()
             
         collection = self._get_collection(table_name)
         
         # Создаём запрос
-        cursor = collection.find(conditions)
+        cursor = collection.find(
+            conditions, 
+            {field: 1 for field in projection} if projection else None,
+            session=self._session()
+        )
         
         # Применяем сортировку
         if sort:
@@ -139,7 +353,7 @@ class MongoDatabase:
             await self.connect()
 
         collection = self._get_collection(table_name)
-        document = await collection.find_one(conditions)
+        document = await collection.find_one(conditions, session=self._session())
 
         if not document:
             return None
@@ -181,18 +395,103 @@ class MongoDatabase:
         # Обновляем записи
         result = await collection.update_many(
             conditions, 
-            {'$set': updates}
+            {'$set': updates},
+            session=self._session()
         )
+        self._notify_write(table_name, "set", conditions, updates)
         
         return result.modified_count
 
+    async def inc(self, 
+                  table_name: str, 
+                  conditions: Dict[str, Any], 
+                  increments: Dict[str, Union[int, float]],
+                  guard: Optional[Dict[str, Any]] = None,
+                  set_fields: Optional[Dict[str, Any]] = None
+                  ) -> Optional[Dict[str, Any]]:
+        """Атомарно изменяет числовые поля одной записи ($inc)
+
+        guard - дополнительные условия, которые должны выполняться в момент 
+        изменения, например {"balance": {"$gte": 100}}.
+        set_fields - поля, которые нужно установить тем же запросом.
+
+        Возвращает документ после изменения или None, если запись 
+        не найдена или guard не выполнен.
+        """
+        if self.db is None:
+            await self.connect()
+
+        if not increments:
+            raise ValueError("increments cannot be empty")
+
+        collection = self._get_collection(table_name)
+
+        query = dict(conditions)
+        if guard: query.update(guard)
+
+        sets = dict(set_fields or {})
+        sets['updated_at'] = datetime.now()
+
+        document = await collection.find_one_and_update(
+            query,
+            {'$inc': increments, '$set': sets},
+            return_document=ReturnDocument.AFTER,
+            session=self._session()
+        )
+        if document is not None:
+            self._notify_write(table_name, "inc", conditions, 
+                               increments, set=sets, 
+                               session_id=document.get("session_id"))
+        return document
+
+    async def unset(self, 
+                    table_name: str, 
+                    conditions: Dict[str, Any], 
+                    fields: List[str]) -> int:
+        """Удаляет поля у записей ($unset)"""
+        if self.db is None:
+            await self.connect()
+
+        collection = self._get_collection(table_name)
+        result = await collection.update_many(
+            conditions,
+            {'$unset': {field: "" for field in fields}},
+            session=self._session()
+        )
+        self._notify_write(table_name, "unset", conditions, fields)
+        return result.modified_count
+
+    async def bulk_update(self, 
+                          table_name: str, 
+                          updates: List[tuple]) -> int:
+        """Обновляет много записей одним запросом
+
+        updates - список пар (conditions, updates), updates применяются через $set
+        """
+        if self.db is None:
+            await self.connect()
+
+        if not updates: return 0
+
+        collection = self._get_collection(table_name)
+        now = datetime.now()
+        result = await collection.bulk_write([
+            UpdateOne(conditions, {'$set': {**fields, 'updated_at': now}})
+            for conditions, fields in updates
+        ], ordered=False, session=self._session())
+        for conditions, fields in updates:
+            self._notify_write(table_name, "set", conditions, 
+                               {**fields, 'updated_at': now})
+        return result.modified_count
+
     async def delete(self, table_name: str, **conditions) -> int:
         """Удаляет записи"""
         if self.db is None:
             await self.connect()
             
         collection = self._get_collection(table_name)
-        result = await collection.delete_many(conditions)
+        result = await collection.delete_many(conditions, session=self._session())
+        self._notify_write(table_name, "delete", conditions)
         return result.deleted_count
 
     async def count(self, table_name: str, **conditions) -> int:
@@ -201,7 +500,19 @@ class MongoDatabase:
             await self.connect()
             
         collection = self._get_collection(table_name)
-        return await collection.count_documents(conditions)
+        return await collection.count_documents(conditions, session=self._session())
+
+    async def count_by(self, table_name: str, field: str, **conditions) -> Dict[Any, int]:
+        """Считает количество записей, сгруппированных по полю, одним запросом"""
+        if self.db is None:
+            await self.connect()
+
+        collection = self._get_collection(table_name)
+        cursor = collection.aggregate([
+            {'$match': conditions},
+            {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}}
+        ], session=self._session())
+        return {doc['_id']: doc['count'] async for doc in cursor}
 
     async def get_tables(self) -> List[str]:
         """Возвращает список коллекций"""
@@ -242,7 +553,7 @@ class MongoDatabase:
         collection = self._get_collection(table_name)
 
         # Ищем документ с максимальным id
-        cursor = collection.find().sort([('id', -1)]).limit(1)
+        cursor = collection.find(session=self._session()).sort([('id', -1)]).limit(1)
         result = await cursor.to_list(length=1)
         
         if result:
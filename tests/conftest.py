@@ -0,0 +1,62 @@
+""" Тесты API на настоящей MongoDB.
+
+    Запуск (replica set из одного узла, чтобы работали транзакции):
+
+        docker compose -f docker-compose.test.yml up -d
+        pip install -r requirements.txt pytest
+        MONGODB_URL="mongodb://localhost:27018/?directConnection=true" python -m pytest tests
+
+    На MongoDB без replica set те же тесты проверяют компенсации on_rollback.
+
+    Тесты пишут в отдельную базу MONGODB_DATABASE (по умолчанию
+    api_test_database), которая удаляется после запуска. Без motor
+    или без доступной базы тесты пропускаются.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(ROOT), str(ROOT / "api")]
+os.environ.setdefault("MONGODB_DATABASE", "api_test_database")
+
+
+@pytest.fixture(scope="session")
+def loop(tmp_path_factory):
+    """ Один цикл событий на все тесты: клиент motor привязан к циклу """
+    pytest.importorskip("motor")
+
+    # Логгеры создают папку logs в текущей директории
+    os.chdir(tmp_path_factory.mktemp("run"))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def connect():
+        from modules.db import just_db
+        try:
+            await asyncio.wait_for(just_db.connect(), 5)
+        except Exception as e:
+            pytest.skip(f"MongoDB недоступна: {e}")
+        await just_db.drop_all()
+        return just_db
+
+    db = loop.run_until_complete(connect())
+    yield loop
+
+    loop.run_until_complete(db.drop_all())
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    """ run(coro) - выполнить корутину в общем цикле """
+    return loop.run_until_complete
+
+
+@pytest.fixture
+def db(loop):
+    from modules.db import just_db
+    return just_db
@@ -0,0 +1,169 @@
+""" Столбцовые правила банка (global_modules.bank) дают те же результаты,
+    что прежние пошаговые циклы компании credit_paid_step и
+    deposit_income_step (скопированы ниже как эталон). База не нужна.
+"""
+import copy
+import random
+from array import array
+
+import pytest
+
+from global_modules.bank import credits_step, deposits_step
+
+MAX_OVERDUE = 3
+
+CREDIT_FIELDS = ("total_to_pay", "need_pay", "paid", "steps_now", "steps_total")
+DEPOSIT_FIELDS = ("current_balance", "total_earned", "income_per_turn",
+                  "steps_now", "steps_total")
+
+
+def credit_paid_step(credits: list[dict], max_overdue: int):
+    """ Эталон: Company.credit_paid_step. Вместо remove_reputation и
+        to_prison возвращает индексы кредитов, по которым они вызывались
+    """
+    overdue, prison = [], []
+    for index, credit in enumerate(credits):
+
+        if credit["steps_now"] < credit["steps_total"]:
+            steps_left = max(1, credit["steps_total"] - credit["steps_now"])
+            credit["need_pay"] += (credit["total_to_pay"] - credit['need_pay'] - credit ['paid']) // steps_left
+            credit["steps_now"] += 1
+
+        elif credit["steps_now"] == credit["steps_total"]:
+            credit["steps_now"] += 1
+
+        elif credit["steps_now"] > credit["steps_total"]:
+            overdue.append(index)
+
+        if credit["steps_now"] - credit["steps_total"] > max_overdue:
+            prison.append(index)
+
+    return overdue, prison
+
+
+def deposit_income_step(deposits: list[dict]):
+    """ Эталон: Company.deposit_income_step. Вместо withdraw_deposit
+        возвращает индексы вкладов, которые снимались бы
+    """
+    matured = []
+    for index, deposit in enumerate(deposits):
+        if deposit["steps_now"] < deposit["steps_total"]:
+            deposit["current_balance"] += deposit["income_per_turn"]
+            deposit["total_earned"] += deposit["income_per_turn"]
+
+        deposit["steps_now"] += 1
+
+        if deposit["steps_now"] >= deposit["steps_total"]:
+            matured.append(index)
+
+    return matured
+
+
+def columns(docs: list[dict], fields: tuple[str, ...]) -> dict[str, array]:
+    return {field: array('q', (doc[field] for doc in docs)) for field in fields}
+
+
+def rows(cols: dict[str, array], fields: tuple[str, ...]) -> list[dict]:
+    return [{field: cols[field][i] for field in fields}
+            for i in range(len(cols[fields[0]]))]
+
+
+def random_credit(rng: random.Random) -> dict:
+    steps_total = rng.randint(1, 10)
+    total = rng.randint(0, 10_000)
+    return {
+        "total_to_pay": total,
+        "need_pay": rng.randint(0, total),
+        "paid": rng.randint(0, total),
+        # До срока, последний ход, просрочка и просрочка сверх лимита
+        "steps_now": rng.randint(0, steps_total + MAX_OVERDUE + 3),
+        "steps_total": steps_total
+    }
+
+
+def random_deposit(rng: random.Random) -> dict:
+    steps_total = rng.randint(1, 10)
+    return {
+        "current_balance": rng.randint(0, 10_000),
+        "total_earned": rng.randint(0, 1_000),
+        "income_per_turn": rng.randint(0, 500),
+        "steps_now": rng.randint(0, steps_total + 2),
+        "steps_total": steps_total
+    }
+
+
+def check_credits(docs: list[dict]):
+    expected = copy.deepcopy(docs)
+    expected_overdue, expected_prison = credit_paid_step(expected, MAX_OVERDUE)
+
+    cols = columns(docs, CREDIT_FIELDS)
+    overdue, prison = credits_step(
+        cols["total_to_pay"], cols["need_pay"], cols["paid"],
+        cols["steps_now"], cols["steps_total"], MAX_OVERDUE)
+
+    assert rows(cols, CREDIT_FIELDS) == expected
+    assert overdue == expected_overdue
+    assert prison == expected_prison
+
+
+def check_deposits(docs: list[dict]):
+    expected = copy.deepcopy(docs)
+    expected_matured = deposit_income_step(expected)
+
+    cols = columns(docs, DEPOSIT_FIELDS)
+    matured = deposits_step(
+        cols["current_balance"], cols["total_earned"], cols["income_per_turn"],
+        cols["steps_now"], cols["steps_total"])
+
+    assert rows(cols, DEPOSIT_FIELDS) == expected
+    assert matured == expected_matured
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_credits_match_reference(seed):
+    rng = random.Random(seed)
+    check_credits([random_credit(rng) for _ in range(rng.randint(0, 30))])
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_deposits_match_reference(seed):
+    rng = random.Random(seed)
+    check_deposits([random_deposit(rng) for _ in range(rng.randint(0, 30))])
+
+
+def test_credit_cases():
+    base = {"total_to_pay": 900, "need_pay": 100, "paid": 100, "steps_total": 5}
+    docs = [
+        {**base, "steps_now": 2},                   # до срока
+        {**base, "steps_now": 5},                   # последний ход
+        {**base, "steps_now": 6},                   # просрочка
+        {**base, "steps_now": 5 + MAX_OVERDUE},     # просрочка на границе
+        {**base, "steps_now": 6 + MAX_OVERDUE},     # тюрьма
+        {**base, "steps_total": 0, "steps_now": 0}, # нулевой срок
+    ]
+    check_credits(docs)
+
+    cols = columns(docs, CREDIT_FIELDS)
+    overdue, prison = credits_step(
+        cols["total_to_pay"], cols["need_pay"], cols["paid"],
+        cols["steps_now"], cols["steps_total"], MAX_OVERDUE)
+    assert overdue == [2, 3, 4]
+    assert prison == [4]
+
+
+def test_deposit_cases():
+    base = {"current_balance": 1000, "total_earned": 0,
+            "income_per_turn": 50, "steps_total": 3}
+    docs = [
+        {**base, "steps_now": 0}, # до срока
+        {**base, "steps_now": 2}, # срок истекает на этом ходу
+        {**base, "steps_now": 3}, # срок истёк, вклад не снят (тюрьма)
+    ]
+    check_deposits(docs)
+
+    cols = columns(docs, DEPOSIT_FIELDS)
+    matured = deposits_step(
+        cols["current_balance"], cols["total_earned"], cols["income_per_turn"],
+        cols["steps_now"], cols["steps_total"])
+    assert matured == [1, 2]
+    assert list(cols["current_balance"]) == [1050, 1050, 1000]
@@ -0,0 +1,157 @@
+""" Параллельные изменения баланса, склада и репутации компании и покупки
+    одного предложения не теряют друг друга (атомарные $inc с условиями).
+"""
+import asyncio
+
+
+async def new_company(db, **fields) -> int:
+    """ Компания без сессии: для inc-операций сессия не нужна """
+    return await db.insert("companies", {
+        "session_id": "atomic-test", "name": "Atomic",
+        "balance": 0, "reputation": 0, "warehouses": {},
+        "this_turn_income": 0, "tax_debt": 0, "overdue_steps": 0,
+        **fields
+    })
+
+
+async def loaded(company_id: int):
+    """ Отдельная копия компании для каждой задачи (у каждой свой снимок) """
+    from game.company import Company
+    return await Company(id=company_id).reupdate()
+
+
+def test_concurrent_balance(run, db):
+    async def scenario():
+        company_id = await new_company(db, balance=1000)
+
+        async def add():
+            await (await loaded(company_id)).add_balance(10)
+
+        async def remove():
+            await (await loaded(company_id)).remove_balance(5)
+
+        await asyncio.gather(*(
+            add() if i % 2 else remove() for i in range(50)))
+
+        company = await loaded(company_id)
+        assert company.balance == 1000 + 25 * 10 - 25 * 5
+        assert company.this_turn_income == 25 * 10
+
+    run(scenario())
+
+
+def test_concurrent_balance_guard(run, db):
+    """ Списаний больше, чем денег: проходят ровно те, на которые хватает """
+    async def scenario():
+        company_id = await new_company(db, balance=100)
+
+        async def remove():
+            try:
+                await (await loaded(company_id)).remove_balance(7)
+                return True
+            except ValueError:
+                return False
+
+        results = await asyncio.gather(*(remove() for _ in range(50)))
+
+        company = await loaded(company_id)
+        assert sum(results) == 100 // 7
+        assert company.balance == 100 % 7
+
+    run(scenario())
+
+
+def test_concurrent_warehouse(run, db):
+    async def scenario():
+        company_id = await new_company(db, warehouses={"wood": 100})
+
+        async def add():
+            await (await loaded(company_id)).add_resource(
+                "wood", 3, ignore_space=True)
+
+        async def remove():
+            try:
+                await (await loaded(company_id)).remove_resource("wood", 4)
+                return 4
+            except ValueError:
+                return 0
+
+        results = await asyncio.gather(*(
+            add() if i % 2 else remove() for i in range(50)))
+
+        company = await loaded(company_id)
+        removed = sum(r for r in results if r)
+        assert company.warehouses.get("wood", 0) == 100 + 25 * 3 - removed
+        assert company.warehouses.get("wood", 0) >= 0
+
+    run(scenario())
+
+
+def test_reputation_keeps_concurrent_balance(run, db):
+    """ remove_reputation не перезаписывает баланс из устаревшей копии """
+    async def scenario():
+        company_id = await new_company(db, balance=0, reputation=1000)
+
+        async def add():
+            await (await loaded(company_id)).add_balance(10)
+
+        async def lose():
+            await (await loaded(company_id)).remove_reputation(1)
+
+        await asyncio.gather(*(
+            add() if i % 2 else lose() for i in range(50)))
+
+        company = await loaded(company_id)
+        assert company.balance == 25 * 10
+        assert company.reputation == 1000 - 25
+
+    run(scenario())
+
+
+def test_concurrent_offer_buy(run, db):
+    """ 50 параллельных покупок одного предложения: товар не продаётся 
+        сверх запаса, деньги покупателей и продавца сохраняются
+    """
+    async def scenario():
+        from game.exchange import Exchange
+        from game.session import session_manager
+
+        session = await session_manager.create_session("atomic-exchange")
+        try:
+            seller_id = await new_company(
+                db, session_id=session.session_id, cell_position="0.0")
+            buyers = [await new_company(
+                db, session_id=session.session_id, balance=1000, 
+                cell_position=f"{i + 1}.{i + 1}") for i in range(5)]
+            offer_id = await db.insert("exchanges", {
+                "session_id": session.session_id, "company_id": seller_id,
+                "sell_resource": "wood", "sell_amount_per_trade": 2, 
+                "total_stock": 60, "offer_type": "money", "price": 50, 
+                "barter_resource": "", "barter_amount": 0})
+
+            async def buy(i: int) -> int:
+                quantity = i % 2 + 1
+                try:
+                    offer = await Exchange(id=offer_id).reupdate()
+                    await offer.buy(buyers[i % len(buyers)], quantity)
+                    return quantity
+                except ValueError:
+                    return 0
+
+            bought = sum(await asyncio.gather(*(buy(i) for i in range(50))))
+
+            offer = await db.find_one("exchanges", id=offer_id)
+            stock = offer["total_stock"] if offer else 0
+            assert 0 < bought <= 30
+            assert stock == 60 - 2 * bought
+
+            companies = [await loaded(i) for i in (seller_id, *buyers)]
+            assert sum(c.balance for c in companies) == 5 * 1000
+            assert companies[0].balance == 50 * bought
+
+            shipped = await db.find("logistics", from_company_id=seller_id)
+            assert sum(s["amount"] for s in shipped) == 2 * bought
+        finally:
+            await session.delete()
+
+    run(scenario())
@@ -0,0 +1,40 @@
+""" Записи журнала вне смены хода (действия игроков) получают сессию
+    объекта, даже если в условиях записи нет session_id.
+"""
+
+
+def test_player_writes_get_session(run, db):
+    async def scenario():
+        from game.company import Company
+        from game.journal import JOURNAL_TABLE, journal, rebuild
+
+        await journal.start()
+        try:
+            company_id = await db.insert("companies", {
+                "session_id": "journal-test", "name": "Journal", "balance": 0})
+            company = await Company(id=company_id).reupdate()
+
+            await company.inc({"balance": 10})
+            company.name = "Renamed"
+            await company.save_fields("name")
+
+            # Кэш сессий потерян (например, после перезапуска)
+            journal._sessions.clear()
+            await company.save_fields("balance")
+            await journal.flush()
+
+            journal._sessions.clear()
+            await db.delete("companies", id=company_id)
+            await journal.flush()
+        finally:
+            await journal.stop()
+
+        entries = await db.find(
+            JOURNAL_TABLE, entity=f"companies:{company_id}", sort=[("seq", 1)])
+        assert [e["op"] for e in entries] == ["insert", "inc", "set", "set", "delete"]
+        assert all(e["session_id"] == "journal-test" for e in entries)
+
+        engine = await rebuild("journal-test")
+        assert engine.state().get("companies", []) == []
+
+    run(scenario())
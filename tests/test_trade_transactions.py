@@ -0,0 +1,133 @@
+""" Сделка, упавшая на середине, не оставляет следов: в replica set
+    её откатывает транзакция, без replica set - компенсации on_rollback.
+"""
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def market(run, db):
+    """ Сессия с продавцом, покупателем, городом и денежным предложением """
+    async def build():
+        from game.session import session_manager
+
+        session = await session_manager.create_session("trade-test")
+        seller = await db.insert("companies", {
+            "session_id": session.session_id, "name": "Seller",
+            "balance": 0, "reputation": 20, "cell_position": "0.0",
+            "warehouses": {"wood": 10}, "this_turn_income": 0, "economic_power": 0})
+        buyer = await db.insert("companies", {
+            "session_id": session.session_id, "name": "Buyer",
+            "balance": 1000, "reputation": 20, "cell_position": "2.2",
+            "warehouses": {}, "this_turn_income": 0, "economic_power": 0})
+        city = await db.insert("cities", {
+            "session_id": session.session_id, "name": "City", "cell_position": "4.4",
+            "branch": "wood", "demands": {"wood": {"amount": 5, "price": 30}}})
+        offer = await db.insert("exchanges", {
+            "session_id": session.session_id, "company_id": seller,
+            "sell_resource": "wood", "sell_amount_per_trade": 2, "total_stock": 6,
+            "offer_type": "money", "price": 50, "barter_resource": "", "barter_amount": 0})
+        return session, seller, buyer, city, offer
+
+    session, *ids = run(build())
+    yield ids
+
+    run(session.delete())
+
+
+async def company(company_id: int):
+    from game.company import Company
+    return await Company(id=company_id).reupdate()
+
+
+def test_sell_resource_closed_demand_keeps_goods(run, db, market):
+    seller_id, _, city_id, _ = market
+
+    async def scenario():
+        from game.citie import Citie
+
+        city = await Citie(id=city_id).reupdate()
+
+        async def closed(*args, **kwargs):
+            return False
+        city.inc = closed # спрос закрыт параллельной продажей
+
+        with pytest.raises(ValueError):
+            await city.sell_resource(seller_id, "wood", 5)
+
+        assert (await company(seller_id)).warehouses["wood"] == 10
+        assert await db.count("logistics", from_company_id=seller_id) == 0
+
+    run(scenario())
+
+
+def test_sell_resource_concurrent(run, db, market):
+    """ Две продажи на весь спрос: проходит одна, товар второй остаётся """
+    seller_id, _, city_id, _ = market
+
+    async def scenario():
+        from game.citie import Citie
+
+        async def sell():
+            city = await Citie(id=city_id).reupdate()
+            try:
+                await city.sell_resource(seller_id, "wood", 5)
+                return True
+            except ValueError:
+                return False
+
+        results = await asyncio.gather(sell(), sell())
+        assert sum(results) == 1
+
+        city = await Citie(id=city_id).reupdate()
+        assert "wood" not in city.demands
+        assert (await company(seller_id)).warehouses["wood"] == 5
+        assert await db.count("logistics", from_company_id=seller_id) == 1
+
+    run(scenario())
+
+
+def test_exchange_buy_rolls_back(run, db, market, monkeypatch):
+    """ Ошибка зачисления продавцу возвращает деньги покупателю и запас предложению """
+    seller_id, buyer_id, _, offer_id = market
+
+    async def scenario():
+        from game.company import Company
+        from game.exchange import Exchange
+
+        async def broken(self, amount, income_percent=1.0):
+            raise RuntimeError("seller is unavailable")
+        monkeypatch.setattr(Company, "add_balance", broken)
+
+        offer = await Exchange(id=offer_id).reupdate()
+        with pytest.raises(RuntimeError):
+            await offer.buy(buyer_id, 2)
+
+        assert (await company(buyer_id)).balance == 1000
+        assert (await company(seller_id)).balance == 0
+        assert (await Exchange(id=offer_id).reupdate()).total_stock == 6
+        assert await db.count("logistics", to_company_id=buyer_id) == 0
+
+    run(scenario())
+
+
+def test_market_buy_failure_keeps_offers(run, db, market, monkeypatch):
+    """ Упавшая рыночная покупка не удаляет выкупленные предложения """
+    seller_id, buyer_id, _, offer_id = market
+
+    async def scenario():
+        from game.company import Company
+        from game.exchange import Exchange
+
+        async def broken(self, amount, income_percent=1.0):
+            raise RuntimeError("seller is unavailable")
+        monkeypatch.setattr(Company, "add_balance", broken)
+
+        with pytest.raises(RuntimeError):
+            await Exchange.market_buy("trade-test", buyer_id, "wood", 6)
+
+        offer = await db.find_one("exchanges", id=offer_id)
+        assert offer is not None and offer["total_stock"] == 6
+        assert (await company(buyer_id)).balance == 1000
+
+    run(scenario())
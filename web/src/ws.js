@@ -1093,6 +1093,10 @@ export class WebSocketManager {
         break;
         
       case 'api-factory-start-complectation':
+      case 'api-factories-bulk-complectation':
+      case 'api-factories-bulk-produce':
+      case 'api-factories-bulk-auto':
+      case 'api-factories_turn':
         // Refresh factories if we have a company
         if (this.gameState.hasCompany) {
           this.get_factories(this.gameState.state.currentUser.company_id);
@@ -1135,6 +1139,7 @@ export class WebSocketManager {
       case 'api-contract_declined':
       case 'api-contract_cancelled':
       case 'api-contract_deleted':
+      case 'api-contracts_settled':
         // Refresh contracts and companies
         this.get_contracts();
         this.get_companies();